@@ -5,12 +5,6 @@
 """
 InVirtualEnv Python Virtualenv Installer Module
 """
-try:
-    import pkg_resources
-    __version__: str = pkg_resources.get_distribution("invirtualenv").version
-except ImportError:
-    ___version__ = '0.0.0'
-
 __copyright__ = "Copyright 2016, Yahoo Inc."
 __all__ = [
     'config',
@@ -23,3 +17,27 @@ __all__ = [
     'utility',
     'virtualenv'
 ]
+
+
+def _get_version():
+    try:
+        from importlib.metadata import version
+        return version("invirtualenv")
+    except ImportError:  # pragma: no cover
+        pass
+    try:  # pragma: no cover
+        import pkg_resources
+        return pkg_resources.get_distribution("invirtualenv").version
+    except ImportError:  # pragma: no cover
+        return '0.0.0'
+
+
+def __getattr__(name):
+    # The version is looked up the first time it is used, reading the
+    # distribution metadata is a large part of the time it takes to import
+    # the package.
+    if name == '__version__':
+        global __version__  # pylint: disable=W0601
+        __version__ = _get_version()
+        return __version__
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
@@ -0,0 +1,178 @@
+# Copyright (c) 2016, Yahoo Inc.
+# Copyrights licensed under the BSD License
+# See the accompanying LICENSE.txt file for terms.
+
+"""
+Cache of the outputs of the package generation stages, keyed by a content
+hash of the stage inputs
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from .utility import read_json_file
+from .wheelhouse import hash_files
+
+
+logger = logging.getLogger(__name__)  # pylint: disable=C0103
+
+
+OUTPUTS_FILENAME = 'outputs.json'
+FILES_DIRECTORY = 'files'
+
+
+def content_digest(paths, root=None):
+    """
+    Get a digest of the contents of files and directories
+
+    Parameters
+    ----------
+    paths : list
+        The files and directories to include, directories are included
+        recursively.  Paths that don't exist are included by name.
+
+    root : str, optional
+        The paths are recorded relative to this directory, so the digest
+        doesn't depend on where the files are
+
+    Returns
+    -------
+    str
+        Hex digest
+    """
+    filenames = []
+    missing = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in os.walk(path):
+                filenames += [os.path.join(directory, name) for name in names]
+        elif os.path.exists(path):
+            filenames.append(path)
+        else:
+            missing.append(path)
+    hashes = hash_files(filenames)
+    entries = []
+    for filename in filenames:
+        name = os.path.relpath(filename, root) if root else filename
+        entries.append([name, os.path.islink(filename), hashes[filename]])
+    return hashlib.sha256(json.dumps([sorted(entries), sorted(missing)]).encode()).hexdigest()
+
+
+class BuildCache(object):
+    """
+    A cache of package generation stage outputs
+
+    Each entry holds the json serializable outputs of a stage and copies of
+    the files it generated.  Entries are written to a temporary directory and
+    renamed into place, so the cache directory can be shared between build
+    hosts, on NFS for example.
+
+    Parameters
+    ----------
+    directory : str
+        The cache directory
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    @staticmethod
+    def key(stage, inputs):
+        """
+        Get the cache key for a stage
+
+        Parameters
+        ----------
+        stage : str
+            The stage name
+
+        inputs : object
+            Json serializable value containing everything the stage outputs
+            depend on
+
+        Returns
+        -------
+        str
+            The cache key
+        """
+        return hashlib.sha256(json.dumps([stage, inputs], sort_keys=True).encode()).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def restore(self, key, build_dir):
+        """
+        Restore the outputs of a stage
+
+        Parameters
+        ----------
+        key : str
+            The cache key
+
+        build_dir : str
+            The directory to copy the cached files to
+
+        Returns
+        -------
+        dict
+            The stage outputs or None if the stage isn't cached
+        """
+        entry = self._entry(key)
+        outputs = read_json_file(os.path.join(entry, OUTPUTS_FILENAME))
+        if outputs is None:
+            return None
+        files_directory = os.path.join(entry, FILES_DIRECTORY)
+        for name in sorted(os.listdir(files_directory)):
+            source = os.path.join(files_directory, name)
+            dest = os.path.join(build_dir, name)
+            if os.path.isdir(source):
+                shutil.copytree(source, dest, symlinks=True, dirs_exist_ok=True)
+            else:
+                shutil.copyfile(source, dest)
+        logger.debug('Restored cached build outputs %r', entry)
+        return outputs
+
+    def save(self, key, outputs, files=None):
+        """
+        Store the outputs of a stage
+
+        Parameters
+        ----------
+        key : str
+            The cache key
+
+        outputs : dict
+            The json serializable stage outputs
+
+        files : dict, optional
+            Dictionary of the name to restore each file or directory as and
+            its path
+        """
+        entry = self._entry(key)
+        if os.path.exists(entry):
+            return
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            temp_entry = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix='.' + key[:8])
+        except OSError:  # pragma: no cover
+            logger.debug('Unable to write to the build cache directory %r', self.directory)
+            return
+        try:
+            files_directory = os.path.join(temp_entry, FILES_DIRECTORY)
+            os.makedirs(files_directory)
+            for name, path in (files or {}).items():
+                if os.path.isdir(path):
+                    shutil.copytree(path, os.path.join(files_directory, name), symlinks=True)
+                else:
+                    shutil.copyfile(path, os.path.join(files_directory, name))
+            with open(os.path.join(temp_entry, OUTPUTS_FILENAME), 'w') as outputs_handle:
+                json.dump(outputs, outputs_handle)
+            os.rename(temp_entry, entry)
+            logger.debug('Stored build outputs in %r', entry)
+        except OSError:
+            # Another build stored the same entry first or the cache is not writable
+            logger.debug('Unable to store build outputs in %r', entry)
+        finally:
+            if os.path.exists(temp_entry):
+                shutil.rmtree(temp_entry, ignore_errors=True)
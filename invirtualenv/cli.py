@@ -4,13 +4,12 @@ Command line interface to invirtualenv v2
 import argparse
 import logging
 import os
-import shutil
 import sys
-from . import __version__ as invirtualenv_version
-from .config import get_configuration_dict
+from .config import Configuration
 from .contextmanager import InTemporaryDirectory
 from .exceptions import PackageGenerationFailure
-from .plugin import create_package, create_package_configuration, get_package_plugin, package_formats
+from .plugin import create_package, create_package_configuration, create_packages, get_package_plugin, package_formats
+from .utility import move_file, scratch_directory
 
 
 logger_name = os.path.basename(sys.argv[0]) if __name__ == '__main__' else __name__
@@ -28,10 +27,39 @@ logging.basicConfig(level=log_level, format='%(asctime)s %(levelname)-5s [%(file
 LOGGER = logging.getLogger(logger_name)
 
 
+class PackageFormatChoices(object):
+    """
+    The package types that can be created on the current system, as an
+    argparse choices container.
+
+    Finding the package types loads the plugins, so it is deferred until
+    argparse checks or displays a package type argument.  Commands that don't
+    take a package type never load the plugins.  Arguments using this need a
+    metavar, otherwise argparse lists the choices when the argument is added.
+    """
+    def __init__(self):
+        self._formats = None
+
+    @property
+    def formats(self):
+        if self._formats is None:
+            self._formats = package_formats()
+        return self._formats
+
+    def __contains__(self, item):
+        return item in self.formats
+
+    def __iter__(self):
+        return iter(self.formats)
+
+    def __len__(self):
+        return len(self.formats)
+
+
 def parse_cli_arguments():
 
     # Determine the package types we can create on the current system
-    package_choices = package_formats()
+    package_choices = PackageFormatChoices()
 
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
@@ -39,11 +67,22 @@ def parse_cli_arguments():
     command_parser = parser.add_subparsers(title='command', dest='command')
     list_plugins_parser = command_parser.add_parser('list_plugins', help='List the installed invirtualenv plugins')
     package_config_parser = command_parser.add_parser('create_package_config', help='Generate the packaging configuration file')
-    package_config_parser.add_argument('package_type', choices=package_choices, help='Type of package to create')
+    package_config_parser.add_argument(
+        'package_type', choices=package_choices, metavar='package_type', help='Type of package to create (%(choices)s)'
+    )
     package_config_parser.add_argument('--outfile', '-o', default=None, help='Output file name')
 
-    package_create_parser = command_parser.add_parser('create_package', help='Generate a package from a deployment configuration')
-    package_create_parser.add_argument('package_type', choices=package_choices, help='Type of package to create')
+    package_create_parser = command_parser.add_parser('create_package', help='Generate packages from a deployment configuration')
+    package_create_parser.add_argument(
+        'package_type', nargs='+', choices=package_choices, metavar='package_type',
+        help='Types of package to create (%(choices)s), the packages are generated concurrently when several are specified'
+    )
+
+    lock_parser = command_parser.add_parser(
+        'lock', help='Generate a lock file pinning all the python packages needed to install the [pip] deps'
+    )
+    lock_parser.add_argument('--outfile', '-o', default=None, help='Output file name, defaults to the deploy_conf with a .lock extension')
+    lock_parser.add_argument('--hash', default='sha256', help='The hash algorithm to use for the package hashes')
 
     get_setting_parser = command_parser.add_parser('get_setting', help='Get a setting value from the configuration')
     get_setting_parser.add_argument('section', help="the configuration section to get the setting from")
@@ -68,7 +107,7 @@ def get_setting_command(args):
     """
     LOGGER.debug('Getting value for %s=%s', args.section, args.item)
     rc = 0
-    config = get_configuration_dict([args.deploy_conf])
+    config = Configuration([args.deploy_conf]).values
     try:
         value = config[args.section][args.item]
     except KeyError:
@@ -95,7 +134,8 @@ def create_config_command(args):
         with open('deploy.conf', 'w') as deploy_conf_handle:
             deploy_conf_handle.write(deploy_config_contents)
 
-    result = create_package_configuration(args.package_type)
+    configuration = Configuration([args.deploy_conf])
+    result = create_package_configuration(args.package_type, configuration=configuration)
     if outfile:
         with open(outfile, 'w') as output_handle:
             output_handle.write(result)
@@ -112,22 +152,62 @@ def create_package_command(args):
     deploy_config_contents = ''
     with open(args.deploy_conf) as deploy_conf_handle:
         deploy_config_contents = deploy_conf_handle.read()
+    configuration = Configuration([args.deploy_conf])
+
+    package_types = args.package_type
+    if isinstance(package_types, str):
+        package_types = [package_types]
 
     orig_directory = os.getcwd()
-    with InTemporaryDirectory():
+    package_files = {}
+    scratch_dir = scratch_directory(orig_directory, configuration.values['global'].get('scratch_dir', ''))
+    with InTemporaryDirectory(dir=scratch_dir):
         with open(args.deploy_conf, 'w') as deploy_conf_handle:
             deploy_conf_handle.write(deploy_config_contents)
-        package_file = create_package(args.package_type, source_dir=orig_directory)
-        if package_file:
+        if len(package_types) == 1:
+            results = {package_types[0]: create_package(package_types[0], source_dir=orig_directory, configuration=configuration)}
+        else:
+            results = create_packages(package_types, source_dir=orig_directory, configuration=configuration)
+        for package_type in package_types:
+            package_file = results.get(package_type, None)
+            if not package_file:
+                raise PackageGenerationFailure('Unable to generate a package file using the %r plugin' % package_type)
             dest_package_file = os.path.join(orig_directory, os.path.basename(package_file))
-            if os.path.exists(package_file):
-                shutil.copy(package_file, dest_package_file)
+            if os.path.exists(package_file) and os.path.abspath(package_file) != dest_package_file:
+                move_file(package_file, dest_package_file)
+            package_files[package_type] = dest_package_file
 
-    if package_file:
-        logging.debug('Generated package file: %s' % dest_package_file)
-        return 0, 'Generated package file:' + dest_package_file
+    output = []
+    for package_type in package_types:
+        logging.debug('Generated package file: %s' % package_files[package_type])
+        output.append('Generated package file:' + package_files[package_type])
+    return 0, os.linesep.join(output)
+
+
+def lock_command(args):
+    """
+    Generate a lock file for the [pip] deps in the deploy.conf
+
+    Parameters
+    ----------
+    args: argparse.Namespace
+        The argparse parser namespace with the parsed cli settings
+
+    Returns
+    -------
+    tuple
+        The return code and the command output
+    """
+    from .lock import generate_lock, lock_filename, write_lock
+    from .toolchain import toolchain_inventory
 
-    raise PackageGenerationFailure('Unable to generate a package file using the %r plugin' % args.package_type)
+    config = Configuration([args.deploy_conf]).values
+    deps = config['pip']['deps']
+    pip_cmd = toolchain_inventory().pip_command(config['global']['basepython'] or 'python3')
+    outfile = args.outfile if args.outfile else lock_filename(args.deploy_conf)
+    requirements = generate_lock(pip_cmd, deps, algorithm=args.hash)
+    write_lock(outfile, deps, requirements)
+    return 0, 'Generated lock file:' + outfile
 
 
 def list_plugins_command(args):
@@ -142,7 +222,9 @@ def list_plugins_command(args):
 
 
 def main(test=False):
-    LOGGER.debug('Invirtualenv version %s', invirtualenv_version)
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        from . import __version__ as invirtualenv_version
+        LOGGER.debug('Invirtualenv version %s', invirtualenv_version)
     args = parse_cli_arguments()
 
     rc = 0
@@ -155,6 +237,8 @@ def main(test=False):
         rc, output = list_plugins_command(args)
     elif args.command in ['get_setting']:
         rc, output = get_setting_command(args)
+    elif args.command in ['lock']:
+        rc, output = lock_command(args)
     if test:
         return rc, output
 
@@ -6,18 +6,21 @@
 Functions for handling the configuration settings
 """
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+import copy
 import getpass
+import hashlib
 import io
+import json
 import logging
 import os
 import tempfile
 # noinspection PyUnresolvedReferences,PyPackageRequirements
 from six.moves.configparser import ConfigParser
-from jinja2 import Template
 
-from .package import package_scripts_directory
-from .plugin import config_defaults, config_types, config_update
-from .utility import str_to_bool, str_to_list, str_format_env
+from . import plugin
+from .plugin import config_defaults, config_types, config_update, plugin_registry
+from .utility import cache_directory, read_json_file, render_template, str_to_bool, str_to_list, str_format_env, \
+    template_variables, write_json_file
 from .virtualenv import default_virtualenv_directory
 
 
@@ -37,6 +40,22 @@ CONFIG_PATH = [
 ]
 
 
+def package_scripts_directory():
+    """
+    Get the package scripts directory
+
+    The invirtualenv.package module imports modules that are only needed to
+    query the package index, so it is imported when the value is needed.
+
+    Returns
+    -------
+    str
+        The path to the directory containing the package scripts
+    """
+    from .package import package_scripts_directory as _package_scripts_directory
+    return _package_scripts_directory()
+
+
 def cast_types(configuration, types_dict=None):
     """
     Update in place the configuration dictionary with inferred values if they
@@ -69,13 +88,227 @@ def cast_types(configuration, types_dict=None):
                 pass
 
 
+class Configuration(object):
+    """
+    A parsed configuration
+
+    The configuration files are read when the object is created and the
+    values are parsed, rendered and cast to their types once, the first time
+    they are used.  The same object can then be passed to the plugins, deploy
+    and cli code instead of each of them parsing the configuration again.
+
+    The rendered values are cached in the invirtualenv cache directory, keyed
+    by the content of the configuration files, the installed plugins and the
+    values of the environment variables the configuration templates
+    reference.  A cache hit skips parsing, rendering and casting the values.
+
+    Parameters
+    ----------
+    configuration : str or list, optional
+        A configuration file or list of configuration files to parse,
+        defaults to deploy.conf in the current working directory.
+
+    value_types : dict, optional
+        Dictionary containing classes to apply to specific items, defaults
+        to the value from config_types().  Configurations using custom
+        value_types are not cached.
+
+    use_cache : bool, optional
+        Use the compiled configuration cache, default=True
+
+    Attributes
+    ----------
+    filenames : list
+        Absolute paths of the configuration files that were read
+    """
+    def __init__(self, configuration=None, value_types=None, use_cache=True):
+        if not configuration:  # pragma: no cover
+            configuration = [
+                # Config file that is part of the package
+                # PACKAGE_DEFAULT_CONFIG,
+
+                # Any deploy.conf files in the current directory
+                'deploy.conf'
+            ]
+        self.configuration = configuration
+        self.value_types = value_types
+        self.use_cache = use_cache and value_types is None
+        self._sources = self._read(configuration)
+        self.filenames = [os.path.abspath(filename) for filename, _ in self._sources]
+        self._parser = None
+        self._values = None
+
+    @staticmethod
+    def _read(configuration):
+        if isinstance(configuration, str):
+            configuration = [configuration]
+        sources = []
+        for filename in configuration:
+            # Files that can't be read are skipped, the same as ConfigParser.read()
+            try:
+                with open(filename) as config_handle:
+                    sources.append([filename, config_handle.read()])
+            except (IOError, OSError):
+                continue
+        return sources
+
+    @property
+    def parser(self):
+        """
+        The raw (unrendered) ConfigParser view of the configuration
+        """
+        if self._parser is None:
+            config = ConfigParser()
+
+            # Set the config defaults
+            try:
+                config.read_string(config_defaults())
+            except AttributeError:
+                config.readfp(io.BytesIO(config_defaults()))
+
+            # logger.debug('Working with default dict: %r', config_defaults())
+            for filename, contents in self._sources:
+                config.read_string(contents, source=filename)
+            self._parser = config
+        return self._parser
+
+    @property
+    def values(self):
+        """
+        The configuration dictionary with the values rendered and cast to
+        their types.
+        """
+        if self._values is None:
+            values = self._cached_values()
+            if values is None:
+                values, variables = self._render()
+                self._cache_values(values, variables)
+            self._values = values
+        return self._values
+
+    def _render(self):
+        parser = self.parser
+        environment = dict(os.environ)
+        variables = set()
+        result_dict = {}
+        for section in parser.sections():
+            result_dict[section] = {}
+            for key, val in parser.items(section):
+                variables.update(template_variables(val))
+                result_dict[section][key] = str_format_env(val, environment)
+
+        config_update(result_dict)
+
+        if 'locations' not in result_dict.keys():
+            result_dict['locations'] = {}
+        result_dict['locations']['package_scripts'] = package_scripts_directory()
+        if not result_dict['global'].get('virtualenv_dir', None):
+            result_dict['global']['virtualenv_dir'] = \
+                default_virtualenv_directory()
+
+        cast_types(result_dict, self.value_types)
+        return result_dict, sorted(variables)
+
+    def _cache_filename(self):
+        if not self.use_cache:
+            return None
+        directory = cache_directory('config')
+        if not directory:
+            return None
+        registry = plugin_registry()
+        if registry.iter_entry_points('invirtualenv.config_update'):  # pragma: no cover
+            # Legacy config_update plugins can change the values in ways the
+            # cache key can't account for.
+            return None
+        key = json.dumps([
+            self._sources,
+            registry.digest(),
+            [[filename, os.stat(filename).st_mtime] for filename in (__file__, plugin.__file__)],
+            default_virtualenv_directory(),
+        ])
+        return os.path.join(directory, hashlib.sha256(key.encode()).hexdigest() + '.json')
+
+    def _cached_values(self):
+        cache = read_json_file(self._cache_filename(), default={})
+        if not cache or 'values' not in cache:
+            return None
+        logger.debug('Using cached configuration values')
+        return cache['values']
+
+    def _cache_values(self, values, variables):
+        filename = self._cache_filename()
+        if not filename:
+            return
+        if variables:
+            # The rendered values can contain secrets from the environment,
+            # such as tokens and index credentials, so they are not written
+            # to the cache
+            logger.debug('The configuration references environment variables, not caching it')
+            return
+        try:
+            if json.loads(json.dumps(values)) != values:
+                logger.debug('Configuration values do not serialize to json, not caching them')
+                return
+        except (TypeError, ValueError):
+            logger.debug('Configuration values do not serialize to json, not caching them')
+            return
+        # The cache file is created readable by the current user only
+        write_json_file(filename, {'values': values})
+
+    def as_dict(self):
+        """
+        Get a copy of the configuration dictionary that can be modified
+
+        Returns
+        -------
+        dict
+            Configuration dictionary
+        """
+        return copy.deepcopy(self.values)
+
+    def config_parser(self):
+        """
+        Get a copy of the ConfigParser view that can be modified
+
+        Returns
+        -------
+        configparser
+            The parsed configuration
+        """
+        return copy.deepcopy(self.parser)
+
+
+def load_configuration(configuration=None, value_types=None):
+    """
+    Get a Configuration object
+
+    Parameters
+    ----------
+    configuration : str, list or Configuration, optional
+        A configuration file, list of configuration files or an already
+        parsed Configuration object.
+
+    value_types : dict, optional
+        Dictionary containing classes to apply to specific items
+
+    Returns
+    -------
+    Configuration
+        The parsed configuration, configuration itself if it is already a
+        Configuration object.
+    """
+    if isinstance(configuration, Configuration):
+        return configuration
+    return Configuration(configuration, value_types=value_types)
+
+
 def get_configuration(configuration=None):
     """
     Parse a configuration file
 
     Parameters
     ----------
-    configuration : str or list, optional
+    configuration : str, list or Configuration, optional
         A configuration file or list of configuration files to parse,
         defaults to the deploy_default.conf file in the package and
         deploy.conf in the current working directory.
@@ -85,25 +318,7 @@ def get_configuration(configuration=None):
     configparser
         The parsed configuration
     """
-    if not configuration:  # pragma: no cover
-        configuration = [
-            # Config file that is part of the package
-            # PACKAGE_DEFAULT_CONFIG,
-
-            # Any deploy.conf files in the current directory
-            'deploy.conf'
-        ]
-    config = ConfigParser()
-
-    # Set the config defaults
-    try:
-        config.read_string(config_defaults())
-    except AttributeError:
-        config.readfp(io.BytesIO(config_defaults()))
-
-    # logger.debug('Working with default dict: %r', config_defaults())
-    config.read(configuration)
-    return config
+    return load_configuration(configuration).config_parser()
 
 
 def get_configuration_dict(configuration=None, value_types=None):
@@ -112,7 +327,7 @@ def get_configuration_dict(configuration=None, value_types=None):
 
     Parameters
     ----------
-    configuration : str or list, optional
+    configuration : str, list or Configuration, optional
         A configuration file or list of configuration files to parse,
         defaults to the deploy_default.conf file in the package and
         deploy.conf in the current working directory.
@@ -125,29 +340,7 @@ def get_configuration_dict(configuration=None, value_types=None):
     dict
         Configuration dictionary
     """
-    if not value_types:  # pragma: no cover
-        value_types = config_types()
-
-    config = get_configuration(configuration)
-
-    result_dict = {}
-    for section in config.sections():
-        result_dict[section] = {}
-        for key, val in config.items(section):
-            result_dict[section][key] = str_format_env(val)
-
-    config_update(result_dict)
-
-    if 'locations' not in result_dict.keys():
-        result_dict['locations'] = {}
-    result_dict['locations']['package_scripts'] = package_scripts_directory()
-    if not result_dict['global'].get('virtualenv_dir', None):
-        result_dict['global']['virtualenv_dir'] = \
-            default_virtualenv_directory()
-
-    cast_types(result_dict)
-
-    return result_dict
+    return load_configuration(configuration, value_types=value_types).as_dict()
 
 
 def generate_parsed_config_file(source=None, dest=None):
@@ -180,8 +373,7 @@ def generate_parsed_config_file(source=None, dest=None):
     if not config_data:  # pragma: no cover
         return None
 
-    template = Template(config_data)
-    result = template.render(**os.environ)
+    result = render_template(config_data, cache=False)
 
     logging.debug('parsed_config_file %s', result)
     if not dest:
@@ -203,7 +395,7 @@ def parse_arguments(configuration=None):
 
     Parameters
     ----------
-    configuration : list, optional
+    configuration : list or Configuration, optional
         A list of config files to parse, defaults to the packaged
         deploy_default.conf and the deploy.conf file in the current
         directory.
@@ -214,10 +406,7 @@ def parse_arguments(configuration=None):
         With the configuration based on the passed command line arguments
         and defaults from the deploy_default.conf file in the package.
     """
-    config = get_configuration_dict(
-        configuration,
-        config_types()
-    )
+    config = load_configuration(configuration).values
     virtualenvuser = config['global']['virtualenv_user']
     if not virtualenvuser:  # pragma: no cover
         virtualenvuser = getpass.getuser()
@@ -10,12 +10,27 @@ import errno
 import logging
 import os
 import shutil
+import socket
 import tempfile
 
 
 LOG = logging.getLogger(__name__)
 
 
+# Prefix of the temporary directories created in a directory other than the
+# system temporary directory, followed by the host name and process id so
+# directories left behind by killed processes can be found and removed
+SCRATCH_PREFIX = '.invirtualenv-'
+
+
+def scratch_prefix():
+    """
+    Get the name prefix of the temporary directories this process creates
+    outside of the system temporary directory
+    """
+    return '%s%s-%d-' % (SCRATCH_PREFIX, socket.gethostname(), os.getpid())
+
+
 @contextmanager
 def working_dir(new_path):
     """
@@ -48,7 +63,7 @@ def revert_file(filename):
 
 
 @contextmanager
-def TemporaryDirectory():  # pylint: disable=C0103
+def TemporaryDirectory(dir=None):  # pylint: disable=C0103,W0622
     """
     A context manager that provides a temporary directory and cleans it up.
 
@@ -56,12 +71,18 @@ def TemporaryDirectory():  # pylint: disable=C0103
         This context manager duplicates the base functionality of the
         tempfile.TemporaryDirectory() context manager in Python 3.2+
 
+    Parameters
+    ----------
+    dir : str, optional
+        The directory to create the temporary directory in, defaults to the
+        system temporary directory
+
     Returns
     -------
     str
         The path to the temporary directory
     """
-    name = tempfile.mkdtemp()
+    name = tempfile.mkdtemp(dir=dir, prefix=scratch_prefix() if dir else 'tmp')
     try:
         yield name
     finally:
@@ -75,11 +96,17 @@ def TemporaryDirectory():  # pylint: disable=C0103
 
 
 @contextmanager
-def InTemporaryDirectory():  # pylint: disable=C0103
+def InTemporaryDirectory(dir=None):  # pylint: disable=C0103,W0622
     """
     A context manager that creates a temporary directory and changes
     the current directory into it.
+
+    Parameters
+    ----------
+    dir : str, optional
+        The directory to create the temporary directory in, defaults to the
+        system temporary directory
     """
-    with TemporaryDirectory() as tempdir:
+    with TemporaryDirectory(dir=dir) as tempdir:
         with working_dir(tempdir):
             yield tempdir
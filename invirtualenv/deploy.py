@@ -14,13 +14,16 @@ from pwd import getpwnam
 import subprocess  # nosec
 import tempfile
 from .utility import display_header
-from .config import get_configuration_dict, parse_arguments
+from .config import load_configuration, parse_arguments
 from .exceptions import AlreadyExists, BuildException, \
     InsufficientPermissions, NoPackageVersions
+from .lock import find_lock_file, read_lock
 from .package import install_prereq_packages, latest_package_version
-from .utility import which
+from .scheduler import Phase, run_phases
+from .utility import find_executable, which
 from .virtualenv import build_virtualenv, install_requirements, \
     remove_virtualenv
+from .wheelhouse import compiler_cache_environment
 
 
 logger = logging.getLogger(__name__)  # pylint: disable=C0103
@@ -66,7 +69,8 @@ def fix_file_ownership(virtualenv, user, group):
 
 def install_python_dependencies(virtualenv, deps=None, requirements=None,
                                 upgrade=False, verbose=False, pip_version=None,
-                                use_index=True, use_local_wheels=False):
+                                use_index=True, use_local_wheels=False,
+                                no_deps=False, env=None, wheel_dirs=None):
     """
     Install python dependencies from a requirements file or
     deploy.conf manifest
@@ -97,6 +101,18 @@ def install_python_dependencies(virtualenv, deps=None, requirements=None,
         Install from local wheels directory instead of pypi
         Default=False
 
+    no_deps: bool, optional
+        The deps are a complete set of pinned packages, such as the
+        requirements from a lock file, install them without resolving
+        their dependencies.
+        Default=False
+
+    env: dict, optional
+        The environment to run pip in, defaults to the current environment
+
+    wheel_dirs: list, optional
+        Directories containing wheels to install the dependencies from
+
     Raises
     ------
     BuildException - If package installation fails
@@ -119,14 +135,17 @@ def install_python_dependencies(virtualenv, deps=None, requirements=None,
                 verbose=verbose,
                 pip_version=pip_version,
                 use_index=use_index,
-                use_local_wheels=use_local_wheels
+                use_local_wheels=use_local_wheels,
+                no_deps=no_deps,
+                env=env,
+                wheel_dirs=wheel_dirs
             )
     if requirements:
         logger.debug('Installing dependencies from requirements file %r', requirements)
         install_requirements(
             requirements, virtualenv=virtualenv, upgrade=upgrade,
             verbose=verbose, pip_version=pip_version, use_index=use_index,
-            use_local_wheels=use_local_wheels
+            use_local_wheels=use_local_wheels, env=env, wheel_dirs=wheel_dirs
         )
 
 
@@ -160,6 +179,33 @@ def install_rpm_dependencies(deps=None, fail_missing=True):  # pragma: no cover
             subprocess.check_call(command)  # nosec
 
 
+def interpreter_from_os_packages(python, rpm_deps=None):
+    """
+    Check if the python interpreter may be installed or updated by the rpm
+    packages being installed
+
+    Parameters
+    ----------
+    python : str
+        The python interpreter
+
+    rpm_deps : list, optional
+        The rpm packages being installed
+
+    Returns
+    -------
+    bool
+        True if the interpreter is not installed or a python rpm package is
+        being installed
+    """
+    if python and not os.path.exists(python) and not find_executable(python):
+        return True
+    for package in rpm_deps or []:
+        if package.lower().startswith('python'):
+            return True
+    return False
+
+
 def build_deploy_virtualenv(arguments=None, configuration=None, update_existing=True, verbose=None):
     """
     Build and deploy a python virtualenv
@@ -170,7 +216,7 @@ def build_deploy_virtualenv(arguments=None, configuration=None, update_existing=
         An argparse namespace with all of the required command line arguments
         defaults to parsing the command line arguments if not provided.
 
-    configuration : str or list, optional
+    configuration : str, list or Configuration, optional
         A configuration file or list of configuration files to parse,
         defaults to the deploy_default.conf file in the package and
         deploy.conf in the current working directory.
@@ -198,7 +244,8 @@ def build_deploy_virtualenv(arguments=None, configuration=None, update_existing=
         no versions for that package where found on artifactory.
     """
     # display_header('Parsing the configuration')
-    config = get_configuration_dict(configuration=configuration)
+    configuration = load_configuration(configuration)
+    config = configuration.as_dict()
     if not arguments:
         logger.debug('No arguments dictionary passed, parsing command line arguments')
         arguments = parse_arguments(configuration=configuration)
@@ -257,57 +304,97 @@ def build_deploy_virtualenv(arguments=None, configuration=None, update_existing=
                 'Virtualenv %r already exists' % virtualenv
             )
 
-    # Install the python OS rpm packages if requested.
-    if arguments.install_os_packages:
-        if verbose:
-            display_header('Installing Operating System Pre-Req packages')
-        install_prereq_packages()
-
-    # Install rpm packages if specified
-    if 'rpm' in config['global']['install_manifest']:
-        if config['rpm']['deps']:
-            if verbose:
-                display_header('Installing rpm dependencies')
-            install_rpm_dependencies(
-                deps=config['rpm']['deps'],
-                fail_missing=config['rpm']['fail_missing_yum']
-            )
-
     # By default don't use local wheels.
     use_local_wheels = config['global'].get('use_local_wheels', 'false').lower() in ['1', 'true', 'yes', 'on']
     use_index = str(not use_local_wheels)  # default is to disable the index if using local wheels
     use_index = config['global'].get('use_index', use_index).lower() in ['1', 'true', 'yes', 'on']
 
-    if verbose:
-        display_header('Building virtualenv')
-    virtualenv = build_virtualenv(
-        arguments.name,
-        arguments.virtualenvdir,
-        python_interpreter=arguments.python,
-        user=arguments.virtualenvuser,
-        verbose=verbose
-    )
-
     deps = config['pip']['deps']
-    if verbose:
-        display_header('Installing python package dependencies')
-    try:
-        install_python_dependencies(
-            virtualenv=virtualenv,
-            requirements=arguments.requirement,
-            deps=deps,
-            upgrade=arguments.upgrade,
-            verbose=verbose,
-            pip_version=config['pip']['pip_version'],
-            use_index=use_index,
-            use_local_wheels=use_local_wheels
+    no_deps = config['pip'].get('locked', False)
+    lock_file = find_lock_file(configuration)
+    locked_deps = read_lock(lock_file, deps)
+    if locked_deps:
+        logger.debug('Installing the pinned requirements from the lock file %r', lock_file)
+        deps = locked_deps
+        no_deps = True
+
+    def install_os_packages():
+        install_prereq_packages()
+
+    def install_rpm_packages():
+        install_rpm_dependencies(
+            deps=config['rpm']['deps'],
+            fail_missing=config['rpm']['fail_missing_yum']
         )
-    except BuildException:
-        logger.exception(
-            'Package installation in virtualenv failed, removing virtualenv',
+
+    built = {}
+
+    def create_virtualenv():
+        built['virtualenv'] = build_virtualenv(
+            arguments.name,
+            arguments.virtualenvdir,
+            python_interpreter=arguments.python,
+            user=arguments.virtualenvuser,
+            verbose=verbose,
+            use_base_virtualenv=config['global'].get('base_virtualenv', False),
+            # The ownership of the files is changed later, which would change
+            # hard linked files in the base virtualenv as well
+            hardlinks=not (arguments.virtualenvuser or arguments.virtualenvgroup)
         )
-        remove_virtualenv(arguments.name, arguments.virtualenvdir)
-        raise BuildException('Package installation in virtualenv failed')
+        return built['virtualenv']
+
+    def install_python_packages():
+        try:
+            install_python_dependencies(
+                virtualenv=built['virtualenv'],
+                requirements=arguments.requirement,
+                deps=deps,
+                upgrade=arguments.upgrade,
+                verbose=verbose,
+                pip_version=config['pip']['pip_version'],
+                use_index=use_index,
+                use_local_wheels=use_local_wheels,
+                no_deps=no_deps,
+                env=compiler_cache_environment(config['pip'].get('compiler_cache', ''), config['pip'].get('compiler_cache_size', None))
+            )
+        except BuildException:
+            logger.exception(
+                'Package installation in virtualenv failed, removing virtualenv',
+            )
+            remove_virtualenv(arguments.name, arguments.virtualenvdir)
+            raise BuildException('Package installation in virtualenv failed')
+
+    # The yum transactions can't run at the same time, but creating the
+    # virtualenv only waits for them if they may install the interpreter.
+    # The python packages may link against the rpm packages so they are
+    # installed once everything else completes.
+    os_phases = []
+    phases = []
+    headers = {
+        'os_packages': 'Installing Operating System Pre-Req packages',
+        'rpm_packages': 'Installing rpm dependencies',
+        'virtualenv': 'Building virtualenv',
+        'python_packages': 'Installing python package dependencies',
+    }
+    if arguments.install_os_packages:
+        phases.append(Phase('os_packages', install_os_packages))
+        os_phases.append('os_packages')
+    if 'rpm' in config['global']['install_manifest'] and config['rpm']['deps']:
+        phases.append(Phase('rpm_packages', install_rpm_packages, requires=os_phases[:]))
+        os_phases.append('rpm_packages')
+    interpreter_os_phases = os_phases if interpreter_from_os_packages(arguments.python, config['rpm']['deps']) else []
+    phases.append(Phase('virtualenv', create_virtualenv, requires=interpreter_os_phases))
+    phases.append(Phase('python_packages', install_python_packages, requires=['virtualenv'] + os_phases))
+    existed = os.path.exists(virtualenv)
+    try:
+        virtualenv = run_phases(phases, on_start=lambda phase: display_header(headers[phase.name]) if verbose else None)['virtualenv']
+    except Exception:
+        # The virtualenv is created while the OS packages install, don't leave
+        # a partial virtualenv behind if any phase failed
+        if not existed and os.path.exists(virtualenv):
+            logger.debug('Removing the virtualenv %r after a failed deploy', virtualenv)
+            remove_virtualenv(arguments.name, arguments.virtualenvdir)
+        raise
 
     if not arguments.virtualenvuser and not arguments.virtualenvgroup:
         # User didn't specify a user or group
@@ -0,0 +1,209 @@
+# Copyright (c) 2016, Yahoo Inc.
+# Copyrights licensed under the BSD License
+# See the accompanying LICENSE.txt file for terms.
+
+"""
+Functions for generating and reading lock files, which pin the full set of
+python packages needed to install the [pip] deps of a configuration
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from .package import package_file_hashes
+from .wheelhouse import download_packages, hash_files, package_requirement
+
+
+logger = logging.getLogger(__name__)  # pylint: disable=C0103
+
+
+LOCK_HEADER = '# Generated by "invirtualenv lock", do not edit'
+LOCK_DIGEST_PREFIX = '# deps-digest: '
+
+
+def lock_filename(config_filename):
+    """
+    Get the lock file for a configuration file, which is stored next to it
+    with a .lock extension
+
+    Parameters
+    ----------
+    config_filename : str
+        The configuration file
+
+    Returns
+    -------
+    str
+        The lock filename
+    """
+    return os.path.splitext(config_filename)[0] + '.lock'
+
+
+def find_lock_file(configuration):
+    """
+    Find the lock file for a configuration
+
+    Parameters
+    ----------
+    configuration : invirtualenv.config.Configuration
+        The configuration
+
+    Returns
+    -------
+    str
+        The lock file next to the last configuration file read or None if
+        there isn't one
+    """
+    if not configuration.filenames:
+        return None
+    filename = lock_filename(configuration.filenames[-1])
+    if os.path.exists(filename):
+        return filename
+    return None
+
+
+def deps_digest(deps):
+    """
+    Get a digest of the deps a lock was generated from
+
+    Parameters
+    ----------
+    deps : list
+        The [pip] deps requirements
+
+    Returns
+    -------
+    str
+        Hex digest
+    """
+    return hashlib.sha256(json.dumps(list(deps)).encode()).hexdigest()
+
+
+def generate_lock(pip_cmd, deps, algorithm=None, index_url=None):
+    """
+    Resolve the deps and get the pinned, hashed requirement for every
+    package needed to install them
+
+    Each requirement lists the hashes of every distribution file of the
+    pinned version on the package index, so the lock installs on other
+    platforms and python versions than the one it was generated on.  If the
+    index can't be queried only the hash of the downloaded file is used.  If
+    any package is a source package, which is built into a wheel when it is
+    installed, the lock contains no hashes, since pip requires hashes for
+    every requirement if any have them and the built wheels don't match the
+    index hashes.
+
+    Parameters
+    ----------
+    pip_cmd : list
+        The command to run pip
+
+    deps : list
+        The requirements to resolve
+
+    algorithm : str, optional
+        The hash algorithm to use for the downloaded files, defaults to
+        sha256
+
+    index_url : str, optional
+        The simple index url to get the hashes from, defaults to the index in
+        the pip configuration
+
+    Returns
+    -------
+    list
+        Sorted list of requirement lines in the form
+        name==version --hash=algorithm:hexdigest ...
+    """
+    if not deps:
+        return []
+    pins = []
+    source = []
+    with tempfile.TemporaryDirectory() as download_dir:
+        download_packages(pip_cmd, deps, download_dir)
+        filenames = [os.path.join(download_dir, filename) for filename in sorted(os.listdir(download_dir))]
+        hashes = hash_files(filenames, algorithm=algorithm)
+        for filename in filenames:
+            name, version = package_requirement(filename)
+            if not version:
+                logger.warning('Unable to determine the version of %r, it is not in the lock', filename)
+                continue
+            if not filename.endswith('.whl'):
+                source.append(name)
+            try:
+                index_hashes = package_file_hashes(name, version, index_url=index_url)
+            except Exception as error:  # pylint: disable=W0703
+                logger.debug('Unable to get the hashes of %s %s from the package index: %s', name, version, error)
+                index_hashes = []
+            if not index_hashes:
+                logger.warning('The package index has no hashes for %s %s, the lock may only install on this platform', name, version)
+            pins.append((name, version, sorted(set(index_hashes) | {hashes[filename]})))
+
+    if source:
+        logger.warning(
+            'The packages %s are built from source packages, the lock file does not include hashes', ', '.join(sorted(source))
+        )
+    requirements = []
+    for name, version, file_hashes in pins:
+        requirement = '{name}=={version}'.format(name=name, version=version)
+        if not source:
+            requirement += ''.join(' --hash={file_hash}'.format(file_hash=file_hash) for file_hash in file_hashes)
+        requirements.append(requirement)
+    return sorted(requirements, key=str.lower)
+
+
+def write_lock(filename, deps, requirements):
+    """
+    Write a lock file
+
+    Parameters
+    ----------
+    filename : str
+        The lock file to write
+
+    deps : list
+        The [pip] deps the lock was generated from
+
+    requirements : list
+        The requirement lines from generate_lock()
+    """
+    lines = [LOCK_HEADER, LOCK_DIGEST_PREFIX + deps_digest(deps)] + list(requirements)
+    with open(filename, 'w') as lock_handle:
+        lock_handle.write('\n'.join(lines) + '\n')
+
+
+def read_lock(filename, deps=None):
+    """
+    Read the requirements from a lock file
+
+    Parameters
+    ----------
+    filename : str
+        The lock file to read
+
+    deps : list, optional
+        The current [pip] deps, if passed a lock that was generated from
+        different deps is ignored
+
+    Returns
+    -------
+    list
+        The requirement lines or None if the lock file is missing or out of
+        date
+    """
+    if not filename or not os.path.exists(filename):
+        return None
+    digest = None
+    requirements = []
+    with open(filename) as lock_handle:
+        for line in lock_handle:
+            line = line.strip()
+            if line.startswith(LOCK_DIGEST_PREFIX):
+                digest = line[len(LOCK_DIGEST_PREFIX):]
+            elif line and not line.startswith('#'):
+                requirements.append(line)
+    if deps is not None and digest != deps_digest(deps):
+        logger.warning('The lock file %r is out of date, run "invirtualenv lock" to update it', filename)
+        return None
+    return requirements
@@ -6,11 +6,11 @@
 Functions for managing packaging
 """
 from collections import defaultdict
-from distutils.version import LooseVersion, StrictVersion
 from html.parser import HTMLParser
 import logging
 import os
 import platform
+import re
 import subprocess  # nosec
 from typing import DefaultDict, Dict, List, Optional
 
@@ -19,13 +19,9 @@ try:  # pragma: no cover
 except ImportError:  # pragma: no cover
     import ConfigParser
 
-from defusedxml import ElementTree
-import pkg_resources
-import requests
-
 from .exceptions import BuildException
 from .utility import display_header
-from distutils.version import LooseVersion
+from .wheelhouse import package_requirement
 
 
 logger = logging.getLogger(__name__)
@@ -53,6 +49,10 @@ def get_index_url():
 
 
 def package_files(package: str, pypi_url: str='https://pypi.org', timeout: float=1500.0) -> List[str]:
+    # These are imported here so commands that don't query the package index don't pay for importing them
+    import pkg_resources
+    import requests
+
     if not pypi_url:
         pypi_url = get_index_url()
     name = pkg_resources.safe_name(package)
@@ -72,7 +72,57 @@ def package_files(package: str, pypi_url: str='https://pypi.org', timeout: float
     return files
 
 
+def package_file_hashes(package: str, version: str, index_url: Optional[str]=None, timeout: float=60.0) -> List[str]:
+    """
+    Get the hashes the package index lists for every distribution file of a
+    package version, the wheels for all platforms and the source packages
+
+    Parameters
+    ----------
+    package : str
+        The package name
+
+    version : str
+        The package version
+
+    index_url : str, optional
+        The simple index url, defaults to the index in the pip configuration
+
+    timeout : float, optional
+        The request timeout in seconds
+
+    Returns
+    -------
+    list
+        Sorted list of hashes in the form algorithm:hexdigest, empty if the
+        index doesn't list hashes for the version
+    """
+    import requests
+
+    if not index_url:
+        index_url = get_index_url()
+    url = index_url.rstrip('/') + '/' + re.sub(r'[-_.]+', '-', package).lower() + '/'
+    parser = HTMLLinkParser()
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()
+    parser.feed(response.text)
+
+    hashes = set()
+    for link in parser.href_list:
+        filename, _, fragment = link.partition('#')
+        name, file_version = package_requirement(os.path.basename(filename))
+        if file_version != version or re.sub(r'[-_.]+', '-', name).lower() != re.sub(r'[-_.]+', '-', package).lower():
+            continue
+        algorithm, _, digest = fragment.partition('=')
+        if algorithm in ('sha256', 'sha384', 'sha512') and digest:
+            hashes.add(algorithm + ':' + digest)
+    return sorted(hashes)
+
+
 def package_type_versions(package: str, pypi_url: str='https://pypi.org', require_strict: bool=False) -> Dict[str, list]:
+    from distutils.version import LooseVersion, StrictVersion
+    import pkg_resources
+
     if not pypi_url:
         pypi_url = get_index_url()
 
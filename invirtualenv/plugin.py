@@ -5,10 +5,13 @@
 """
 Functions to enable packaging plugin functionality
 """
+import hashlib
+import importlib
+import json
 import logging
 import os
-import pkg_resources
-from .utility import find_executable, update_recursive, csv_list
+import sys
+from .utility import cache_directory, csv_list, find_executable, move_file, read_json_file, scratch_directory, update_recursive, write_json_file
 
 
 logger = logging.getLogger(__name__)  # pylint: disable=C0103
@@ -26,9 +29,17 @@ virtualenv_deploy_dir=
 virtualenv_version_package =
 virtualenv_user =
 virtualenv_group =
+reproducible = False
+base_virtualenv = False
 
 [pip]
 pip_version =
+build_jobs = 0
+compiler_cache =
+compiler_cache_size = 5120
+wheel_cache = True
+wheel_cache_size = 2048
+locked = False
 deps:
 
 [rpm]
@@ -39,22 +50,309 @@ CONFIG_TYPES = {
     'global': {
         'install_manifest': csv_list,
         'install_os_packages': bool,
+        'reproducible': bool,
+        'base_virtualenv': bool,
     },
     'pip': {
-        'deps': list
+        'deps': list,
+        'build_jobs': int,
+        'compiler_cache_size': int,
+        'wheel_cache': bool,
+        'wheel_cache_size': int,
+        'locked': bool,
     },
     'rpm': {
         'deps': list,
         'fail_missing_yum': bool
     },
 }
+# Entry point groups searched for plugins, all but invirtualenv.plugin are
+# the legacy plugin interface.
+PLUGIN_GROUPS = [
+    'invirtualenv.plugin',
+    'invirtualenv.supported',
+    'invirtualenv.config',
+    'invirtualenv.create_package',
+    'invirtualenv.config_update',
+]
+PLUGIN_INDEX_FILENAME = 'plugin_index.json'
+DISTRIBUTION_METADATA_SUFFIXES = ('.dist-info', '.egg-info', '.egg-link')
+
+
+class PluginEntryPoint(object):
+    """
+    An entry point from the plugin index that can be loaded without scanning
+    the installed distributions.
+    """
+    def __init__(self, name, module_name, attrs=''):
+        self.name = name
+        self.module_name = module_name
+        self.attrs = attrs
+
+    def __repr__(self):
+        return '%s(%r, %r, %r)' % (self.__class__.__name__, self.name, self.module_name, self.attrs)
+
+    def load(self):
+        """
+        Import the entry point module and return the object it refers to
+        """
+        result = importlib.import_module(self.module_name)
+        for attr in self.attrs.split('.') if self.attrs else []:
+            result = getattr(result, attr)
+        return result
+
+
+class PluginRegistry(object):
+    """
+    Index of the invirtualenv plugin entry points
+
+    The installed distributions are scanned for entry points once per process
+    and the result is stored on disk, keyed by the sys.path entries and their
+    modification times.  As long as no distributions are added to or removed
+    from the path the index is read from disk without scanning the
+    installed distributions.
+
+    Parameters
+    ----------
+    path : list, optional
+        The directories to search for plugins, defaults to sys.path
+
+    index_filename : str, optional
+        The file to store the plugin index in, defaults to a file in the
+        invirtualenv cache directory
+    """
+    def __init__(self, path=None, index_filename=None):
+        self.path = list(sys.path) if path is None else list(path)
+        if index_filename is None:
+            directory = cache_directory()
+            if directory:
+                index_filename = os.path.join(directory, PLUGIN_INDEX_FILENAME)
+        self.index_filename = index_filename
+        self._entry_points = None
+        self._from_index = False
+        self._loaded = {}
+        self._format_index = None
+
+    def key(self):
+        """
+        Get a key that changes when the distributions on the path change
+
+        Returns
+        -------
+        str
+            Hex digest of the path entries and their modification times
+        """
+        path_state = []
+        current_directory = os.getcwd()
+        for entry in self.path:
+            entry = os.path.abspath(entry)
+            try:
+                if entry == current_directory:
+                    # The working directory changes whenever a file is
+                    # written in it, so only the distribution metadata in it
+                    # is used.
+                    state = sorted(name for name in os.listdir(entry) if name.endswith(DISTRIBUTION_METADATA_SUFFIXES))
+                else:
+                    state = os.stat(entry).st_mtime
+            except OSError:
+                state = None
+            path_state.append([entry, state])
+        return hashlib.sha256(json.dumps(path_state).encode()).hexdigest()
+
+    def digest(self):
+        """
+        Get a digest that identifies the set of installed plugins
+
+        Returns
+        -------
+        str
+            Hex digest of the path state and the plugin entry points
+        """
+        entry_points = [
+            [group, [[entry_point.name, entry_point.module_name, entry_point.attrs] for entry_point in entries]]
+            for group, entries in sorted(self.entry_points.items())
+        ]
+        return hashlib.sha256(json.dumps([self.key(), entry_points]).encode()).hexdigest()
+
+    def scan(self):
+        """
+        Scan the installed distributions for plugin entry points
+
+        Returns
+        -------
+        dict
+            Dictionary of entry point group names and the list of
+            [name, module_name, attrs] entries in the group
+        """
+        import pkg_resources
+
+        if self.path == sys.path:
+            working_set = pkg_resources.working_set
+        else:
+            working_set = pkg_resources.WorkingSet(self.path)
+        result = {}
+        for group in PLUGIN_GROUPS:
+            result[group] = [
+                [entry_point.name, entry_point.module_name, '.'.join(entry_point.attrs)]
+                for entry_point in working_set.iter_entry_points(group=group)
+            ]
+        logger.debug('Scanned plugin entry points: %r', result)
+        return result
+
+    @property
+    def entry_points(self):
+        """
+        The plugin entry points, from the on disk index if it is current
+
+        Returns
+        -------
+        dict
+            Dictionary of entry point group names and their entry points
+        """
+        if self._entry_points is None:
+            key = self.key()
+            index = read_json_file(self.index_filename, default={})
+            if index.get('key') == key:
+                logger.debug('Using plugin index %r', self.index_filename)
+                groups = index['groups']
+                self._from_index = True
+            else:
+                groups = self.scan()
+                write_json_file(self.index_filename, {'key': key, 'groups': groups})
+                self._from_index = False
+            self._entry_points = {
+                group: [PluginEntryPoint(*entry) for entry in groups.get(group, [])] for group in PLUGIN_GROUPS
+            }
+        return self._entry_points
+
+    def iter_entry_points(self, group):
+        """
+        Iterate the entry points in a plugin group
+
+        Parameters
+        ----------
+        group : str
+            The entry point group name
+
+        Returns
+        -------
+        list
+            List of PluginEntryPoint objects
+        """
+        return list(self.entry_points.get(group, []))
+
+    def load(self, group):
+        """
+        Load all the entry points in a plugin group
+
+        If the on disk index refers to an entry point that can no longer be
+        imported the index is discarded and the distributions are rescanned.
+
+        Parameters
+        ----------
+        group : str
+            The entry point group name
+
+        Returns
+        -------
+        list
+            The objects the entry points refer to
+        """
+        if group not in self._loaded:
+            try:
+                loaded = [entry_point.load() for entry_point in self.iter_entry_points(group)]
+            except (ImportError, AttributeError):
+                if not self._from_index:
+                    raise
+                logger.debug('Plugin index %r is stale, rescanning', self.index_filename)
+                self.invalidate()
+                loaded = [entry_point.load() for entry_point in self.iter_entry_points(group)]
+            self._loaded[group] = loaded
+        return list(self._loaded[group])
+
+    def format_index(self):
+        """
+        Get the plugin class that handles each package format that can be
+        generated on this system.
+
+        The plugins are probed at the class level so no plugin is constructed
+        to build the index.
+
+        Returns
+        -------
+        dict
+            Dictionary of package format and the plugin class that creates it
+        """
+        if self._format_index is None:
+            index = {}
+            for plugin in self.load('invirtualenv.plugin'):
+                for package_format in plugin_available_formats(plugin):
+                    index.setdefault(package_format, plugin)
+            logger.debug('Package format plugin index: %r', index)
+            self._format_index = index
+        return dict(self._format_index)
+
+    def invalidate(self):
+        """
+        Discard the in memory and on disk plugin index
+        """
+        self._entry_points = None
+        self._loaded = {}
+        self._format_index = None
+        if self.index_filename and os.path.exists(self.index_filename):
+            os.remove(self.index_filename)
+
+
+_plugin_registry = None
+
+
+def plugin_registry():
+    """
+    Get the plugin registry for this process
+
+    Returns
+    -------
+    PluginRegistry
+        The plugin registry
+    """
+    global _plugin_registry  # pylint: disable=W0603
+    if _plugin_registry is None:
+        _plugin_registry = PluginRegistry()
+    return _plugin_registry
+
+
+def plugin_available_formats(plugin):
+    """
+    Get the package formats a plugin class can generate on this system
+
+    Parameters
+    ----------
+    plugin : class
+        The InvirtualenvPlugin class
+
+    Returns
+    -------
+    list
+        The package formats supported by the plugin on this system
+    """
+    try:
+        return plugin.available_formats()
+    except (AttributeError, TypeError):
+        # Plugins that implement system_requirements_ok() as an instance
+        # method can only be probed by constructing them.
+        return plugin().supported_formats()
 
 
 def installed_plugins():
-    plugins = []
-    for entry_point in pkg_resources.iter_entry_points(group='invirtualenv.plugin'):
-        plugins.append(entry_point.load())
-    return plugins
+    """
+    Get the installed invirtualenv plugin classes
+
+    Returns
+    -------
+    list
+        List of InvirtualenvPlugin classes
+    """
+    return plugin_registry().load('invirtualenv.plugin')
 
 
 def package_formats():
@@ -66,15 +364,10 @@ def package_formats():
     list
         A list of supported package type strings
     """
-    supported_types = []
-    for plugin in installed_plugins():
-        supported_types += plugin().supported_formats()
+    supported_types = list(plugin_registry().format_index().keys())
 
     # Legacy plugin support
-    for entry_point in pkg_resources.iter_entry_points(
-            group='invirtualenv.supported'
-    ):  # pragma: no cover
-        supported = entry_point.load()
+    for supported in plugin_registry().load('invirtualenv.supported'):  # pragma: no cover
         logger.debug(supported)
         supported_types += supported()
 
@@ -106,10 +399,7 @@ def config():
             )
 
     # Legacy plugin support
-    for entry_point in pkg_resources.iter_entry_points(
-            group='invirtualenv.config'
-    ):  # pragma: no cover
-        default_config_function = entry_point.load()
+    for default_config_function in plugin_registry().load('invirtualenv.config'):  # pragma: no cover
         default_config, default_types = default_config_function()
         if default_config:
             logger.debug('Adding to default config: %r', default_config)
@@ -135,10 +425,7 @@ def config_update(configuration):
     configuration : dict
         The configuration dictionary
     """
-    for entry_point in pkg_resources.iter_entry_points(
-            group='invirtualenv.config_update'
-    ):  # pragma: no cover
-        config_update_function = entry_point.load()
+    for config_update_function in plugin_registry().load('invirtualenv.config_update'):  # pragma: no cover
         config_update_function(configuration)
 
     logger.debug('Updated configuration: %r', configuration)
@@ -184,12 +471,15 @@ def get_package_plugin(package_type):
     InvirtualEnvPlugin:
         The invirtualenv plugin for the specific package_type
     """
+    plugin = plugin_registry().format_index().get(package_type, None)
+    if plugin:
+        return plugin
     for plugin in installed_plugins():
         if package_type in plugin.package_formats:
             return plugin
 
 
-def create_package_configuration(package_type):
+def create_package_configuration(package_type, configuration=None):
     """
     Create a package of a specific package type
 
@@ -203,13 +493,15 @@ def create_package_configuration(package_type):
     package_type : str
         The package type to create a package for
 
+    configuration : invirtualenv.config.Configuration, optional
+        The parsed configuration to pass to the plugin
     """
-    for plugin in installed_plugins():
-        if package_type in plugin.package_formats:
-            return plugin().render_template_with_config()
+    plugin = get_package_plugin(package_type)
+    if plugin:
+        return plugin(configuration=configuration).render_template_with_config()
 
 
-def create_package(package_type, source_dir=''):
+def create_package(package_type, source_dir='', configuration=None):
     """
     Create a package of a specific package type
 
@@ -218,6 +510,8 @@ def create_package(package_type, source_dir=''):
 
     These plugins should return None if they do not handle that package type.
 
+    Only the plugin that handles the package_type is constructed.
+
     Parameters
     ----------
     package_type : str
@@ -225,17 +519,137 @@ def create_package(package_type, source_dir=''):
 
     source_dir: str, optional
         The source_dir for the plugin
+
+    configuration : invirtualenv.config.Configuration, optional
+        The parsed configuration to pass to the plugin
     """
-    for plugin in installed_plugins():
-        package_name = plugin(source_dir=source_dir).create_package(package_type)
+    plugin = plugin_registry().format_index().get(package_type, None)
+    if plugin:
+        package_name = plugin(source_dir=source_dir, configuration=configuration).create_package(package_type)
         if package_name:
             return package_name
 
     # Legacy plugin support
-    for entry_point in pkg_resources.iter_entry_points(
-            group='invirtualenv.create_package'
-    ):
-        package = entry_point.load()
+    for package in plugin_registry().load('invirtualenv.create_package'):
         package_name = package(package_type)
         if package_name:
             return package(package_type)
+
+
+def _run_package_command(plugin, hashes, build_dir, connection, log_level=logging.INFO):
+    """
+    Run a plugin's run_package_command() in its package build directory and
+    send the resulting package or the error to the connection, this runs in a
+    spawned process so the plugin is passed pickled.
+    """
+    logging.basicConfig(level=log_level)
+    try:
+        os.chdir(build_dir)
+        package = plugin.run_cached_package_command(hashes, build_dir, wheel_dir='wheels')
+        if package and os.path.exists(package):
+            package = os.path.abspath(package)
+        connection.send([package, None])
+    except Exception as error:  # pylint: disable=W0703
+        logger.exception('Generating the package failed')
+        connection.send([None, repr(error)])
+    finally:
+        connection.close()
+
+
+def create_packages(package_types, source_dir='', configuration=None):
+    """
+    Create packages of several package types
+
+    The configuration is parsed once and the package types that use the same
+    interpreter and dependencies share the generated wheels.  Each package
+    type is prepared in its own build directory and the plugins'
+    run_package_command() methods, which generate the packages, run
+    concurrently in separate processes.
+
+    Parameters
+    ----------
+    package_types : list
+        The package types to create packages for
+
+    source_dir: str, optional
+        The source_dir for the plugins
+
+    configuration : invirtualenv.config.Configuration, optional
+        The parsed configuration to pass to the plugins
+
+    Returns
+    -------
+    dict
+        Dictionary of package type and the generated package, packages that
+        are files are moved to the current directory.  The package is None
+        for package types no plugin could generate.
+
+    Raises
+    ------
+    PackageGenerationFailure
+        Generating one of the packages failed
+    """
+    import multiprocessing
+    from .config import load_configuration
+    from .contextmanager import TemporaryDirectory, working_dir
+    from .exceptions import PackageGenerationFailure
+    from .toolchain import toolchain_inventory
+
+    configuration = load_configuration(configuration)
+    original_directory = os.getcwd()
+    index = plugin_registry().format_index()
+    results = {}
+    scratch_dir = scratch_directory(original_directory, configuration.values['global'].get('scratch_dir', ''))
+    with TemporaryDirectory(dir=scratch_dir) as build_root:
+        builds = []
+        shared_wheels = {}
+        for package_type in package_types:
+            if package_type in results or package_type in [build[0] for build in builds]:
+                continue
+            plugin_class = index.get(package_type, None)
+            if not plugin_class:
+                # Legacy plugins generate the package in a single call
+                results[package_type] = create_package(package_type, source_dir=source_dir, configuration=configuration)
+                continue
+            plugin = plugin_class(source_dir=source_dir, configuration=configuration)
+            if package_type not in plugin.supported_formats():
+                results[package_type] = None
+                continue
+            if 'wheel_packages' in [stage.name for stage in plugin.pipeline()]:
+                toolchain_inventory().probe(interpreters=[plugin.basepython])
+            build_dir = os.path.join(build_root, package_type)
+            os.makedirs(build_dir)
+            with working_dir(build_dir):
+                hashes = plugin.prepare_package(build_dir, shared_wheels=shared_wheels)
+            builds.append([package_type, plugin, hashes, build_dir])
+
+        # The plugins generate the package in the current directory, so each of
+        # them runs in a separate process that can change to its build directory.
+        # The processes are spawned rather than forked, because forking after the
+        # probe and wheel build thread pools have run can deadlock on their locks.
+        context = multiprocessing.get_context('spawn')
+        log_level = logging.getLogger().getEffectiveLevel()
+        processes = []
+        for package_type, plugin, hashes, build_dir in builds:
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_run_package_command, args=(plugin, hashes, build_dir, sender, log_level))
+            process.start()
+            sender.close()
+            processes.append([package_type, process, receiver])
+
+        errors = {}
+        for package_type, process, receiver in processes:
+            try:
+                package, error = receiver.recv()
+            except EOFError:
+                package, error = None, 'The package generation process exited unexpectedly'
+            process.join()
+            if error:
+                errors[package_type] = error
+                continue
+            if package and os.path.exists(package):
+                package = move_file(package, os.path.join(original_directory, os.path.basename(package)))
+            results[package_type] = package
+    if errors:
+        raise PackageGenerationFailure('Unable to generate the %s package(s): %r' % (', '.join(sorted(errors)), errors))
+    return results
@@ -5,23 +5,95 @@
 """
 Functions to enable packaging plugin functionality
 """
+import json
 import logging
 import os
 import shutil
 import subprocess  # nosec
 import sys
-from jinja2 import Template
 from . import __version__
-from .config import get_configuration_dict, get_configuration, generate_parsed_config_file
+from .buildcache import BuildCache, content_digest
+from .config import generate_parsed_config_file, load_configuration
 from .contextmanager import InTemporaryDirectory, working_dir
-from .utility import find_executable, update_recursive, csv_list
+from .exceptions import PackageGenerationFailure
+from .lock import find_lock_file, read_lock
+from .toolchain import toolchain_inventory
+from .utility import compile_template, update_recursive, csv_list, installed_version, move_file, scratch_directory, source_date_epoch, str_to_bool
+from .wheelhouse import WheelCache, archive_compression, archive_filename, build_wheelhouse, compiler_cache_environment, hash_files, write_archive
 
 
 logger = logging.getLogger(__name__)  # pylint: disable=C0103
 
 
+class PackageStage(object):
+    """
+    A stage of the package generation pipeline run by
+    InvirtualenvPlugin.prepare_package()
+
+    Parameters
+    ----------
+    name: str
+        The stage name
+
+    method: str
+        The name of the plugin method that runs the stage, the method is
+        passed the pipeline state dictionary and returns a dictionary of the
+        outputs it adds to the state
+
+    inputs: list, optional
+        The pipeline state values the stage needs from earlier stages
+
+    outputs: list, optional
+        The pipeline state values the stage adds
+
+    cache_inputs: str, optional
+        The name of the plugin method that returns the json serializable
+        inputs the stage outputs depend on, or None if the outputs can't be
+        cached.  The method is passed the pipeline state dictionary.  Stages
+        without a cache_inputs method always run.
+
+    files: list, optional
+        The outputs that are files or directories in the package build
+        directory, which are stored in the build cache with the outputs
+
+    restore: str, optional
+        The name of the plugin method called with the outputs restored from
+        the build cache, to apply the changes the stage makes to the plugin
+    """
+    def __init__(self, name, method, inputs=None, outputs=None, cache_inputs=None, files=None, restore=None):
+        self.name = name
+        self.method = method
+        self.inputs = inputs if inputs else []
+        self.outputs = outputs if outputs else []
+        self.cache_inputs = cache_inputs
+        self.files = files if files else []
+        self.restore = restore
+
+    def __repr__(self):
+        return 'PackageStage({0!r}, {1!r}, inputs={2!r}, outputs={3!r})'.format(self.name, self.method, self.inputs, self.outputs)
+
+
+# The built in package stages, plugins list the ones they need in their
+# package_stages in the order they should run.
+PACKAGE_STAGES = {
+    'copy_files': PackageStage('copy_files', 'stage_copy_files', outputs=['source_files']),
+    'wheel_packages': PackageStage(
+        'wheel_packages', 'stage_wheel_packages', outputs=['wheel_dir', 'hashes'],
+        cache_inputs='wheel_packages_cache_inputs', files=['wheel_dir'], restore='restore_wheel_packages'
+    ),
+    'wheel_archive': PackageStage(
+        'wheel_archive', 'stage_wheel_archive', inputs=['wheel_dir'], outputs=['wheel_archive'],
+        cache_inputs='wheel_archive_cache_inputs', files=['wheel_archive']
+    ),
+    'deploy_conf': PackageStage('deploy_conf', 'stage_deploy_conf', outputs=['deploy_conf']),
+}
+
+
 class InvirtualenvPlugin(object):
     package_formats = []
+    # The stages run to prepare the package before run_package_command(), names from PACKAGE_STAGES or PackageStage
+    # objects for plugin specific stages
+    package_stages = ['copy_files', 'wheel_packages', 'wheel_archive', 'deploy_conf']
     config_default = ""
     config_types = {}
     default_config_filename = 'invirtualenv.configuration'
@@ -29,12 +101,28 @@ class InvirtualenvPlugin(object):
     hash = None  # PIP hash algorithm to use, can be sha256, sha384, sha512 or None (no hashing)
     noarch = True
 
-    def __init__(self, config_file='deploy.conf', source_dir=''):
+    def __init__(self, config_file='deploy.conf', source_dir='', configuration=None):
+        """
+        Parameters
+        ----------
+        config_file: str, optional
+            The configuration file to use if no configuration is passed
+
+        source_dir: str, optional
+            The directory containing the source files for the package
+
+        configuration: invirtualenv.config.Configuration, optional
+            An already parsed configuration, config_file is parsed if this
+            is not passed
+        """
         self._wheel_hashes = {}
+        self._locked = False
+        self._wheel_archive_compression = None
         self.config_file = config_file
-        self.config = get_configuration_dict(configuration=config_file)
+        self.configuration = load_configuration(configuration if configuration else config_file)
+        self.config = self.configuration.as_dict()
         self.source_dir = source_dir if source_dir else os.getcwd()
-        self.loaded_configuration = get_configuration(configuration=config_file)
+        self.loaded_configuration = self.configuration.config_parser()
         self.add_plugin_configuration()
 
     # Methods that need to be written for each plugin type
@@ -44,10 +132,14 @@ class InvirtualenvPlugin(object):
         """
         pass
 
-    def system_requirements_ok(self):
+    @classmethod
+    def system_requirements_ok(cls):
         """
         Check if all the system requirements for this plugin are met.
 
+        This is a classmethod so the plugin does not need to be constructed
+        (which parses the configuration) to find out if it can be used.
+
         Returns
         -------
         bool
@@ -55,6 +147,21 @@ class InvirtualenvPlugin(object):
         """
         return True
 
+    @classmethod
+    def available_formats(cls):
+        """
+        Formats supported by this plugin class that can be generated on this
+        system, without constructing the plugin.
+
+        Returns
+        -------
+        list
+            Package formats that this plugin supports
+        """
+        if cls.system_requirements_ok():
+            return list(cls.package_formats)
+        return []
+
     @property
     def basepython(self):
         """
@@ -75,26 +182,15 @@ class InvirtualenvPlugin(object):
         as would be used to deploy them.
 
         The full path to the python interpreter is used to avoid shebang
-        line length issues.
+        line length issues.  The interpreter is probed once through the
+        toolchain inventory instead of on every access.
 
         Returns
         -------
         list
             Command that can be used to invoke pip
         """
-        python_executable = find_executable(self.basepython)
-        if not python_executable:
-            python_executable = sys.executable
-        bin_dir = os.path.dirname(python_executable)
-        try:
-            output = subprocess.check_output([python_executable, '-m', 'pip'])  # nosec
-            return [python_executable, '-m', 'pip']
-        except subprocess.CalledProcessError:
-            # Try to work around broken pip module
-            pip_exe = os.path.join(bin_dir, 'pip3')
-            if os.path.exists(pip_exe):
-                return [pip_exe]
-            return [os.path.join(bin_dir, 'pip')]
+        return toolchain_inventory().pip_command(self.basepython)
 
     def get_plugin_config_value(self, key, default=''):
         """
@@ -154,20 +250,315 @@ class InvirtualenvPlugin(object):
         if package_type not in self.supported_formats():
             return None
 
-        use_local_wheels = self.get_plugin_config_value('use_local_wheels', 'false').lower() in ['1', 'true', 'yes', 'on']
-        include_hashes = self.get_plugin_config_value('hash_dependencies', 'false').lower() in ['1', 'true', 'yes', 'on']
-
         original_directory = os.getcwd()
 
-        with InTemporaryDirectory() as tempdir:
-            self.copy_files_to_tempdir(tempdir)
+        if 'wheel_packages' in [stage.name for stage in self.pipeline()]:
+            # Probe the interpreter and build tools concurrently up front
+            toolchain_inventory().probe(interpreters=[self.basepython])
+
+        scratch_dir = scratch_directory(original_directory, self.get_plugin_config_value('scratch_dir', ''))
+        with InTemporaryDirectory(dir=scratch_dir) as tempdir:
+            hashes = self.prepare_package(tempdir)
+            package = self.run_cached_package_command(hashes, tempdir, wheel_dir='wheels')
+            if package and os.path.exists(package):
+                return move_file(package, os.path.join(original_directory, os.path.basename(package)))
+            return package
+
+    def pipeline(self):
+        """
+        Get the stages prepare_package() runs for this plugin
+
+        Returns
+        -------
+        list
+            The PackageStage objects for the package_stages of the plugin
+
+        Raises
+        ------
+        PackageGenerationFailure
+            A stage is unknown or needs an input no earlier stage outputs
+        """
+        stages = []
+        available = set()
+        for stage in self.package_stages:
+            if not isinstance(stage, PackageStage):
+                if stage not in PACKAGE_STAGES:
+                    raise PackageGenerationFailure('Unknown package stage %r' % stage)
+                stage = PACKAGE_STAGES[stage]
+            missing = [name for name in stage.inputs if name not in available]
+            if missing:
+                raise PackageGenerationFailure('Package stage %r needs %r from an earlier stage' % (stage.name, missing))
+            available.update(stage.outputs)
+            stages.append(stage)
+        return stages
+
+    def prepare_package(self, tempdir, shared_wheels=None):
+        """
+        Run the package generation stages that come before the
+        run_package_command(), in the tempdir which must be the current
+        directory.
+
+        The stages run are the package_stages of the plugin, by default
+        this copies the source files, generates the wheels and the wheel
+        archive and writes the deploy.conf for the package.
+
+        Parameters
+        ----------
+        tempdir: str
+            The package build directory
+
+        shared_wheels: dict, optional
+            Wheels generated by other plugins, shared when generating several
+            package types, see generate_shared_wheel_packages()
+
+        Returns
+        -------
+        dict of filename, pip requirements line
+        """
+        cache = self.build_cache()
+        state = {'tempdir': tempdir, 'shared_wheels': shared_wheels}
+        for stage in self.pipeline():
+            state.update(self.run_stage(stage, state, cache))
+        return state.get('hashes', {})
+
+    def build_timestamp(self):
+        """
+        Get the modification time to set on generated files for reproducible
+        builds
+
+        Reproducible builds are enabled by the reproducible setting or by
+        setting the SOURCE_DATE_EPOCH environment variable, which is the
+        timestamp used, defaulting to 0.
+
+        Returns
+        -------
+        int
+            The timestamp or None if reproducible builds are not enabled
+        """
+        timestamp = source_date_epoch()
+        reproducible = self.get_plugin_config_value('reproducible', False)
+        if not isinstance(reproducible, bool):
+            reproducible = str_to_bool(reproducible)
+        if timestamp is None and reproducible:
+            timestamp = 0
+        return timestamp
+
+    def build_cache(self):
+        """
+        Get the build cache set with the build_cache_dir setting
+
+        Returns
+        -------
+        invirtualenv.buildcache.BuildCache
+            The build cache or None if the build cache is not enabled
+        """
+        directory = self.get_plugin_config_value('build_cache_dir', '')
+        if not directory:
+            return None
+        return BuildCache(os.path.expanduser(directory))
+
+    def run_stage(self, stage, state, cache=None):
+        """
+        Run a package stage, restoring its outputs from the build cache if
+        the stage inputs haven't changed
+
+        Parameters
+        ----------
+        stage: PackageStage
+            The stage to run
+
+        state: dict
+            The pipeline state
+
+        cache: invirtualenv.buildcache.BuildCache, optional
+            The build cache
+
+        Returns
+        -------
+        dict
+            The stage outputs
+        """
+        key = None
+        if cache and stage.cache_inputs:
+            inputs = getattr(self, stage.cache_inputs)(state)
+            if inputs is not None:
+                key = cache.key(stage.name, inputs)
+                outputs = cache.restore(key, state['tempdir'])
+                if outputs is not None:
+                    logger.debug('Using the cached outputs of package stage %r', stage.name)
+                    if stage.restore:
+                        getattr(self, stage.restore)(outputs)
+                    return outputs
+        logger.debug('Running package stage %r', stage.name)
+        outputs = getattr(self, stage.method)(state) or {}
+        if key:
+            files = {}
+            for name in stage.files:
+                if outputs.get(name, None):
+                    files[outputs[name]] = os.path.join(state['tempdir'], outputs[name])
+            cache.save(key, outputs, files=files)
+        return outputs
+
+    def run_cached_package_command(self, package_hashes, tempdir, wheel_dir='wheels'):
+        """
+        Run the run_package_command(), restoring the package from the build
+        cache if none of its inputs have changed
+
+        Parameters
+        ----------
+        package_hashes: dict
+            The wheel hashes
+
+        tempdir: str
+            The package build directory
+
+        wheel_dir: str, optional
+            The wheels directory
+
+        Returns
+        -------
+        str
+            The generated package
+        """
+        cache = self.build_cache()
+        inputs = self.package_cache_inputs(tempdir) if cache else None
+        if inputs is None:
+            return self.run_package_command(package_hashes, wheel_dir=wheel_dir)  # pylint: disable=E1128,E1111
+        key = cache.key('package', inputs)
+        outputs = cache.restore(key, tempdir)
+        if outputs is not None:
+            logger.debug('Using the cached package %r', outputs['package'])
+            return os.path.join(tempdir, outputs['package'])
+        package = self.run_package_command(package_hashes, wheel_dir=wheel_dir)  # pylint: disable=E1128,E1111
+        if package and os.path.isfile(package):
+            name = os.path.basename(package)
+            cache.save(key, {'package': name}, files={name: package})
+        return package
+
+    def package_cache_inputs(self, tempdir):
+        """
+        Get the inputs the package generated by run_package_command()
+        depends on, the package is restored from the build cache when these
+        are unchanged.
 
-            wheel_dir = 'wheels'
-            os.makedirs(wheel_dir)
-            hashes = self.generate_wheel_packages(wheel_dir)
-            self.generate_wheel_archive()
+        The inputs are the plugin, the rendered configuration, the package
+        template, the contents of the package build directory and of the
+        files from package_cache_files().
+
+        Parameters
+        ----------
+        tempdir: str
+            The package build directory
+
+        Returns
+        -------
+        list
+            The inputs or None if the package can't be cached
+        """
+        config = json.dumps(self.config, sort_keys=True, default=str)
+        for path, name in [(tempdir, '{tempdir}'), (os.path.realpath(tempdir), '{tempdir}'), (self.source_dir, '{source_dir}')]:
+            if path:
+                config = config.replace(path, name)
+        plugin_module = sys.modules[type(self).__module__]
+        return [
+            type(self).__module__,
+            type(self).__name__,
+            __version__,
+            content_digest([plugin_module.__file__]) if getattr(plugin_module, '__file__', None) else None,
+            self.package_template,
+            config,
+            content_digest([tempdir], root=tempdir),
+            content_digest(self.package_cache_files()),
+        ]
+
+    def package_cache_files(self):
+        """
+        Files outside of the package build directory that
+        run_package_command() uses
+
+        Returns
+        -------
+        list
+            The file paths
+        """
+        return []
+
+    def stage_copy_files(self, state):
+        """
+        Package stage that copies the source files into the package build
+        directory
+        """
+        self.copy_files_to_tempdir(state['tempdir'])
+        return {'source_files': state['tempdir']}
+
+    def stage_wheel_packages(self, state):
+        """
+        Package stage that generates the wheels and their hashes
+        """
+        wheel_dir = 'wheels'
+        os.makedirs(wheel_dir)
+        hashes = self.generate_shared_wheel_packages(wheel_dir, state['shared_wheels'])
+        return {'wheel_dir': wheel_dir, 'hashes': hashes, 'noarch': self.noarch, 'locked': self._locked}
+
+    def wheel_packages_cache_inputs(self, state):
+        """
+        The inputs of the wheel_packages stage, the wheels are only cached
+        when the deps are pinned by a lock file, because unpinned deps can
+        resolve to new versions.
+        """
+        if type(self).generate_wheel_packages is not InvirtualenvPlugin.generate_wheel_packages:
+            return None
+        locked_requirements = read_lock(find_lock_file(self.configuration), self.config['pip'].get('deps', []))
+        if not locked_requirements:
+            return None
+        interpreter = toolchain_inventory().interpreter(self.basepython)
+        if not interpreter:
+            return None
+        return [
+            sorted(locked_requirements),
+            [interpreter[name] for name in ['implementation', 'version', 'python_tag', 'abi_tag', 'platform_tag']],
+            self.hash,
+            __version__,
+        ]
+
+    def restore_wheel_packages(self, outputs):
+        """
+        Apply the changes generating the wheels makes to the plugin when the
+        wheels are restored from the build cache
+        """
+        self.noarch = outputs['noarch']
+        self._locked = outputs['locked']
+        self._wheel_hashes = dict(outputs['hashes'])
+        self.add_plugin_configuration()
+
+    def stage_wheel_archive(self, state):
+        """
+        Package stage that generates the archive of the wheels
+        """
+        return {'wheel_archive': self.generate_wheel_archive()}
+
+    def wheel_archive_cache_inputs(self, state):
+        """
+        The inputs of the wheel_archive stage
+        """
+        if type(self).generate_wheel_archive is not InvirtualenvPlugin.generate_wheel_archive:
+            return None
+        return [
+            self.wheel_archive_compression(),
+            content_digest([state['wheel_dir']], root=state['tempdir']),
+            self.build_timestamp(),
+            __version__,
+        ]
+
+    def stage_deploy_conf(self, state):
+        """
+        Package stage that writes the deploy.conf for the package, with the
+        deps replaced by the generated wheels if the wheels were generated
+        """
+        if 'hashes' in state:
+            include_hashes = self.get_plugin_config_value('hash_dependencies', 'false').lower() in ['1', 'true', 'yes', 'on']
             deps = []
-            for package_name, package_hash in hashes.items():
+            for package_name, package_hash in sorted(state['hashes'].items()):
                 if include_hashes:
                     deps.append('{package_name} --hash={package_hash}'.format(package_name=package_name, package_hash=package_hash))
                 else:
@@ -175,23 +566,127 @@ class InvirtualenvPlugin(object):
             self.config['pip']['deps'] = deps
             if self.hash:
                 self.loaded_configuration['pip']['deps'] = '\n'.join(deps)
-            with open('deploy.conf.unparsed', 'w') as deploy_conf_handle:
-                self.loaded_configuration.write(deploy_conf_handle)
-            with open('deploy.conf.unparsed') as fh:
-                logger.debug('deploy.conf.unparsed %s', fh.read())
-            generate_parsed_config_file('deploy.conf.unparsed', 'deploy.conf')
-            package = self.run_package_command(hashes, wheel_dir=wheel_dir)  # pylint: disable=E1128,E1111
-            if package and os.path.exists(package):
-                source = package
-                dest = os.path.join(original_directory, os.path.basename(package))
+                if self._locked:
+                    # The deps are the pinned packages from the lock and all of the packages they depend on
+                    self.loaded_configuration['pip']['locked'] = 'True'
+        with open('deploy.conf.unparsed', 'w') as deploy_conf_handle:
+            self.loaded_configuration.write(deploy_conf_handle)
+        with open('deploy.conf.unparsed') as fh:
+            logger.debug('deploy.conf.unparsed %s', fh.read())
+        generate_parsed_config_file('deploy.conf.unparsed', 'deploy.conf')
+        return {'deploy_conf': 'deploy.conf'}
+
+    def generate_shared_wheel_packages(self, wheeldir, shared_wheels=None):
+        """
+        Generate wheel packages for all dependencies, reusing the wheels
+        another plugin generated for the same interpreter, dependencies and
+        hash algorithm.
+
+        Plugins that override generate_wheel_packages() always generate their
+        own wheels.
+
+        Parameters
+        ----------
+        wheeldir: str
+            The directory path to store the wheel packages
+
+        shared_wheels: dict, optional
+            Dictionary the generated wheels are shared through, this is
+            updated with the wheels generated by this plugin
+
+        Returns
+        -------
+        dict of filename, pip requirements line
+        """
+        if shared_wheels is None or type(self).generate_wheel_packages is not InvirtualenvPlugin.generate_wheel_packages:
+            return self.generate_wheel_packages(wheeldir)
+
+        key = json.dumps([self.pip_cmd, self.config['pip'].get('deps', []), self.hash])
+        if key not in shared_wheels:
+            hashes = self.generate_wheel_packages(wheeldir)
+            shared_wheels[key] = {
+                'wheel_dir': os.path.abspath(wheeldir),
+                'hashes': dict(hashes),
+                'noarch': self.noarch,
+                'locked': self._locked,
+            }
+            return hashes
+
+        shared = shared_wheels[key]
+        logger.debug('Using the wheel packages in %r', shared['wheel_dir'])
+        for filename in sorted(os.listdir(shared['wheel_dir'])):
+            source = os.path.join(shared['wheel_dir'], filename)
+            dest = os.path.join(wheeldir, filename)
+            try:
+                os.link(source, dest)
+            except OSError:
                 shutil.copyfile(source, dest)
-                return dest
-            return package
+        self.noarch = shared['noarch']
+        self._locked = shared['locked']
+        self._wheel_hashes = dict(shared['hashes'])
+        self.add_plugin_configuration()
+        return dict(shared['hashes'])
+
+    def wheel_cache_key(self):
+        """
+        Get the key of the shared wheel cache, the build inputs that the
+        wheel filenames don't identify.  These are the invirtualenv version
+        and the versions of the unpinned build requirements, the configparser
+        backport and the packaging tools of the interpreter the wheels are
+        built with.
+
+        Returns
+        -------
+        list
+            The wheel cache key
+        """
+        # The packaging tools may have just been upgraded, so probe them again
+        toolchain_inventory().invalidate(self.basepython)
+        interpreter = toolchain_inventory().interpreter(self.basepython) or {}
+        return [
+            __version__,
+            installed_version('configparser'),
+            [interpreter.get(name) for name in ['pip', 'setuptools', 'wheel']],
+        ]
+
+    def wheel_archive_compression(self):
+        """
+        Get the compression of the wheel archive from the
+        wheel_archive_compression setting, it is only checked once so the
+        zstd fallback warning is only logged once
+
+        Returns
+        -------
+        str
+            The compression to use
+        """
+        if self._wheel_archive_compression is None:
+            self._wheel_archive_compression = archive_compression(self.get_plugin_config_value('wheel_archive_compression', 'gz'))
+        return self._wheel_archive_compression
 
     def generate_wheel_archive(self, filename=None):
+        """
+        Generate an archive of the wheels directory
+
+        The compression is set with the wheel_archive_compression setting,
+        which can be store, gz, xz or zstd and defaults to gz.
+
+        Parameters
+        ----------
+        filename: str, optional
+            The archive file to write, defaults to wheels with the extension
+            for the compression
+
+        Returns
+        -------
+        str
+            The archive filename
+        """
+        compression = self.wheel_archive_compression()
         if not filename:
-            filename = 'wheels.tar.gz'
-        subprocess.check_call(['tar', '-czf', filename, 'wheels'])  # nosec
+            filename = archive_filename('wheels', compression)
+        write_archive(filename, 'wheels', compression=compression, mtime=self.build_timestamp())
+        return filename
 
     def generate_wheel_packages(self, wheeldir):
         """
@@ -214,51 +709,44 @@ class InvirtualenvPlugin(object):
             logger.debug('Making sure the wheel package is installed')
             subprocess.check_call(self.pip_cmd + ['install', '-U', 'pip'])  # nosec
             subprocess.check_call(self.pip_cmd + ['install', 'wheel'])  # nosec
-            deps = self.config['pip'].get('deps', []) + ['invirtualenv', 'configparser']
-            cmd = self.pip_cmd + ['wheel', '-w', '.'] + deps
-            logger.debug('Running pip command %r to generate wheel packages', cmd)
-            try:
-                output = subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode()  # nosec
-            except subprocess.CalledProcessError as error:
-                logger.warning('Exception occurred while generating wheel packages, downloading source packages')
-                if error.stdout:
-                    logger.error(error.stdout.decode())
-                if error.stderr:
-                    logger.error(error.stderr.decode())
-                cmd = self.pip_cmd + ['download', '-d', '.'] + deps
-                logger.debug('Running pip command %r to download missing packages', cmd)
-                try:
-                    output = subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode()  # nosec
-                except subprocess.CalledProcessError as error:
-                    logger.warning('Exception occurred while downloading source packages')
-                    if error.stdout:
-                        logger.error(error.stdout.decode())
-                    if error.stderr:
-                        logger.error(error.stderr.decode())
-                    raise
-            for filename in os.listdir('.'):
-                if filename.endswith('.whl'):
-                    split_filename = os.path.basename(filename).split('-')
-                    file_wheel_name = filename
-                    file_wheel_version = None
-                    if len(split_filename) > 2:
-                        file_wheel_name = split_filename[0]
-                        file_wheel_version = split_filename[1]
-                    if self.noarch and not filename.endswith('none-any.whl'):
-                        self.noarch = False
-                    cmd = self.pip_cmd + ['hash']
-                    if self.hash:
-                        cmd += ['-a', self.hash]
-                    cmd += [filename]
-                    logger.debug('Running pip command %r to generate package hash for %r', cmd, filename)
-                    hash_result = subprocess.check_output(cmd).decode()  # nosec
-                    if file_wheel_name and file_wheel_version:
-                        logger.debug("{file_wheel_name}=={file_wheel_version}".format(**locals()))
-                        hashes['{file_wheel_name}=={file_wheel_version}'.format(**locals())] = '='.join(hash_result.split(os.linesep)[1].split('=')[1:])
-                        logger.debug('Got requirements line %r', hashes['{file_wheel_name}=={file_wheel_version}'.format(**locals())])
-                    else:
-                        hashes[filename] = '='.join(hash_result.split(os.linesep)[1].split('=')[1:])  # nosec
-                        logger.debug('Got requirements line %r', hashes[filename])
+            deps = self.config['pip'].get('deps', [])
+            pinned = None
+            lock_file = find_lock_file(self.configuration)
+            locked_requirements = read_lock(lock_file, deps)
+            if locked_requirements:
+                logger.debug('Using the pinned requirements from the lock file %r', lock_file)
+                pinned = [requirement.split()[0] for requirement in locked_requirements]
+                deps = []
+            wheel_cache = None
+            if self.config['pip'].get('wheel_cache', True):
+                wheel_cache = WheelCache(max_size=self.config['pip'].get('wheel_cache_size', None), key=self.wheel_cache_key())
+            unbuilt = build_wheelhouse(
+                self.pip_cmd, deps + ['invirtualenv', 'configparser'], '.', wheel_cache=wheel_cache, pinned=pinned,
+                jobs=self.config['pip'].get('build_jobs', 0),
+                env=compiler_cache_environment(self.config['pip'].get('compiler_cache', ''), self.config['pip'].get('compiler_cache_size', None))
+            )
+            if unbuilt:
+                logger.warning('Including source packages that could not be built as wheels: %r', unbuilt)
+            self._locked = bool(pinned) and not unbuilt
+            wheel_files = sorted(filename for filename in os.listdir('.') if filename.endswith('.whl'))
+            logger.debug('Generating package hashes for %r', wheel_files)
+            wheel_hashes = hash_files(wheel_files, algorithm=self.hash)
+            for filename in wheel_files:
+                split_filename = os.path.basename(filename).split('-')
+                file_wheel_name = filename
+                file_wheel_version = None
+                if len(split_filename) > 2:
+                    file_wheel_name = split_filename[0]
+                    file_wheel_version = split_filename[1]
+                if self.noarch and not filename.endswith('none-any.whl'):
+                    self.noarch = False
+                if file_wheel_name and file_wheel_version:
+                    logger.debug("{file_wheel_name}=={file_wheel_version}".format(**locals()))
+                    hashes['{file_wheel_name}=={file_wheel_version}'.format(**locals())] = wheel_hashes[filename]
+                    logger.debug('Got requirements line %r', hashes['{file_wheel_name}=={file_wheel_version}'.format(**locals())])
+                else:
+                    hashes[filename] = wheel_hashes[filename]
+                    logger.debug('Got requirements line %r', hashes[filename])
         self._wheel_hashes = hashes
         self.add_plugin_configuration()
         return hashes
@@ -290,7 +778,7 @@ class InvirtualenvPlugin(object):
                 hashes = self.generate_wheel_packages(wheel_dir)
 
             deps = []
-            for package_name, package_hash in hashes.items():
+            for package_name, package_hash in sorted(hashes.items()):
                 if use_local_wheels and include_hashes:
                     deps.append('{package_name} --hash={package_hash}'.format(package_name=package_name, package_hash=package_hash))
                 else:
@@ -300,5 +788,5 @@ class InvirtualenvPlugin(object):
             if use_local_wheels or include_hashes:
                 self.loaded_configuration['pip']['deps'] = '\n'.join(deps)
 
-        template = Template(template_str)
+        template = compile_template(template_str)
         return template.render(self.config)
@@ -0,0 +1,106 @@
+# Copyright (c) 2016, Yahoo Inc.
+# Copyrights licensed under the BSD License
+# See the accompanying LICENSE.txt file for terms.
+
+"""
+Run the phases of an operation concurrently in dependency order
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
+
+
+logger = logging.getLogger(__name__)  # pylint: disable=C0103
+
+
+class Phase(object):
+    """
+    A phase of an operation
+
+    Parameters
+    ----------
+    name: str
+        The phase name
+
+    function: callable
+        The function that runs the phase, it is called without arguments
+
+    requires: list, optional
+        The names of the phases that must complete before this phase starts
+    """
+    def __init__(self, name, function, requires=None):
+        self.name = name
+        self.function = function
+        self.requires = list(requires) if requires else []
+
+    def __repr__(self):
+        return 'Phase(%r, requires=%r)' % (self.name, self.requires)
+
+
+def run_phases(phases, max_workers=None, on_start=None):
+    """
+    Run phases, each phase starts as soon as the phases it requires have
+    completed so independent phases run at the same time
+
+    Requirements on phases that are not in the list are ignored, so optional
+    phases can be left out.  If a phase fails no new phases are started and
+    the exception is raised once the running phases have completed.
+
+    Parameters
+    ----------
+    phases: list
+        The Phase objects to run
+
+    max_workers: int, optional
+        The maximum number of phases to run at the same time, defaults to the
+        number of phases
+
+    on_start: callable, optional
+        Called with each Phase before it starts, the calls are made one at a
+        time from the calling thread so they can write output without
+        interleaving
+
+    Returns
+    -------
+    dict
+        Dictionary of phase name and the value the phase function returned
+
+    Raises
+    ------
+    ValueError
+        The phase requirements contain a cycle
+    """
+    names = {phase.name for phase in phases}
+    pending = {phase.name: phase for phase in phases}
+    requires = {phase.name: set(phase.requires) & names for phase in phases}
+    results = {}
+    if not phases:
+        return results
+
+    error = None
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(phases)) as executor:
+        while pending or running:
+            if error is None:
+                for name in [name for name in list(pending) if requires[name] <= set(results)]:
+                    logger.debug('Starting phase %r', name)
+                    phase = pending.pop(name)
+                    if on_start:
+                        on_start(phase)
+                    running[executor.submit(phase.function)] = name
+            if not running:
+                if error is None and pending:
+                    raise ValueError('The requirements of the phases %s contain a cycle' % ', '.join(sorted(pending)))
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                    logger.debug('Completed phase %r', name)
+                except Exception as phase_error:  # pylint: disable=W0703
+                    logger.debug('Phase %r failed: %r', name, phase_error)
+                    if error is None:
+                        error = phase_error
+    if error is not None:
+        raise error
+    return results
@@ -0,0 +1,275 @@
+# Copyright (c) 2016, Yahoo Inc.
+# Copyrights licensed under the BSD License
+# See the accompanying LICENSE.txt file for terms.
+
+"""
+Inventory of the interpreters and build tools available on the host
+"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import subprocess  # nosec
+import sys
+import threading
+from .utility import cache_directory, find_executable, read_json_file, write_json_file
+
+
+logger = logging.getLogger(__name__)  # pylint: disable=C0103
+
+
+# Commands probed by ToolchainInventory.probe()
+TOOL_COMMANDS = ['docker', 'rpmbuild', 'virtualenv']
+INTERPRETER_INDEX_FILENAME = 'interpreters.json'
+
+# Script run with each interpreter to describe it, it prints a json dictionary
+INTERPRETER_PROBE = r"""
+import importlib.util, json, platform, sys, sysconfig
+
+def version(module):
+    try:
+        if importlib.util.find_spec(module) is None:
+            return None
+        return getattr(__import__(module), '__version__', '')
+    except Exception:
+        return None
+
+def installed(module):
+    try:
+        return importlib.util.find_spec(module) is not None
+    except Exception:
+        return False
+
+python_tag = 'py%d%d' % sys.version_info[:2]
+abi_tag = 'none'
+platform_tag = sysconfig.get_platform().replace('-', '_').replace('.', '_')
+try:
+    try:
+        from packaging import tags
+    except ImportError:
+        from pip._vendor.packaging import tags
+    tag = next(iter(tags.sys_tags()))
+    python_tag, abi_tag, platform_tag = tag.interpreter, tag.abi, tag.platform
+except Exception:
+    pass
+
+pip_version = version('pip')
+print(json.dumps({
+    'executable': sys.executable,
+    'version': platform.python_version(),
+    'implementation': platform.python_implementation(),
+    'python_tag': python_tag,
+    'abi_tag': abi_tag,
+    'platform_tag': platform_tag,
+    'purelib': sysconfig.get_paths()['purelib'],
+    'pip': pip_version if installed('pip._internal') else None,
+    'setuptools': version('setuptools'),
+    'wheel': version('wheel'),
+    'virtualenv': version('virtualenv'),
+    'venv': installed('venv') and installed('ensurepip'),
+}))
+"""
+
+
+class ToolchainInventory(object):
+    """
+    Inventory of the python interpreters and build tools on the host
+
+    Command lookups and interpreter probes are memoized for the life of the
+    object.  Interpreter probes are also stored on disk and reused until the
+    interpreter binary or its site-packages directory is modified.
+
+    Parameters
+    ----------
+    index_filename : str, optional
+        The file to store the interpreter probes in, defaults to a file in
+        the invirtualenv cache directory
+    """
+    def __init__(self, index_filename=None):
+        if index_filename is None:
+            directory = cache_directory()
+            if directory:
+                index_filename = os.path.join(directory, INTERPRETER_INDEX_FILENAME)
+        self.index_filename = index_filename
+        self._executables = {}
+        self._interpreters = {}
+        self._pip_commands = {}
+        self._lock = threading.Lock()
+
+    def executable(self, command):
+        """
+        Find a command in the path
+
+        Parameters
+        ----------
+        command : str
+            The command to find
+
+        Returns
+        -------
+        str
+            Path to the command or None if it is not found
+        """
+        if command not in self._executables:
+            self._executables[command] = find_executable(command)
+        return self._executables[command]
+
+    @staticmethod
+    def _state(filename, purelib=None):
+        try:
+            state = [os.stat(filename).st_mtime]
+            if purelib:
+                state.append(os.stat(purelib).st_mtime if os.path.exists(purelib) else None)
+            return state
+        except OSError:
+            return None
+
+    def _probe_interpreter(self, python_executable):
+        logger.debug('Probing python interpreter %r', python_executable)
+        try:
+            output = subprocess.check_output([python_executable, '-c', INTERPRETER_PROBE])  # nosec
+            return json.loads(output.decode())
+        except (OSError, ValueError, subprocess.CalledProcessError):
+            logger.debug('Unable to probe python interpreter %r', python_executable)
+            return None
+
+    def interpreter(self, python):
+        """
+        Get information about a python interpreter
+
+        Parameters
+        ----------
+        python : str
+            The interpreter name or path
+
+        Returns
+        -------
+        dict
+            Dictionary with the interpreter version, wheel tags and the
+            versions of the packaging tools installed in it, or None if the
+            interpreter was not found
+        """
+        python_executable = python if os.path.isabs(python) else self.executable(python)
+        if not python_executable:
+            return None
+        python_executable = os.path.abspath(python_executable)
+        if python_executable in self._interpreters:
+            return self._interpreters[python_executable]
+
+        index = read_json_file(self.index_filename, default={})
+        entry = index.get(python_executable, None)
+        if entry and entry['state'] == self._state(python_executable, entry['info'].get('purelib')):
+            info = entry['info']
+        else:
+            info = self._probe_interpreter(python_executable)
+            if info:
+                with self._lock:
+                    index = read_json_file(self.index_filename, default={})
+                    index[python_executable] = {'state': self._state(python_executable, info['purelib']), 'info': info}
+                    write_json_file(self.index_filename, index)
+        self._interpreters[python_executable] = info
+        return info
+
+    def invalidate(self, python=None):
+        """
+        Discard the memoized results, for a single interpreter if python is
+        passed, so they are probed again.
+
+        Parameters
+        ----------
+        python : str, optional
+            The interpreter name or path to discard the results for
+        """
+        if python is None:
+            self._executables = {}
+            self._interpreters = {}
+            self._pip_commands = {}
+            return
+        python_executable = python if os.path.isabs(python) else self.executable(python)
+        if python_executable:
+            self._interpreters.pop(os.path.abspath(python_executable), None)
+        self._pip_commands.pop(python, None)
+
+    def probe(self, interpreters=None, commands=None):
+        """
+        Probe interpreters and commands in parallel
+
+        Parameters
+        ----------
+        interpreters : list, optional
+            Interpreter names or paths to probe, defaults to the running
+            interpreter
+
+        commands : list, optional
+            Commands to find, defaults to TOOL_COMMANDS
+
+        Returns
+        -------
+        dict
+            Dictionary with an 'interpreters' dictionary of interpreter
+            information and an 'executables' dictionary of command paths
+        """
+        interpreters = [sys.executable] if interpreters is None else list(interpreters)
+        commands = TOOL_COMMANDS if commands is None else list(commands)
+        with ThreadPoolExecutor(max_workers=max(len(interpreters) + len(commands), 1)) as executor:
+            futures = [executor.submit(self.executable, command) for command in commands]
+            infos = list(executor.map(self.interpreter, interpreters))
+            for future in futures:
+                future.result()
+        return {
+            'interpreters': dict(zip(interpreters, infos)),
+            'executables': {command: self.executable(command) for command in commands},
+        }
+
+    def pip_command(self, python):
+        """
+        Get the command to run pip with a python interpreter
+
+        The full path to the python interpreter is used to avoid shebang
+        line length issues.
+
+        Parameters
+        ----------
+        python : str
+            The interpreter name or path, the running interpreter is used
+            if it is not found
+
+        Returns
+        -------
+        list
+            Command that can be used to invoke pip
+        """
+        if python not in self._pip_commands:
+            python_executable = self.executable(python) if python else None
+            if not python_executable:
+                python_executable = sys.executable
+            info = self.interpreter(python_executable)
+            if info and info['pip']:
+                command = [python_executable, '-m', 'pip']
+            else:
+                # Try to work around broken pip module
+                bin_dir = os.path.dirname(python_executable)
+                command = [os.path.join(bin_dir, 'pip')]
+                pip_exe = os.path.join(bin_dir, 'pip3')
+                if os.path.exists(pip_exe):
+                    command = [pip_exe]
+            self._pip_commands[python] = command
+        return list(self._pip_commands[python])
+
+
+_toolchain_inventory = None
+
+
+def toolchain_inventory():
+    """
+    Get the toolchain inventory for this process
+
+    Returns
+    -------
+    ToolchainInventory
+        The toolchain inventory
+    """
+    global _toolchain_inventory  # pylint: disable=W0603
+    if _toolchain_inventory is None:
+        _toolchain_inventory = ToolchainInventory()
+    return _toolchain_inventory
@@ -6,18 +6,34 @@
 General utility functionality module
 """
 from __future__ import print_function
+import errno
+import functools
+import json
 import logging
 import os
+import re
+import shutil
+import socket
+import tempfile
 import textwrap
 import sys
-from jinja2 import Template
-from distutils.spawn import find_executable
+from .contextmanager import SCRATCH_PREFIX
 from .exceptions import CommandNotFound
 
 
 logger = logging.getLogger(__name__)  # pylint: disable=C0103
 
 
+# Strings that start jinja2 template blocks, strings without any of these
+# render to themselves.
+TEMPLATE_MARKERS = ('{{', '{%', '{#')
+
+# Number of compiled templates to keep in memory
+TEMPLATE_CACHE_SIZE = 1024
+
+_template_environment = None
+
+
 def get_terminal_size():
     """
     Get the terminal rows and columns if we are running on an
@@ -91,6 +107,30 @@ def display_header(
     outfile.flush()
 
 
+def find_executable(executable, path=None):
+    """
+    Search the path for an executable
+
+    This replaces distutils.spawn.find_executable() which is slow to import
+    and deprecated.
+
+    Parameters
+    ----------
+    executable : str
+        The executable to find
+
+    path : str, optional
+        The os.pathsep separated list of directories to search, defaults to
+        the PATH environment variable
+
+    Returns
+    -------
+    str
+        The path to the executable or None if it is not found
+    """
+    return shutil.which(executable, path=path)
+
+
 def which(command):
     """
     Function searches the path for the command executable
@@ -208,7 +248,95 @@ def str_to_dict(value):
     return result_dict
 
 
-def str_format_env(value):
+def template_environment():
+    """
+    Get the jinja2 Environment shared by all the templates rendered by
+    invirtualenv.
+
+    Returns
+    -------
+    jinja2.Environment
+        The template environment
+    """
+    global _template_environment  # pylint: disable=W0603
+    if _template_environment is None:
+        from jinja2 import Environment
+        _template_environment = Environment()
+    return _template_environment
+
+
+def has_template_syntax(value):
+    """
+    Check if a string contains any jinja2 template syntax
+
+    Parameters
+    ----------
+    value : str
+        The string to check
+
+    Returns
+    -------
+    bool
+        True if the string contains template syntax
+    """
+    return any(marker in value for marker in TEMPLATE_MARKERS)
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(value):
+    """
+    Compile a template string, reusing previously compiled templates
+
+    Parameters
+    ----------
+    value : str
+        The template string
+
+    Returns
+    -------
+    jinja2.Template
+        The compiled template
+    """
+    return template_environment().from_string(value)
+
+
+def render_template(value, environment=None, cache=True):
+    """
+    Render a template string
+
+    Strings that contain no template syntax are returned without compiling
+    them.
+
+    Parameters
+    ----------
+    value : str
+        The template string
+
+    environment : dict, optional
+        The variables to render the template with, defaults to the
+        environment variables
+
+    cache : bool, optional
+        Keep the compiled template in the template cache, default=True
+
+    Returns
+    -------
+    str
+        The rendered string
+    """
+    if not has_template_syntax(value) and '\r' not in value:
+        # Rendering a template removes a single trailing newline
+        return value[:-1] if value.endswith('\n') else value
+    if environment is None:
+        environment = dict(os.environ)
+    if cache:
+        template = compile_template(value)
+    else:
+        template = template_environment().from_string(value)
+    return template.render(environment)
+
+
+def str_format_env(value, environment=None):
     """
     Substitute values with environment variables in a string
 
@@ -217,18 +345,141 @@ def str_format_env(value):
     value : str
         The string object to be formatted and converted into a list
 
+    environment : dict, optional
+        The variables to substitute, defaults to the environment variables.
+        Passing this avoids copying the environment for every value.
+
     Returns
     -------
     str
         With env variable values substituded
     """
-    template = Template(value)
-    result = template.render(**os.environ)
+    result = render_template(value, environment)
     if result != value:
         logger.debug('Rendered: %r to %r', value, result)
     return result
 
 
+def template_variables(value):
+    """
+    Get the names of the variables a template string references
+
+    Parameters
+    ----------
+    value : str
+        The template string
+
+    Returns
+    -------
+    set
+        The names of the variables that are not defined in the template
+    """
+    if not has_template_syntax(value):
+        return set()
+    from jinja2 import meta
+    return meta.find_undeclared_variables(template_environment().parse(value))
+
+
+def cache_directory(*subdirectories):
+    """
+    Get the invirtualenv cache directory, creating it if it does not exist
+
+    The cache directory defaults to ~/.cache/invirtualenv (or
+    $XDG_CACHE_HOME/invirtualenv) and can be changed by setting the
+    INVIRTUALENV_CACHE_DIR environment variable.  Setting the
+    INVIRTUALENV_NO_CACHE environment variable to true disables caching.
+
+    Parameters
+    ----------
+    subdirectories : str, optional
+        Subdirectories of the cache directory to return
+
+    Returns
+    -------
+    str
+        The path to the cache directory or None if caching is disabled or
+        the directory could not be created
+    """
+    if str_to_bool(os.environ.get('INVIRTUALENV_NO_CACHE', 'false')):
+        return None
+    base_directory = os.environ.get('INVIRTUALENV_CACHE_DIR', '')
+    if not base_directory:
+        base_directory = os.path.join(
+            os.environ.get('XDG_CACHE_HOME', '') or os.path.expanduser('~/.cache'), 'invirtualenv'
+        )
+    directory = os.path.join(base_directory, *subdirectories)
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:  # pragma: no cover
+        logger.debug('Unable to create cache directory %r, caching is disabled', directory)
+        return None
+    return directory
+
+
+def read_json_file(filename, default=None):
+    """
+    Read a json file, returning a default value if it is missing or corrupt
+
+    Parameters
+    ----------
+    filename : str
+        The json file to read
+
+    default : object, optional
+        The value to return if the file cannot be read
+
+    Returns
+    -------
+    object
+        The deserialized json data
+    """
+    if not filename:
+        return default
+    try:
+        with open(filename) as handle:
+            return json.load(handle)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def write_json_file(filename, data):
+    """
+    Atomically write data to a json file
+
+    The data is written to a temporary file in the same directory and renamed
+    into place so concurrent readers never see a partially written file.
+    Errors are logged and ignored since this is used for cache files.
+
+    Parameters
+    ----------
+    filename : str
+        The json file to write
+
+    data : object
+        The json serializable data to write
+
+    Returns
+    -------
+    bool
+        True if the file was written, False otherwise
+    """
+    if not filename:
+        return False
+    directory = os.path.dirname(filename) or '.'
+    temp_filename = None
+    try:
+        file_descriptor, temp_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'w') as handle:
+            json.dump(data, handle)
+        os.replace(temp_filename, filename)
+    except (IOError, OSError, TypeError, ValueError) as error:
+        logger.debug('Unable to write cache file %r: %s', filename, error)
+        if temp_filename and os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        return False
+    return True
+
+
 def change_uid_gid(user_uid=None, user_gid=None):  # pragma: no cover
     """
     preexec_fn to change the uid/gid when using subprocess
@@ -333,3 +584,321 @@ def update_recursive(basedict, updatedict):
 
     """
     return dict(update_recursive_generator(basedict, updatedict))
+
+
+def source_date_epoch():
+    """
+    Get the timestamp set in the SOURCE_DATE_EPOCH environment variable,
+    which reproducible builds use as the modification time of generated
+    files
+
+    Returns
+    -------
+    int
+        The timestamp or None if SOURCE_DATE_EPOCH is not set to a valid
+        timestamp
+    """
+    value = os.environ.get('SOURCE_DATE_EPOCH', '').strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        logger.debug('Ignoring the invalid SOURCE_DATE_EPOCH %r', value)
+        return None
+
+
+def installed_version(name):
+    """
+    Get the version of an installed distribution
+
+    Parameters
+    ----------
+    name : str
+        The distribution name
+
+    Returns
+    -------
+    str
+        The installed version or None if the distribution is not installed
+    """
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+    except ImportError:  # pragma: no cover
+        import pkg_resources
+        try:
+            return pkg_resources.get_distribution(name).version
+        except pkg_resources.DistributionNotFound:
+            return None
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return None
+
+
+# The linux ioctl that makes a file share the data blocks of another file,
+# fcntl.FICLONE on python 3.12+
+FICLONE = 0x40049409
+
+# Bytes to copy per copy_file_range() call
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def _reflink(source_handle, dest_handle):
+    if not sys.platform.startswith('linux'):
+        return False
+    import fcntl
+    try:
+        fcntl.ioctl(dest_handle.fileno(), getattr(fcntl, 'FICLONE', FICLONE), source_handle.fileno())
+    except OSError:
+        return False
+    return True
+
+
+def reflink_file(source, dest):
+    """
+    Create dest as a reflink of source, sharing its data blocks, on file
+    systems that support it such as btrfs and xfs
+
+    Parameters
+    ----------
+    source : str
+        The file to clone
+
+    dest : str
+        The file to create, it is not created if the reflink fails
+
+    Returns
+    -------
+    bool
+        True if the reflink was created
+    """
+    with open(source, 'rb') as source_handle, open(dest, 'wb') as dest_handle:
+        linked = _reflink(source_handle, dest_handle)
+    if not linked:
+        os.remove(dest)
+    return linked
+
+
+def clone_tree(source, dest, hardlinks=True):
+    """
+    Copy a directory tree as quickly as the file system allows
+
+    Files are reflinked where the file system supports it, otherwise they are
+    hard linked if hardlinks is set, otherwise they are copied.  The method
+    is picked using the first file and used for the whole tree.  Symlinks are
+    copied as symlinks and the file modes are preserved.
+
+    Hard linked files share their inode with the source, so files in the
+    copy must be replaced rather than changed in place, and changing their
+    ownership or mode changes the source too.
+
+    Parameters
+    ----------
+    source : str
+        The directory to copy
+
+    dest : str
+        The directory to create
+
+    hardlinks : bool, optional
+        Hard link the files if reflinks are not supported, default=True
+
+    Returns
+    -------
+    str
+        The method used, reflink, hardlink or copy
+    """
+    method = None
+    os.makedirs(dest)
+    for root, dirnames, filenames in os.walk(source):
+        dest_root = os.path.join(dest, os.path.relpath(root, source))
+        for name in list(dirnames):
+            source_name = os.path.join(root, name)
+            if os.path.islink(source_name):
+                # os.walk doesn't descend into directory symlinks, copy the link
+                os.symlink(os.readlink(source_name), os.path.join(dest_root, name))
+                continue
+            os.mkdir(os.path.join(dest_root, name))
+            shutil.copymode(source_name, os.path.join(dest_root, name))
+        for name in filenames:
+            source_name = os.path.join(root, name)
+            dest_name = os.path.join(dest_root, name)
+            if os.path.islink(source_name):
+                os.symlink(os.readlink(source_name), dest_name)
+                continue
+            if method is None:
+                method = 'copy'
+                if reflink_file(source_name, dest_name):
+                    method = 'reflink'
+                    shutil.copymode(source_name, dest_name)
+                    continue
+                if hardlinks:
+                    try:
+                        os.link(source_name, dest_name)
+                        method = 'hardlink'
+                        continue
+                    except OSError:
+                        pass
+            if method == 'reflink':
+                if not reflink_file(source_name, dest_name):
+                    shutil.copy2(source_name, dest_name)
+                shutil.copymode(source_name, dest_name)
+            elif method == 'hardlink':
+                os.link(source_name, dest_name)
+            else:
+                shutil.copy2(source_name, dest_name)
+    logger.debug('Copied %r to %r using %s', source, dest, method or 'copy')
+    return method or 'copy'
+
+
+def clone_file(source, dest):
+    """
+    Copy a file's contents without reading it into user space
+
+    A reflink, which shares the data blocks of the source, is used on file
+    systems that support it such as btrfs and xfs, falling back to
+    copy_file_range(), which lets the kernel or a network file server do the
+    copy, and then to a buffered copy.
+
+    Parameters
+    ----------
+    source : str
+        The file to copy
+
+    dest : str
+        The file to create or overwrite
+    """
+    with open(source, 'rb') as source_handle, open(dest, 'wb') as dest_handle:
+        if _reflink(source_handle, dest_handle):
+            return
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while os.copy_file_range(source_handle.fileno(), dest_handle.fileno(), COPY_CHUNK_SIZE):
+                    pass
+                return
+            except OSError:
+                source_handle.seek(0)
+                dest_handle.seek(0)
+                dest_handle.truncate()
+        shutil.copyfileobj(source_handle, dest_handle)
+
+
+def move_file(source, dest):
+    """
+    Move a file, replacing dest atomically
+
+    The file is renamed if source and dest are on the same file system,
+    otherwise it is cloned to a temporary file next to dest, which is renamed
+    to dest, so dest never contains a partial file.
+
+    Parameters
+    ----------
+    source : str
+        The file to move
+
+    dest : str
+        The destination filename
+
+    Returns
+    -------
+    str
+        The destination filename
+    """
+    try:
+        os.replace(source, dest)
+        return dest
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+    logger.debug('Copying %r to %r on another file system', source, dest)
+    temp_handle, temp_filename = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dest)), prefix='.' + os.path.basename(dest))
+    os.close(temp_handle)
+    try:
+        clone_file(source, temp_filename)
+        shutil.copymode(source, temp_filename)
+        os.replace(temp_filename, dest)
+    finally:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+    os.remove(source)
+    return dest
+
+
+def _process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def remove_stale_scratch_directories(directory):
+    """
+    Remove the temporary build directories left in a directory by processes
+    on this host that were killed before they could remove them
+
+    Parameters
+    ----------
+    directory : str
+        The directory the temporary build directories are created in
+    """
+    pattern = re.compile(re.escape(SCRATCH_PREFIX + socket.gethostname()) + r'-(\d+)-')
+    try:
+        names = os.listdir(directory)
+    except OSError:  # pragma: no cover
+        return
+    for name in names:
+        match = pattern.match(name)
+        if not match or _process_running(int(match.group(1))):
+            continue
+        logger.debug('Removing the stale build directory %r', os.path.join(directory, name))
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def scratch_directory(destination, configured=None):
+    """
+    Get the directory to create package build directories in
+
+    Generated packages are moved from the build directory to their
+    destination, which is a rename when both are on the same file system.
+    When the system temporary directory is on another file system the build
+    directories are created in the parent directory of the destination, or
+    the destination itself if the parent is on another file system.  Build
+    directories that processes which were killed left in the directory are
+    removed.
+
+    Parameters
+    ----------
+    destination : str
+        The directory the generated packages are moved to
+
+    configured : str, optional
+        The scratch_dir setting
+
+    Returns
+    -------
+    str
+        The directory, or None to use the default temporary directory, which
+        is used when TMPDIR is set or it is on the destination file system
+    """
+    if configured:
+        configured = os.path.expanduser(configured)
+        os.makedirs(configured, exist_ok=True)
+        remove_stale_scratch_directories(configured)
+        return configured
+    if os.environ.get('TMPDIR', None):
+        return None
+    try:
+        destination_device = os.stat(destination).st_dev
+        if os.stat(tempfile.gettempdir()).st_dev == destination_device:
+            return None
+        parent = os.path.dirname(os.path.abspath(destination))
+        if os.access(parent, os.W_OK) and os.stat(parent).st_dev == destination_device:
+            destination = parent
+    except OSError:  # pragma: no cover
+        return None
+    remove_stale_scratch_directories(destination)
+    return destination
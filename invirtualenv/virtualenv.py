@@ -6,27 +6,58 @@
 Functions for creating and managing python virtual environments
 """
 from __future__ import print_function
+import base64
+import csv
 import getpass
+import glob
 import hashlib
 import json
 import logging
 import os
 from pwd import getpwnam
+import re
 import shutil
 import subprocess  # nosec
 import sys
+import tempfile
+import time
 
 logger = logging.getLogger(__name__)  # pylint: disable=C0103
 
 try:
     import venv
     BUILTIN_VENV = True
-    logger.warning('The venv module is missing in this interpreter')
 except ImportError:
     BUILTIN_VENV = False
+    logger.warning('The venv module is missing in this interpreter')
 
 from .exceptions import BuildException
-from .utility import chown_recursive, which
+from .toolchain import toolchain_inventory
+from .utility import cache_directory, chown_recursive, clone_tree, read_json_file, which, write_json_file
+from .wheelhouse import package_requirement, wheel_files
+
+
+# The packages used to install and build packages in a virtualenv
+PACKAGE_TOOLS = ['pip', 'setuptools', 'wheel']
+
+# Seconds before the package tool wheels in the seed cache are downloaded
+# again
+SEED_CACHE_MAX_AGE = 24 * 60 * 60
+
+# Directory in the virtualenv directory containing the base virtualenvs new
+# virtualenvs are cloned from
+BASE_VIRTUALENV_DIRECTORY = '.invirtualenv-base'
+
+# File in a base virtualenv recording where it was built
+BASE_VIRTUALENV_INFO_FILENAME = '.invirtualenv-base.json'
+
+# Seconds before a base virtualenv is rebuilt, so the package tools in it
+# stay up to date
+BASE_VIRTUALENV_MAX_AGE = 24 * 60 * 60
+
+# Longest shebang line the kernel runs, longer interpreter paths use a sh
+# exec header
+MAX_SHEBANG_LENGTH = 127
 
 
 def default_virtualenv_directory():
@@ -60,9 +91,11 @@ def virtualenv_command(install_virtualenv=False):
     """
     if not hasattr(sys, 'frozen'):
         if install_virtualenv:
-            packages = os.popen('pip freeze').read()  # nosec
-            if 'virtualenv' not in packages:
-                subprocess.check_output(['pip', 'install', 'virtualenv'])  # nosec
+            inventory = toolchain_inventory()
+            info = inventory.interpreter(sys.executable)
+            if not info or not info['virtualenv']:
+                subprocess.check_output(inventory.pip_command(sys.executable) + ['install', 'virtualenv'])  # nosec
+                inventory.invalidate(sys.executable)
     return which('virtualenv')
 
 
@@ -109,39 +142,524 @@ def remove_virtualenv(name, directory=None):
         shutil.rmtree(venv_directory)
 
 
-def upgrade_package_tools(virtualenv_directory, verbose=False):
+def bundled_wheels_directory(virtualenv_directory):
+    """
+    Get the directory containing the wheels bundled in the package that
+    deploys a virtualenv
+
+    Parameters
+    ----------
+    virtualenv_directory: str
+        The directory that contains the virtualenv
+
+    Returns
+    -------
+    str
+        The wheels directory
+    """
+    package_data_dir = os.path.join('/usr/share/', os.path.basename(virtualenv_directory))
+    return os.path.join(package_data_dir, 'wheels/')
+
+
+def _version_key(version):
+    return tuple(int(part) for part in re.findall(r'\d+', version or ''))
+
+
+def seed_wheels(directories):
+    """
+    Find the newest wheel of each of the package tools in directories
+
+    Parameters
+    ----------
+    directories: list
+        The directories to search, directories that don't exist are skipped
+
+    Returns
+    -------
+    dict
+        Dictionary of package tool name and a tuple of the wheel path and
+        version
+    """
+    seeds = {}
+    for directory in directories:
+        if not directory or not os.path.isdir(directory):
+            continue
+        for filename in wheel_files(directory):
+            name, version = package_requirement(filename)
+            name = name.lower().replace('_', '-')
+            if name not in PACKAGE_TOOLS or not version:
+                continue
+            if name not in seeds or _version_key(version) > _version_key(seeds[name][1]):
+                seeds[name] = (os.path.join(directory, filename), version)
+    return seeds
+
+
+def installed_package_tools(virtualenv_directory):
+    """
+    Get the versions of the package tools installed in a virtualenv from
+    the package metadata, without running the virtualenv interpreter
+
+    Parameters
+    ----------
+    virtualenv_directory: str
+        The directory that contains the virtualenv
+
+    Returns
+    -------
+    dict
+        Dictionary of package tool name and version
+    """
+    installed = {}
+    for dist_info in glob.glob(os.path.join(virtualenv_directory, 'lib*', 'python*', 'site-packages', '*.dist-info')):
+        name, _, version = os.path.basename(dist_info)[:-len('.dist-info')].partition('-')
+        name = name.lower().replace('_', '-')
+        if name in PACKAGE_TOOLS:
+            installed[name] = version
+    return installed
+
+
+def package_tools_outdated(virtualenv_directory, wheel_dirs):
+    """
+    Check if the wheel directories contain newer package tools than the
+    versions installed in a virtualenv
+
+    Parameters
+    ----------
+    virtualenv_directory: str
+        The directory that contains the virtualenv
+
+    wheel_dirs: list
+        Directories containing wheels of the package tools
+
+    Returns
+    -------
+    bool
+        True if any of the package tools should be upgraded
+    """
+    installed = installed_package_tools(virtualenv_directory)
+    for name, (_, version) in seed_wheels(wheel_dirs).items():
+        if name not in installed or _version_key(installed[name]) < _version_key(version):
+            return True
+    return False
+
+
+def update_seed_cache(pip_command, directory, max_age=None):
+    """
+    Download the latest wheels of the package tools into the seed cache if
+    the cached wheels are older than max_age
+
+    Parameters
+    ----------
+    pip_command: list
+        The command to run pip
+
+    directory: str
+        The seed cache directory
+
+    max_age: int, optional
+        The age in seconds when the cached wheels are downloaded again,
+        defaults to SEED_CACHE_MAX_AGE
+
+    Returns
+    -------
+    bool
+        True if the seed cache is up to date
+    """
+    marker = os.path.join(directory, '.downloaded')
+    max_age = SEED_CACHE_MAX_AGE if max_age is None else max_age
+    if os.path.exists(marker) and time.time() - os.path.getmtime(marker) < max_age:
+        return True
+    command = pip_command + ['download', '--only-binary', ':all:', '-d', directory] + PACKAGE_TOOLS
+    logger.debug('Updating the seed wheel cache using command %r', command)
+    try:
+        subprocess.check_output(command, stderr=subprocess.STDOUT)  # nosec
+    except subprocess.CalledProcessError as error:
+        logger.debug('Unable to update the seed wheel cache: %s', error.output.decode().strip())
+        return False
+    with open(marker, 'w'):
+        pass
+    return True
+
+
+def upgrade_package_tools(virtualenv_directory, verbose=False, wheel_dirs=None):
     """
     Upgrade the packages used to install/build packages in the virtualenv
+
+    The package tools are seeded from the wheels in wheel_dirs, missing ones
+    are taken from a local seed cache of the latest versions for the
+    interpreter, which is updated from the package index once a day.  The
+    tools with newer wheels than the installed versions are upgraded with a
+    single pip command that finds the wheels in the seed directories without
+    using the package index, so pip picks the newest versions compatible
+    with the interpreter.  The tools are upgraded from the package index if
+    no wheels are found or the wheels can't be installed.
+
     Parameters
     ----------
     virtualenv_directory: str
         The directory that contains the virtualenv
+
+    verbose: bool, optional
+        Print the pip output
+
+    wheel_dirs: list, optional
+        Directories containing wheels of the package tools, such as the
+        wheels bundled in a package
     """
     python_interpreter = os.path.join(virtualenv_directory, 'bin/python')
-    pip_command = os.path.join(virtualenv_directory, 'bin/pip')
+    pip_command = [python_interpreter, os.path.join(virtualenv_directory, 'bin/pip')]
+
+    inventory = toolchain_inventory()
+    installed = inventory.interpreter(python_interpreter) or {}
+    seed_directories = [directory for directory in wheel_dirs or [] if directory]
+    seeds = seed_wheels(seed_directories)
+    seed_cache = cache_directory('seed_wheels')
+    if seed_cache and set(seeds) != set(PACKAGE_TOOLS):
+        # The wheels of the newest versions don't install on every interpreter
+        seed_cache = os.path.join(seed_cache, installed.get('python_tag', None) or 'py')
+        os.makedirs(seed_cache, exist_ok=True)
+        update_seed_cache(pip_command, seed_cache)
+        seed_directories.append(seed_cache)
+        for name, seed in seed_wheels([seed_cache]).items():
+            seeds.setdefault(name, seed)
+
+    outdated = []
+    for name, (_, version) in sorted(seeds.items()):
+        if installed.get(name, None) and _version_key(installed[name]) >= _version_key(version):
+            logger.debug('The installed %s %s is up to date', name, installed[name])
+            continue
+        outdated.append(name)
+    missing = [name for name in PACKAGE_TOOLS if name not in seeds]
+
+    commands = []
+    if outdated:
+        find_links = []
+        for directory in seed_directories:
+            if os.path.isdir(directory):
+                find_links += ['--find-links', directory]
+        command = pip_command + ['install', '--upgrade', '--no-index'] + find_links + outdated
+        if _run_package_tools_command(command, verbose):
+            commands.append(command)
+        else:
+            logger.debug('Unable to upgrade %s from the seed wheels, using the package index', ', '.join(outdated))
+            missing = sorted(set(missing + outdated), key=PACKAGE_TOOLS.index)
+    if missing:
+        command = pip_command + ['install', '--upgrade'] + missing
+        if not _run_package_tools_command(command, verbose):
+            error_message = 'Upgrade command {command} in virtualenv {virtualenv_directory} failed'.format(
+                command=command,
+                virtualenv_directory=virtualenv_directory
+            )
+            raise BuildException(error_message)
+        commands.append(command)
+    if commands:
+        inventory.invalidate(python_interpreter)
+
+
+def _run_package_tools_command(command, verbose=False):
+    try:
+        output = subprocess.check_output(command, stderr=subprocess.STDOUT)  # nosec
+        if verbose:
+            print(output.decode().strip())
+    except subprocess.CalledProcessError as error:
+        if verbose:
+            print(error.output.decode().strip())
+        logger.debug(error.output.decode().strip())
+        return False
+    return True
 
-    for command in [
-        [python_interpreter, pip_command, 'install', '--upgrade', 'pip'],
-        [python_interpreter, pip_command, 'install', '--upgrade', 'setuptools'],
-        [python_interpreter, pip_command, 'install', '--upgrade', 'wheel'],
-    ]:
+
+def _create_virtualenv(name, directory, python_interpreter=None, verbose=False):
+    virtualenv_dir = os.path.join(directory, name)
+    cwd = os.getcwd()
+    if python_interpreter and BUILTIN_VENV and not hasattr(sys, 'frozen'):
+        logger.debug(
+            'Building virtualenv %r using the built in venv module',
+            virtualenv_dir
+        )
+        interpreter = which(python_interpreter) or python_interpreter
+        if os.path.realpath(interpreter) == os.path.realpath(sys.executable):
+            venv.create(virtualenv_dir, with_pip=True)
+        else:
+            # The venv module creates virtualenvs for the interpreter running it
+            command = [interpreter, '-m', 'venv', virtualenv_dir]
+            try:
+                subprocess.check_output(command, stderr=subprocess.STDOUT)  # nosec
+            except (OSError, subprocess.CalledProcessError) as error:
+                logger.debug(getattr(error, 'output', b'').decode().strip())
+                logger.exception('Virtualenv create command %r failed', ' '.join(command))
+                remove_virtualenv(name, directory)
+                raise BuildException('Virtualenv create failed')
+    else:
+        logger.debug('Building virtualenv using the virtualenv package, BUILTIN_VENV = BUILTIN_VENV')
+        os.chdir(directory)
+        command = [virtualenv_command()]
+        if python_interpreter:
+            command += ['-p', python_interpreter]
+        command += [name]
+        logger.debug('Building virtualenv using external command %r', ' '.join(command))
         try:
-            output = subprocess.check_output(command, stderr=subprocess.STDOUT)  # nosec
+            output = subprocess.check_output(  # nosec
+                command,
+                stderr=subprocess.STDOUT,
+            )
             if verbose:
                 print(output.decode().strip())
         except subprocess.CalledProcessError as error:
             if verbose:
                 print(error.output.decode().strip())
             logger.debug(error.output.decode().strip())
-            error_message = 'Upgrade command {command} in virtualenv {virtualenv_directory} failed'.format(
-                command=command,
-                virtualenv_directory=virtualenv_directory
-            )
-            raise BuildException(error_message)
+            logger.exception(
+                'Virtualenv create command %r failed', ' '.join(command))
+            remove_virtualenv(name, directory)
+            os.chdir(cwd)
+            raise BuildException('Virtualenv create failed')
+        os.chdir(cwd)
+
+
+def _shebang(interpreter):
+    if len(interpreter) + 2 > MAX_SHEBANG_LENGTH or b' ' in interpreter:
+        # The same sh exec header pip writes for interpreters the kernel can't run directly
+        return b"#!/bin/sh\n'''exec' \"" + interpreter + b'" "$0" "$@"\n' + b"' '''"
+    return b'#!' + interpreter
+
+
+def _relocate_file(filename, old_path, new_path):
+    # The file is replaced rather than changed in place, so hard linked copies are not changed
+    with open(filename, 'rb') as file_handle:
+        data = file_handle.read()
+    if b'\0' in data[:1024] or old_path not in data:
+        return False
+    first_line, newline, rest = data.partition(b'\n')
+    if first_line.startswith(b'#!' + old_path) and b' ' not in first_line:
+        data = _shebang(new_path + first_line[len(old_path) + 2:]) + newline + rest.replace(old_path, new_path)
+    else:
+        data = data.replace(old_path, new_path)
+    temp_filename = filename + '.invirtualenv-tmp'
+    with open(temp_filename, 'wb') as file_handle:
+        file_handle.write(data)
+    shutil.copymode(filename, temp_filename)
+    os.replace(temp_filename, filename)
+    return True
+
+
+def _record_hash(filename):
+    with open(filename, 'rb') as file_handle:
+        data = file_handle.read()
+    digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest()).rstrip(b'=').decode()
+    return ['sha256=' + digest, str(len(data))]
+
+
+def _relocate_records(site_packages, old_path, new_path, changed):
+    for record_filename in sorted(glob.glob(os.path.join(site_packages, '*.dist-info', 'RECORD'))):
+        with open(record_filename, newline='') as record_handle:
+            rows = list(csv.reader(record_handle))
+        updated = False
+        for row in rows:
+            if not row:
+                continue
+            if row[0].startswith(old_path + os.sep):
+                row[0] = new_path + row[0][len(old_path):]
+                updated = True
+            filename = row[0] if os.path.isabs(row[0]) else os.path.normpath(os.path.join(site_packages, row[0]))
+            if filename in changed and len(row) == 3 and row[1]:
+                row[1:] = _record_hash(filename)
+                updated = True
+        if updated:
+            # Replaced rather than changed in place, so the hard linked RECORD of the base virtualenv is not changed
+            temp_filename = record_filename + '.invirtualenv-tmp'
+            with open(temp_filename, 'w', newline='') as record_handle:
+                csv.writer(record_handle, lineterminator='\n').writerows(rows)
+            shutil.copymode(record_filename, temp_filename)
+            os.replace(temp_filename, record_filename)
+
+
+def _relocate_paths(virtualenv_directory, old_path, new_path):
+    """
+    Rewrite the paths in the files of the virtualenv in virtualenv_directory
+    from old_path to new_path
+    """
+    old_bytes = old_path.encode()
+    new_bytes = new_path.encode()
+    filenames = [os.path.join(virtualenv_directory, 'pyvenv.cfg')]
+    bin_directory = os.path.join(virtualenv_directory, 'bin')
+    if os.path.isdir(bin_directory):
+        filenames += [os.path.join(bin_directory, name) for name in sorted(os.listdir(bin_directory))]
+    site_packages_directories = sorted(glob.glob(os.path.join(virtualenv_directory, 'lib*', 'python*', 'site-packages')))
+    for site_packages in site_packages_directories:
+        filenames += sorted(glob.glob(os.path.join(site_packages, '*.pth')))
+        filenames += sorted(glob.glob(os.path.join(site_packages, '*.dist-info', 'direct_url.json')))
+
+    changed = set()
+    for filename in filenames:
+        if os.path.islink(filename):
+            target = os.readlink(filename)
+            if target.startswith(old_path + os.sep):
+                os.remove(filename)
+                os.symlink(new_path + target[len(old_path):], filename)
+        elif os.path.isfile(filename) and _relocate_file(filename, old_bytes, new_bytes):
+            changed.add(os.path.normpath(filename))
+    for site_packages in site_packages_directories:
+        _relocate_records(site_packages, old_path, new_path, changed)
+    logger.debug('Relocated %d files in %r from %r to %r', len(changed), virtualenv_directory, old_path, new_path)
+
+
+def relocate_virtualenv(source, dest, move=True):
+    """
+    Relocate a virtualenv
+
+    The paths in the console script shebangs, activate scripts, pyvenv.cfg,
+    .pth files and the RECORD files of the installed packages are rewritten
+    from the source to the dest directory, and the hashes in the RECORD files
+    are updated for the files that changed.  Shebangs that are too long for
+    the kernel are written as a sh exec header, the same way pip does.
+
+    Parameters
+    ----------
+    source : str
+        The virtualenv directory
+
+    dest : str
+        The directory the virtualenv is relocated to
+
+    move : bool, optional
+        Move the virtualenv to dest after rewriting the paths.  If False the
+        virtualenv is left in the source directory, for a virtualenv built in
+        a staging directory, such as a package build root, that is installed
+        in dest later.  default=True
+
+    Returns
+    -------
+    str
+        The directory of the virtualenv
+
+    Raises
+    ------
+    BuildException
+        The source directory is not a virtualenv or dest already exists
+    """
+    source = os.path.abspath(source)
+    dest = os.path.abspath(dest)
+    if not os.path.exists(os.path.join(source, 'pyvenv.cfg')):
+        raise BuildException('The directory %r is not a virtualenv' % source)
+    if move and os.path.lexists(dest):
+        raise BuildException('Unable to relocate the virtualenv %r, %r already exists' % (source, dest))
+    if source != dest:
+        _relocate_paths(source, source, dest)
+    if not move:
+        return source
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    shutil.move(source, dest)
+    return dest
+
+
+def base_virtualenv_directory(directory, python_interpreter=None):
+    """
+    Get the directory of the base virtualenv for an interpreter
+
+    Parameters
+    ----------
+    directory : str
+        Directory the virtualenvs are created in
+
+    python_interpreter : str, optional
+        The python interpreter of the virtualenv
+
+    Returns
+    -------
+    str
+        The base virtualenv directory, the base virtualenv for an updated
+        interpreter is in a different directory
+    """
+    interpreters = []
+    for interpreter in [sys.executable, python_interpreter]:
+        if interpreter:
+            interpreter = os.path.realpath(shutil.which(interpreter) or interpreter)
+            interpreters.append([interpreter, os.path.getmtime(interpreter) if os.path.exists(interpreter) else None])
+    key = hashlib.sha256(json.dumps(interpreters).encode()).hexdigest()[:16]
+    return os.path.join(directory, BASE_VIRTUALENV_DIRECTORY, key)
+
+
+def base_virtualenv(directory, python_interpreter=None, verbose=False):
+    """
+    Get the base virtualenv for an interpreter, building it if it doesn't
+    exist or is older than BASE_VIRTUALENV_MAX_AGE
+
+    The base virtualenv is built in a temporary directory and renamed into
+    place, so virtualenvs can be cloned from it while it is rebuilt.
+
+    Parameters
+    ----------
+    directory : str
+        Directory the virtualenvs are created in
+
+    python_interpreter : str, optional
+        The python interpreter of the virtualenv
+
+    verbose : bool
+        If True, provides status output while running.
+
+    Returns
+    -------
+    str
+        The base virtualenv directory
+    """
+    base_directory = base_virtualenv_directory(directory, python_interpreter)
+    info = read_json_file(os.path.join(base_directory, BASE_VIRTUALENV_INFO_FILENAME))
+    if info and time.time() - info['created'] < BASE_VIRTUALENV_MAX_AGE:
+        return base_directory
+
+    parent = os.path.dirname(base_directory)
+    os.makedirs(parent, exist_ok=True)
+    build_directory = tempfile.mkdtemp(dir=parent, prefix='.build-')
+    os.rmdir(build_directory)
+    logger.debug('Building the base virtualenv %r', base_directory)
+    try:
+        _create_virtualenv(os.path.basename(build_directory), parent, python_interpreter=python_interpreter, verbose=verbose)
+        upgrade_package_tools(build_directory, verbose=verbose)
+        write_json_file(os.path.join(build_directory, BASE_VIRTUALENV_INFO_FILENAME), {'path': build_directory, 'created': time.time()})
+        old_directory = None
+        if os.path.exists(base_directory):
+            old_directory = tempfile.mkdtemp(dir=parent, prefix='.old-')
+            os.rename(base_directory, os.path.join(old_directory, 'venv'))
+        os.rename(build_directory, base_directory)
+        if old_directory:
+            shutil.rmtree(old_directory, ignore_errors=True)
+    finally:
+        if os.path.exists(build_directory):
+            shutil.rmtree(build_directory, ignore_errors=True)
+    return base_directory
+
+
+def clone_virtualenv(base_directory, virtualenv_directory, hardlinks=True):
+    """
+    Create a virtualenv by cloning a base virtualenv
+
+    Parameters
+    ----------
+    base_directory : str
+        The base virtualenv directory
+
+    virtualenv_directory : str
+        The virtualenv to create
+
+    hardlinks : bool, optional
+        Hard link the files if the file system doesn't support reflinks,
+        this must not be used if the file ownership of the new virtualenv is
+        changed.  default=True
+    """
+    info = read_json_file(os.path.join(base_directory, BASE_VIRTUALENV_INFO_FILENAME))
+    if not info:
+        raise BuildException('The base virtualenv %r is incomplete' % base_directory)
+    method = clone_tree(base_directory, virtualenv_directory, hardlinks=hardlinks)
+    os.remove(os.path.join(virtualenv_directory, BASE_VIRTUALENV_INFO_FILENAME))
+    _relocate_paths(virtualenv_directory, info['path'], virtualenv_directory)
+    logger.debug('Cloned the base virtualenv %r to %r using %s', base_directory, virtualenv_directory, method)
 
 
 def build_virtualenv(
-        name, directory, python_interpreter=None, user=None, verbose=False):
+        name, directory, python_interpreter=None, user=None, verbose=False,
+        use_base_virtualenv=False, hardlinks=True):
     """
     Build a virtualenv in a directory
 
@@ -160,6 +678,14 @@ def build_virtualenv(
     verbose : bool
         If True, provides status output while running.
 
+    use_base_virtualenv : bool, optional
+        Clone new virtualenvs from a base virtualenv for the interpreter,
+        which is kept in the directory, instead of building them.
+        default=False
+
+    hardlinks : bool, optional
+        Allow hard linking the files of the base virtualenv, default=True
+
     Returns
     -------
     str
@@ -175,43 +701,22 @@ def build_virtualenv(
     #     if not hasattr(sys, 'frozen'):
     #         python_interpreter = sys.executable
     # logger.debug('Python interpreter is: %s' % sys.executable)
-    cwd = os.getcwd()
     if not os.path.isdir(directory):
         os.makedirs(directory)
 
     virtualenv_dir = os.path.join(directory, name)
+    bundled_wheels = bundled_wheels_directory(virtualenv_dir)
 
-    if python_interpreter and BUILTIN_VENV and not hasattr(sys, 'frozen'):
-        logger.debug(
-            'Building virtualenv %r using the built in venv module',
-            virtualenv_dir
-        )
-        venv.create(virtualenv_dir, with_pip=True)
-    else:
-        logger.debug('Building virtualenv using the virtualenv package, BUILTIN_VENV = BUILTIN_VENV')
-        os.chdir(directory)
-        command = [virtualenv_command()]
-        if python_interpreter:
-            command += ['-p', python_interpreter]
-        command += [name]
-        logger.debug('Building virtualenv using external command %r', ' '.join(command))
+    cloned = False
+    if use_base_virtualenv and not os.path.exists(virtualenv_dir):
         try:
-            output = subprocess.check_output(  # nosec
-                command,
-                stderr=subprocess.STDOUT,
-            )
-            if verbose:
-                print(output.decode().strip())
-        except subprocess.CalledProcessError as error:
-            if verbose:
-                print(error.output.decode().strip())
-            logger.debug(error.output.decode().strip())
-            logger.exception(
-                'Virtualenv create command %r failed', ' '.join(command))
+            clone_virtualenv(base_virtualenv(directory, python_interpreter, verbose=verbose), virtualenv_dir, hardlinks=hardlinks)
+            cloned = True
+        except (BuildException, OSError, ValueError):
+            logger.exception('Unable to clone the base virtualenv, building the virtualenv')
             remove_virtualenv(name, directory)
-            os.chdir(cwd)
-            raise BuildException('Virtualenv create failed')
-        os.chdir(cwd)
+    if not cloned:
+        _create_virtualenv(name, directory, python_interpreter=python_interpreter, verbose=verbose)
 
     for directory_name in ['conf', 'logs']:
         filename = os.path.join(virtualenv_dir, directory_name)
@@ -219,7 +724,10 @@ def build_virtualenv(
             logger.debug('Creating %r directory', filename)
             os.makedirs(filename)
 
-    upgrade_package_tools(virtualenv_dir, verbose=verbose)
+    # The base virtualenv already has up to date package tools, unless the
+    # package bundles newer versions
+    if not cloned or package_tools_outdated(virtualenv_dir, [bundled_wheels]):
+        upgrade_package_tools(virtualenv_dir, verbose=verbose, wheel_dirs=[bundled_wheels])
 
     before_binfiles_filename = os.path.join(virtualenv_dir, 'conf/binfiles_predeploy.json')
     with open(before_binfiles_filename, 'w') as before_binfiles_handle:
@@ -231,7 +739,8 @@ def build_virtualenv(
 
 def install_requirements(
         requirements, virtualenv, user=None, upgrade=False, verbose=False,
-        pip_version=None, use_index=True, use_local_wheels=False
+        pip_version=None, use_index=True, use_local_wheels=False, no_deps=False,
+        env=None, wheel_dirs=None
 ):
     """
     Open one or more requirements files and run pip -r to install them
@@ -263,6 +772,18 @@ def install_requirements(
     use_local_wheels: bool, optional
         Install wheels from local directory
         Default=False
+
+    no_deps: bool, optional
+        Don't install the dependencies of the requirements, used when the
+        requirements are a complete pinned set such as a lock file
+        Default=False
+
+    env: dict, optional
+        The environment to run pip in, source packages are built in this
+        environment.  Defaults to the current environment
+
+    wheel_dirs: list, optional
+        Directories containing wheels to install the requirements from
     """
     logger.debug(
         'Installing requirements from requirements file: %r '
@@ -283,13 +804,15 @@ def install_requirements(
         extra_pip_args.append('-q')
     if not use_index:
         extra_pip_args.append('--no-index')
+    if no_deps:
+        extra_pip_args.append('--no-deps')
     if use_local_wheels:
         # Get the wheels_dir path from virtualenv path. Instead of downloading
         # packages from pypi we will be installing wheels from local dir.
-        package_data_dir_name = os.path.basename(virtualenv)
-        package_data_dir = os.path.join("/usr/share/", package_data_dir_name)
-        wheels_dir = os.path.join(package_data_dir, "wheels/")
+        wheels_dir = bundled_wheels_directory(virtualenv)
         extra_pip_args += ['--find-links', wheels_dir, '--prefer-binary']
+    for wheels_dir in wheel_dirs or []:
+        extra_pip_args += ['--find-links', wheels_dir]
 
     user_uid = None
     user_gid = None
@@ -314,7 +837,7 @@ def install_requirements(
         logger.debug('Running command: %s', ' '.join(command))
         try:
             output = subprocess.check_output(  # nosec
-                command, stderr=subprocess.STDOUT,
+                command, stderr=subprocess.STDOUT, env=env,
                 # preexec_fn=change_uid_gid(user_uid=user_uid)
             )
             if verbose:
@@ -0,0 +1,895 @@
+# Copyright (c) 2016, Yahoo Inc.
+# Copyrights licensed under the BSD License
+# See the accompanying LICENSE.txt file for terms.
+
+"""
+Functions for managing the directory of wheel packages (wheelhouse) that is
+bundled into the generated packages
+"""
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess  # nosec
+import sysconfig
+import tarfile
+import tempfile
+from .toolchain import toolchain_inventory
+from .utility import cache_directory
+
+
+logger = logging.getLogger(__name__)  # pylint: disable=C0103
+
+
+# The hash algorithm pip uses when none is specified
+DEFAULT_HASH_ALGORITHM = 'sha256'
+
+# Size of the reads used to hash files
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Default maximum size of the wheel cache in megabytes
+WHEEL_CACHE_SIZE = 2048
+
+# Compression formats for the wheel archive and the archive file extension
+# for each of them
+ARCHIVE_EXTENSIONS = {
+    'store': '.tar',
+    'gz': '.tar.gz',
+    'xz': '.tar.xz',
+    'zstd': '.tar.zst',
+}
+
+# Number of requirements each pip download command downloads when the
+# requirements are downloaded without resolving their dependencies
+REQUIREMENTS_CHUNK_SIZE = 250
+
+# Memory in megabytes to allow for each compile job when sizing the number of
+# build jobs
+BUILD_JOB_MEMORY = 2048
+
+# Default maximum size of the compiler cache in megabytes
+COMPILER_CACHE_SIZE = 5120
+
+# File extensions of source packages pip can build wheels from
+SOURCE_PACKAGE_EXTENSIONS = ('.tar.gz', '.tar.bz2', '.tgz', '.tar', '.zip')
+
+
+def hash_file(filename, algorithm=None):
+    """
+    Hash a file, in the format pip uses for --hash arguments
+
+    The file is read in chunks so large wheels are never held in memory.
+    hashlib releases the GIL while hashing, so hashing several files from
+    threads runs in parallel.
+
+    Parameters
+    ----------
+    filename : str
+        The file to hash
+
+    algorithm : str, optional
+        The hashlib algorithm to use, defaults to sha256
+
+    Returns
+    -------
+    str
+        The hash in the form algorithm:hexdigest
+    """
+    if not algorithm:
+        algorithm = DEFAULT_HASH_ALGORITHM
+    file_hash = hashlib.new(algorithm)
+    buffer = memoryview(bytearray(HASH_CHUNK_SIZE))
+    with open(filename, 'rb') as file_handle:
+        while True:
+            size = file_handle.readinto(buffer)
+            if not size:
+                break
+            file_hash.update(buffer[:size])
+    return '{algorithm}:{digest}'.format(algorithm=algorithm, digest=file_hash.hexdigest())
+
+
+def hash_files(filenames, algorithm=None, max_workers=None):
+    """
+    Hash files in parallel
+
+    Parameters
+    ----------
+    filenames : list
+        The files to hash
+
+    algorithm : str, optional
+        The hashlib algorithm to use, defaults to sha256
+
+    max_workers : int, optional
+        The number of threads to hash with, defaults to the number of cpus
+
+    Returns
+    -------
+    dict
+        Dictionary of filename and the hash in the form algorithm:hexdigest
+    """
+    filenames = list(filenames)
+    if not filenames:
+        return {}
+    if not max_workers:
+        max_workers = min(len(filenames), os.cpu_count() or 1)
+    logger.debug('Hashing %d files using %d threads', len(filenames), max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        hashes = executor.map(lambda filename: hash_file(filename, algorithm), filenames)
+        return dict(zip(filenames, hashes))
+
+
+def source_packages(directory='.'):
+    """
+    Find the source packages in a directory
+
+    Parameters
+    ----------
+    directory : str, optional
+        The directory to search, defaults to the current directory
+
+    Returns
+    -------
+    list
+        Sorted list of the paths of the source packages
+    """
+    return sorted(
+        os.path.join(directory, filename) for filename in os.listdir(directory)
+        if filename.endswith(SOURCE_PACKAGE_EXTENSIONS)
+    )
+
+
+def wheel_files(directory='.'):
+    """
+    Find the wheel packages in a directory
+
+    Parameters
+    ----------
+    directory : str, optional
+        The directory to search, defaults to the current directory
+
+    Returns
+    -------
+    list
+        Sorted list of the wheel filenames
+    """
+    return sorted(filename for filename in os.listdir(directory) if filename.endswith('.whl'))
+
+
+def package_requirement(filename):
+    """
+    Get the package name and version from a wheel or source package filename
+
+    Parameters
+    ----------
+    filename : str
+        The wheel or source package filename
+
+    Returns
+    -------
+    tuple
+        The package name and version, the version is None if it can't be
+        determined from the filename
+    """
+    basename = os.path.basename(filename)
+    if basename.endswith('.whl'):
+        split_filename = basename.split('-')
+        if len(split_filename) > 2:
+            return split_filename[0], split_filename[1]
+        return basename, None
+    for extension in SOURCE_PACKAGE_EXTENSIONS:
+        if basename.endswith(extension):
+            basename = basename[:-len(extension)]
+            break
+    if '-' not in basename:
+        return basename, None
+    name, version = basename.rsplit('-', 1)
+    return name, version
+
+
+class WheelCache(object):
+    """
+    A wheel cache that is shared by package builds
+
+    Wheels are stored under their filename, which identifies the package
+    name, version, python tag, abi tag and platform tag of the wheel, in a
+    subdirectory named by the digest of the key.  The key holds the build
+    inputs the filename doesn't identify, like the versions of the tools
+    the wheels are built with, so wheels built with other tools are not
+    reused.  Wheels are touched each time they are used and the least
+    recently used wheels, including the wheels stored under other keys,
+    are removed when the cache grows larger than max_size.
+
+    Parameters
+    ----------
+    directory : str, optional
+        The directory to store the wheels in, defaults to the wheels
+        directory in the invirtualenv cache directory
+
+    max_size : int, optional
+        The maximum size of the cache in megabytes, defaults to
+        WHEEL_CACHE_SIZE
+
+    key : list, optional
+        JSON serializable build inputs the cached wheels depend on, the
+        wheels are stored directly in the directory if no key is passed
+    """
+    def __init__(self, directory=None, max_size=None, key=None):
+        if directory is None:
+            directory = cache_directory('wheels')
+        self.root = directory
+        if directory and key is not None:
+            digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+            directory = os.path.join(directory, digest)
+        self.directory = directory
+        self.max_size = WHEEL_CACHE_SIZE if max_size is None else max_size
+
+    def pip_args(self):
+        """
+        Get the pip arguments to use the cached wheels
+
+        Returns
+        -------
+        list
+            pip command line arguments
+        """
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        return ['--find-links', self.directory]
+
+    def wheels(self):
+        """
+        Get the wheels in the cache
+
+        Returns
+        -------
+        list
+            Sorted list of the cached wheel filenames
+        """
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        return wheel_files(self.directory)
+
+    def add(self, filename):
+        """
+        Add a wheel to the cache, marking it as used if it is already cached
+
+        Parameters
+        ----------
+        filename : str
+            The path to the wheel
+        """
+        if not self.directory:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        cached_filename = os.path.join(self.directory, os.path.basename(filename))
+        if os.path.exists(cached_filename):
+            os.utime(cached_filename)
+            return
+        file_handle, temp_filename = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(file_handle)
+        try:
+            shutil.copyfile(filename, temp_filename)
+            os.replace(temp_filename, cached_filename)
+        except OSError:  # pragma: no cover
+            logger.debug('Unable to add %r to the wheel cache', filename)
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+
+    def update(self, wheel_dir='.'):
+        """
+        Add the wheels in a directory to the cache and remove the least
+        recently used wheels if the cache is larger than max_size
+
+        Parameters
+        ----------
+        wheel_dir : str, optional
+            The directory containing the wheels, defaults to the current
+            directory
+        """
+        if not self.directory:
+            return
+        for filename in wheel_files(wheel_dir):
+            self.add(os.path.join(wheel_dir, filename))
+        self.prune()
+
+    def prune(self):
+        """
+        Remove the least recently used wheels until the cache is no larger
+        than max_size
+        """
+        if not self.root or not os.path.isdir(self.root):
+            return
+        directories = [self.root] + [
+            os.path.join(self.root, name) for name in sorted(os.listdir(self.root)) if os.path.isdir(os.path.join(self.root, name))
+        ]
+        entries = []
+        for directory in directories:
+            for filename in wheel_files(directory):
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:  # pragma: no cover
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        size = sum(entry[1] for entry in entries)
+        max_size = self.max_size * 1024 * 1024
+        for _, file_size, path in sorted(entries):
+            if size <= max_size:
+                break
+            logger.debug('Removing %r from the wheel cache', path)
+            try:
+                os.remove(path)
+            except OSError:  # pragma: no cover
+                continue
+            size -= file_size
+
+
+def requirement_chunks(requirements, chunk_size=None):
+    """
+    Split requirements into chunks, dropping duplicate requirements
+
+    Parameters
+    ----------
+    requirements : list
+        The requirements
+
+    chunk_size : int, optional
+        The maximum number of requirements in each chunk, defaults to
+        REQUIREMENTS_CHUNK_SIZE
+
+    Returns
+    -------
+    list
+        List of lists of requirements
+    """
+    chunk_size = chunk_size or REQUIREMENTS_CHUNK_SIZE
+    requirements = list(dict.fromkeys(requirements))
+    return [requirements[index:index + chunk_size] for index in range(0, len(requirements), chunk_size)]
+
+
+def run_pip_requirements(cmd, requirements):
+    """
+    Run a pip command with the requirements passed in a requirements file, so
+    the command line length doesn't depend on the number of requirements
+
+    Parameters
+    ----------
+    cmd : list
+        The pip command, without the requirements
+
+    requirements : list
+        The requirements
+    """
+    with tempfile.TemporaryDirectory() as tempdir:
+        requirements_file = os.path.join(tempdir, 'requirements.txt')
+        with open(requirements_file, 'w') as requirements_handle:
+            requirements_handle.write('\n'.join(requirements) + '\n')
+        cmd = cmd + ['-r', requirements_file]
+        logger.debug('Running pip command %r with %d requirements', cmd, len(requirements))
+        try:
+            subprocess.check_output(cmd, stderr=subprocess.STDOUT)  # nosec
+        except subprocess.CalledProcessError as error:
+            logger.warning('Exception occurred while running pip')
+            if error.output:
+                logger.error(error.output.decode())
+            raise
+
+
+def download_packages(pip_cmd, requirements, wheel_dir='.', no_deps=False, options=None, chunk_size=None, max_workers=None):
+    """
+    Resolve the requirements and download the wheel or source package for
+    every package needed to install them
+
+    The requirements are passed to pip in a requirements file.  When their
+    dependencies are not resolved, the requirements are downloaded in chunks
+    by concurrent pip commands, so the download time grows linearly with the
+    number of requirements.  Otherwise all the requirements are resolved
+    together by a single pip command.
+
+    Parameters
+    ----------
+    pip_cmd : list
+        The command to run pip
+
+    requirements : list
+        The requirements to download
+
+    wheel_dir : str, optional
+        The directory to download the packages to, defaults to the current
+        directory
+
+    no_deps : bool, optional
+        Only download the requirements, without resolving their
+        dependencies, default=False
+
+    options : list, optional
+        Extra pip download command line options
+
+    chunk_size : int, optional
+        The number of requirements downloaded by each pip command when
+        no_deps is set, defaults to REQUIREMENTS_CHUNK_SIZE
+
+    max_workers : int, optional
+        The number of pip commands to run at the same time, defaults to the
+        number of cpus
+    """
+    cmd = pip_cmd + ['download', '-d', wheel_dir] + list(options or [])
+    if not no_deps:
+        run_pip_requirements(cmd, list(requirements))
+        return
+    cmd.append('--no-deps')
+    chunks = requirement_chunks(requirements, chunk_size)
+    if len(chunks) < 2:
+        for chunk in chunks:
+            run_pip_requirements(cmd, chunk)
+        return
+    max_workers = min(len(chunks), max_workers or os.cpu_count() or 1)
+    logger.debug('Downloading %d chunks of requirements using %d workers', len(chunks), max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for future in [executor.submit(run_pip_requirements, cmd, chunk) for chunk in chunks]:
+            future.result()
+
+
+def available_memory():
+    """
+    Get the memory available for new processes
+
+    Returns
+    -------
+    int
+        The available memory in megabytes or None if it can't be determined
+    """
+    try:
+        with open('/proc/meminfo') as meminfo_handle:
+            for line in meminfo_handle:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // (1024 * 1024)
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def build_jobs(jobs=None):
+    """
+    Get the number of compile jobs to run when building wheels
+
+    Parameters
+    ----------
+    jobs : int, optional
+        The configured number of jobs, if not set the number of cpus is used,
+        limited so each job has BUILD_JOB_MEMORY of the available memory
+
+    Returns
+    -------
+    int
+        The number of jobs
+    """
+    if jobs:
+        return max(1, int(jobs))
+    jobs = os.cpu_count() or 1
+    memory = available_memory()
+    if memory:
+        jobs = min(jobs, max(1, memory // BUILD_JOB_MEMORY))
+    return jobs
+
+
+def build_environment(jobs, config_dir, env=None):
+    """
+    Get the environment for wheel builds that compile with parallel jobs
+
+    The job count is passed to make, cmake, numpy and pytorch builds and to
+    the setuptools build_ext command using a distutils config file.  Settings
+    already in the environment are left unchanged.
+
+    Parameters
+    ----------
+    jobs : int
+        The number of compile jobs each build runs
+
+    config_dir : str
+        The directory to write the distutils config file to
+
+    env : dict, optional
+        The environment to update, defaults to a copy of os.environ
+
+    Returns
+    -------
+    dict
+        The build environment
+    """
+    env = dict(os.environ if env is None else env)
+    jobs = str(jobs)
+    distutils_config = os.path.join(config_dir, 'build_ext.cfg')
+    with open(distutils_config, 'w') as config_handle:
+        config_handle.write('[build_ext]\nparallel = {0}\n'.format(jobs))
+    for name, value in [
+        ('MAKEFLAGS', '-j' + jobs),
+        ('CMAKE_BUILD_PARALLEL_LEVEL', jobs),
+        ('MAX_JOBS', jobs),
+        ('NPY_NUM_BUILD_JOBS', jobs),
+        ('DIST_EXTRA_CONFIG', distutils_config),
+    ]:
+        env.setdefault(name, value)
+    return env
+
+
+def compiler_cache_environment(directory, max_size=None, env=None):
+    """
+    Get an environment that routes C and C++ compiles through ccache
+
+    The CC and CXX compilers, which setuptools and cmake use, are set to run
+    through ccache with the cache in directory.  Compilers that already run
+    through ccache, or that a cmake compiler launcher is already set for, are
+    left unchanged so compiles don't run through ccache twice.  The cache is
+    limited to max_size and pip's temporary build directories are left out of
+    the compile hashes, so rebuilding the same source package gets cache
+    hits.  The environment is returned unchanged if ccache is not installed.
+
+    Parameters
+    ----------
+    directory : str
+        The compiler cache directory, the environment is returned unchanged
+        if this is not set
+
+    max_size : int, optional
+        The maximum size of the cache in megabytes, defaults to
+        COMPILER_CACHE_SIZE
+
+    env : dict, optional
+        The environment to update, defaults to a copy of os.environ
+
+    Returns
+    -------
+    dict
+        The environment
+    """
+    env = dict(os.environ if env is None else env)
+    if not directory:
+        return env
+    ccache = toolchain_inventory().executable('ccache')
+    if not ccache:
+        logger.debug('The ccache command is not present, not using the compiler cache %r', directory)
+        return env
+    directory = os.path.abspath(os.path.expanduser(directory))
+    os.makedirs(directory, exist_ok=True)
+    env['CCACHE_DIR'] = directory
+    env['CCACHE_MAXSIZE'] = '{0}M'.format(max_size or COMPILER_CACHE_SIZE)
+    env.setdefault('CCACHE_BASEDIR', tempfile.gettempdir())
+    env.setdefault('CCACHE_NOHASHDIR', '1')
+    for variable, launcher, default in [('CC', 'CMAKE_C_COMPILER_LAUNCHER', 'cc'), ('CXX', 'CMAKE_CXX_COMPILER_LAUNCHER', 'c++')]:
+        if env.get(launcher, None):
+            continue
+        compiler = env.get(variable, None) or sysconfig.get_config_var(variable) or default
+        if 'ccache' not in os.path.basename(compiler.split()[0]):
+            env[variable] = '{0} {1}'.format(ccache, compiler)
+    logger.debug('Using the compiler cache %r', directory)
+    return env
+
+
+def build_wheel(pip_cmd, source_package, wheel_dir='.', env=None):
+    """
+    Build a wheel from a single source package
+
+    The source package is removed if the wheel is built, if the build fails
+    it is left in place so it can be installed from source instead.
+
+    Parameters
+    ----------
+    pip_cmd : list
+        The command to run pip
+
+    source_package : str
+        The path to the source package
+
+    wheel_dir : str, optional
+        The directory to write the wheel to, defaults to the current directory
+
+    env : dict, optional
+        The environment to run the build in, defaults to the current
+        environment
+
+    Returns
+    -------
+    bool
+        True if the wheel was built, False otherwise
+    """
+    cmd = pip_cmd + ['wheel', '--no-deps', '-w', wheel_dir, source_package]
+    logger.debug('Running pip command %r to generate a wheel package', cmd)
+    try:
+        subprocess.check_output(cmd, stderr=subprocess.STDOUT, env=env)  # nosec
+    except subprocess.CalledProcessError as error:
+        logger.warning('Unable to generate a wheel package for %r, keeping the source package', source_package)
+        if error.output:
+            logger.debug(error.output.decode())
+        return False
+    os.remove(source_package)
+    return True
+
+
+def build_wheels(pip_cmd, packages, wheel_dir='.', max_workers=None, jobs=None, env=None):
+    """
+    Build wheels from source packages concurrently
+
+    The compile jobs are divided between the concurrent builds, so a single
+    large build uses all of them.
+
+    Parameters
+    ----------
+    pip_cmd : list
+        The command to run pip
+
+    packages : list
+        The paths of the source packages
+
+    wheel_dir : str, optional
+        The directory to write the wheels to, defaults to the current directory
+
+    max_workers : int, optional
+        The number of builds to run at the same time, defaults to the number
+        of cpus
+
+    jobs : int, optional
+        The total number of compile jobs, defaults to build_jobs()
+
+    env : dict, optional
+        The environment to run the builds in, defaults to the current
+        environment
+
+    Returns
+    -------
+    dict
+        Dictionary of source package and True if the wheel was built
+    """
+    packages = list(packages)
+    if not packages:
+        return {}
+    if not max_workers:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(len(packages), max_workers)
+    build_job_count = max(1, build_jobs(jobs) // max_workers)
+    logger.debug('Building %d wheel packages using %d workers with %d compile jobs each', len(packages), max_workers, build_job_count)
+    with tempfile.TemporaryDirectory() as config_dir:
+        env = build_environment(build_job_count, config_dir, env=env)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(lambda package: build_wheel(pip_cmd, package, wheel_dir, env=env), packages)
+            return dict(zip(packages, results))
+
+
+def build_wheelhouse(pip_cmd, requirements, wheel_dir='.', max_workers=None, wheel_cache=None, pinned=None, jobs=None, env=None):
+    """
+    Populate a directory with wheels for the requirements and everything they
+    depend on
+
+    The requirements are resolved once by downloading them, the pinned
+    requirements are downloaded in concurrent chunks, then wheels are built
+    concurrently for the source packages that were downloaded.  Source
+    packages that fail to build are kept so they can be installed from
+    source, without affecting the other packages.
+
+    If a wheel cache is passed, pip prefers the cached wheels to source
+    packages so only missing wheels are built, and the wheels are added to
+    the cache afterwards.
+
+    Parameters
+    ----------
+    pip_cmd : list
+        The command to run pip
+
+    requirements : list
+        The requirements to generate wheels for
+
+    wheel_dir : str, optional
+        The directory to store the packages in, defaults to the current
+        directory
+
+    max_workers : int, optional
+        The number of builds to run at the same time, defaults to the number
+        of cpus
+
+    wheel_cache : WheelCache, optional
+        The wheel cache to use
+
+    pinned : list, optional
+        Pinned requirements that already include all of their dependencies,
+        such as the requirements from a lock file, these are downloaded
+        without running the resolver
+
+    jobs : int, optional
+        The total number of compile jobs for the wheel builds, defaults to
+        build_jobs()
+
+    env : dict, optional
+        The environment to run the wheel builds in, such as one from
+        compiler_cache_environment(), defaults to the current environment
+
+    Returns
+    -------
+    list
+        The source packages that could not be built into wheels
+    """
+    download_args = wheel_cache.pip_args() if wheel_cache else []
+    if pinned:
+        download_packages(pip_cmd, pinned, wheel_dir, no_deps=True, options=download_args, max_workers=max_workers)
+    if requirements:
+        download_packages(pip_cmd, requirements, wheel_dir, options=download_args)
+    if wheel_cache:
+        cached = set(wheel_cache.wheels()).intersection(wheel_files(wheel_dir))
+        logger.debug('Using %d wheels from the wheel cache', len(cached))
+    results = build_wheels(pip_cmd, source_packages(wheel_dir), wheel_dir, max_workers=max_workers, jobs=jobs, env=env)
+    if wheel_cache:
+        wheel_cache.update(wheel_dir)
+    return sorted(package for package, built in results.items() if not built)
+
+
+def zstd_available():
+    """
+    Check if the optional zstandard module is installed
+
+    Returns
+    -------
+    bool
+        True if zstd compression can be used
+    """
+    try:
+        import zstandard  # noqa: F401 pylint: disable=W0611
+    except ImportError:
+        return False
+    return True
+
+
+def archive_compression(compression='gz'):
+    """
+    Get the archive compression to use, falling back to gz compression if
+    zstd compression is requested and the zstandard module isn't installed
+
+    Parameters
+    ----------
+    compression : str, optional
+        The requested compression, store, gz, xz or zstd, default=gz
+
+    Returns
+    -------
+    str
+        The compression to use
+
+    Raises
+    ------
+    ValueError
+        The compression is not supported
+    """
+    if compression not in ARCHIVE_EXTENSIONS:
+        raise ValueError('Unsupported archive compression %r' % compression)
+    if compression == 'zstd' and not zstd_available():
+        logger.warning('The zstandard module is not installed, using gz compression')
+        return 'gz'
+    return compression
+
+
+def archive_filename(basename, compression='gz'):
+    """
+    Get the filename of an archive with the extension for the compression
+
+    Parameters
+    ----------
+    basename : str
+        The archive filename without an extension
+
+    compression : str, optional
+        The archive compression, store, gz, xz or zstd, default=gz
+
+    Returns
+    -------
+    str
+        The archive filename
+    """
+    return basename + ARCHIVE_EXTENSIONS[compression]
+
+
+def archive_entries(directory):
+    """
+    Get the files and directories under a directory in a deterministic order
+
+    Parameters
+    ----------
+    directory : str
+        The directory
+
+    Returns
+    -------
+    list
+        Sorted list of paths, starting with the directory, with each
+        directory listed before its contents
+    """
+    entries = [directory]
+    for root, dirnames, filenames in os.walk(directory):
+        entries += [os.path.join(root, name) for name in dirnames + filenames]
+    return sorted(entries, key=lambda path: path.split(os.sep))
+
+
+def write_archive(filename, directory, compression='gz', threads=None, mtime=None):
+    """
+    Write a tar archive of a directory
+
+    The archive is written as a stream, so the files are never held in
+    memory, and the entries are added in a deterministic order.
+
+    Parameters
+    ----------
+    filename : str
+        The archive file to write
+
+    directory : str
+        The directory to archive
+
+    compression : str, optional
+        The archive compression, default=gz
+
+        store
+            No compression, the fastest option for wheels, which are
+            already compressed
+        gz
+            gzip compression, the same as tar -czf
+        xz
+            xz compression
+        zstd
+            zstd compression, this requires the zstandard module and falls
+            back to gz compression if it is not installed
+
+    threads : int, optional
+        The number of compression threads to use for zstd compression,
+        defaults to one per cpu
+
+    mtime : int, optional
+        If passed the modification time of every entry and of the gzip
+        header is set to this timestamp and the entry owners are cleared,
+        so archives of the same files are byte identical
+
+    Returns
+    -------
+    str
+        The compression that was used
+
+    Raises
+    ------
+    ValueError
+        The compression is not supported
+    """
+    compression = archive_compression(compression)
+    entries = archive_entries(directory)
+    logger.debug('Writing %d entries to the %s compressed archive %r', len(entries), compression, filename)
+
+    def normalize(tarinfo):
+        if mtime is not None:
+            tarinfo.mtime = mtime
+            tarinfo.uid = tarinfo.gid = 0
+            tarinfo.uname = tarinfo.gname = ''
+        return tarinfo
+
+    def add_entries(archive):
+        for entry in entries:
+            archive.add(entry, recursive=False, filter=normalize)
+
+    with open(filename, 'wb') as archive_handle:
+        if compression == 'zstd':
+            import zstandard
+            compressor = zstandard.ZstdCompressor(threads=-1 if threads is None else threads)
+            with compressor.stream_writer(archive_handle, closefd=False) as stream:
+                with tarfile.open(fileobj=stream, mode='w|') as archive:
+                    add_entries(archive)
+        elif compression == 'gz':
+            # The gzip level tar -czf uses, the gzip header holds a timestamp so it is written here rather than by tarfile
+            with gzip.GzipFile(filename=os.path.basename(filename), mode='wb', compresslevel=6, fileobj=archive_handle, mtime=mtime) as stream:
+                with tarfile.open(fileobj=stream, mode='w') as archive:
+                    add_entries(archive)
+        else:
+            with tarfile.open(fileobj=archive_handle, mode='w:xz' if compression == 'xz' else 'w') as archive:
+                add_entries(archive)
+    return compression
@@ -1,12 +1,12 @@
 import logging
 import os
+import pkgutil
 import subprocess
-from jinja2 import Template
-import pkg_resources
 import shutil
 
 from invirtualenv.plugin_base import InvirtualenvPlugin
-from invirtualenv.utility import csv_list, str_to_dict, find_executable
+from invirtualenv.toolchain import toolchain_inventory
+from invirtualenv.utility import csv_list, str_to_dict
 
 
 logger = logging.getLogger(__name__)
@@ -104,6 +104,8 @@ workdir_start=
 
 class InvirtualenvDocker(InvirtualenvPlugin):
     package_formats = ['docker']
+    # The container installs from the package index, the wheels directory is empty so there is nothing to archive
+    package_stages = ['copy_files', 'wheel_packages', 'deploy_conf']
     package_template = DOCKERFILE_TEMPLATE
     config_default = DOCKER_CONFIG_DEFAULT
     default_config_filename = 'Dockerfile.invirtualenv'
@@ -133,8 +135,9 @@ class InvirtualenvDocker(InvirtualenvPlugin):
         }
     }
 
-    def system_requirements_ok(self):
-        if find_executable('docker'):
+    @classmethod
+    def system_requirements_ok(cls):
+        if toolchain_inventory().executable('docker'):
             return True
         logger.debug('The docker command is not present, disabling the docker plugin')
         return False
@@ -144,7 +147,8 @@ class InvirtualenvDocker(InvirtualenvPlugin):
         pass
 
     def write_command_scripts(self):
-        shutil.copyfile(pkg_resources.resource_filename(__name__, 'docker_scripts/docker_build.sh'), 'docker_build.sh')
+        with open('docker_build.sh', 'wb') as script_handle:
+            script_handle.write(pkgutil.get_data('invirtualenv_plugins', 'docker_scripts/docker_build.sh'))
 
     def generate_wheel_packages(self, wheeldir):
         # For docker containers there is no need to generate and store wheels
@@ -171,7 +175,7 @@ class InvirtualenvDocker(InvirtualenvPlugin):
         with open('Dockerfile', 'w') as dockerfile_handle:
             dockerfile_handle.write(self.render_template_with_config())
         container_tag = '{name}:{version}'.format(name=self.config['docker_container']['container_name'], version=self.config['global']['version'])
-        command = [find_executable('docker'), 'build', '-t', container_tag, '.']
+        command = [toolchain_inventory().executable('docker'), 'build', '-t', container_tag, '.']
         logger.debug('Running command %r', ' '.join(command))
         subprocess.check_call(command)
         logger.debug('Created container %r', container_tag)
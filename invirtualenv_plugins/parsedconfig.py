@@ -9,6 +9,8 @@ logger = logging.getLogger(__name__)
 
 class InvirtualenvParsedConfig(InvirtualenvPlugin):
     package_formats = ['parsed_deploy_conf']
+    # Rendering the deploy.conf doesn't need the source files or wheels
+    package_stages = ['deploy_conf']
     default_config_filename = 'deploy.conf.parsed'
     package_template = None
 
@@ -5,11 +5,13 @@ import shlex
 import shutil
 import subprocess
 
-import distro
 import pkgutil
 
+from invirtualenv.deploy import deployed_bin_files, install_python_dependencies
+from invirtualenv.exceptions import BuildException
 from invirtualenv.plugin_base import InvirtualenvPlugin
-from invirtualenv.utility import find_executable
+from invirtualenv.toolchain import toolchain_inventory
+from invirtualenv.virtualenv import build_virtualenv, default_virtualenv_directory, relocate_virtualenv
 
 
 logger = logging.getLogger(__name__)
@@ -24,8 +26,15 @@ Group: {{rpm_package['group']|default('Development')}}
 Packager: {{rpm_package['packager']|default('Verizon')}}
 URL: {{global['url']|default('https://github.com/yahoo/invirtualenv')}}
 AutoReqProv: no
-{% if rpm_package['noarch'] %}BuildArch: noarch{% endif %}
-{% if rpm_package['bootstrap_deps'] %}
+{% if rpm_package['noarch'] and not rpm_package['prebuilt_virtualenv'] %}BuildArch: noarch{% endif %}
+{% if rpm_package['prebuilt_virtualenv'] %}
+# The virtualenv is built with the package, don't byte compile, strip or
+# mangle the shebangs of its files
+%global __os_install_post %{nil}
+%global debug_package %{nil}
+%global _build_id_links none
+Requires: {{rpm_package['basepython']}}
+{% elif rpm_package['bootstrap_deps'] %}
 # Install deps for {{ global['distro.name()'] }} {{ global['distro.major_version()'] }}.{{global['distro.minor_version()']}}
 Requires(post): {% for package in rpm_package['bootstrap_deps'] %}{{package}}{{ ", " if not loop.last }}{% endfor %}
 {% endif %}{% if rpm_package['deps'] %}
@@ -37,6 +46,11 @@ Requires: {% for package in rpm_package['deps'] %}{{package}}{{ ", " if not loop
 
 %install
 mkdir -p %{buildroot}/usr/share/%{name}_%{version}/
+{% if rpm_package['prebuilt_virtualenv'] %}
+cp {{rpm_package['cwd']}}/deploy.conf %{buildroot}/usr/share/%{name}_%{version}/deploy.conf
+mkdir -p %{buildroot}{{rpm_package['virtualenv_deploy_dir']}}
+cp -a {{rpm_package['cwd']}}/{{rpm_package['virtualenv_build_dir']}}/. %{buildroot}{{rpm_package['virtualenv_deploy_dir']}}
+{% else %}
 mkdir -p %{buildroot}/usr/share/%{name}_%{version}/package_scripts/
 cp -r {{rpm_package['cwd']}}/wheels %{buildroot}/usr/share/%{name}_%{version}
 cp {{rpm_package['cwd']}}/deploy.conf %{buildroot}/usr/share/%{name}_%{version}/deploy.conf
@@ -44,10 +58,29 @@ cp {{rpm_package['cwd']}}/post_install.py %{buildroot}/usr/share/%{name}_%{versi
 cp {{rpm_package['cwd']}}/pre_uninstall.py %{buildroot}/usr/share/%{name}_%{version}/package_scripts/pre_uninstall.py
 chmod 755 %{buildroot}/usr/share/%{name}_%{version}/package_scripts/post_install.py
 chmod 755 %{buildroot}/usr/share/%{name}_%{version}/package_scripts/pre_uninstall.py
+{% endif %}
 {% for source, dest in rpm_package['file_tuples'] %}mkdir -p $(dirname %{buildroot}{{dest[-1]}})
 cp -a {{rpm_package['source_dir']}}/{{source}} %{buildroot}{{dest[-1]}}
 {% endfor %}
 
+{% if rpm_package['prebuilt_virtualenv'] %}
+%post
+{% for filename in rpm_package['virtualenv_bin_files'] %}
+if [ -L "{{rpm_package['bin_dir']}}/{{filename}}" ] || [ ! -e "{{rpm_package['bin_dir']}}/{{filename}}" ]; then
+    ln -sfn "{{rpm_package['virtualenv_deploy_dir']}}/bin/{{filename}}" "{{rpm_package['bin_dir']}}/{{filename}}"
+fi
+{% endfor %}
+
+%preun
+if [ "$1" = "0" ]; then
+{% for filename in rpm_package['virtualenv_bin_files'] %}
+    if [ "$(readlink "{{rpm_package['bin_dir']}}/{{filename}}")" = "{{rpm_package['virtualenv_deploy_dir']}}/bin/{{filename}}" ]; then
+        rm -f "{{rpm_package['bin_dir']}}/{{filename}}"
+    fi
+{% endfor %}
+    true
+fi
+{% else %}
 %post
 export RPM_ARG="$1"
 export PATH=$PATH:/opt/python/bin:/usr/local/bin
@@ -84,20 +117,29 @@ export RPM_ARG="$1"
 
 %postun
 rm -rf /usr/share/%{name}_%{version}
+{% endif %}
 
 %files
 %defattr(0755, root, root, 0755)
 /usr/share/%{name}_%{version}/*
 {% for source, dest in rpm_package['file_tuples'] %}{% for elem in dest %}{{elem}} {% endfor %}
 {% endfor %}
+{% if rpm_package['prebuilt_virtualenv'] %}
+%defattr(-, root, root, -)
+{{rpm_package['virtualenv_deploy_dir']}}
+{% endif %}
 """
 
 RPM_CONFIG_DEFAULT = """[rpm_package]
 bin_dir =
+prebuilt_virtualenv = False
 deps:
 files:
 """
 
+# Name of the directory the prebuilt virtualenv is built in
+PREBUILT_VIRTUALENV_DIRECTORY = 'prebuilt_virtualenv'
+
 class InvirtualenvRPM(InvirtualenvPlugin):
     hash = 'sha256'
     package_formats = ['rpm']
@@ -106,6 +148,7 @@ class InvirtualenvRPM(InvirtualenvPlugin):
     config_types = {
         'rpm_package': {
             'bin_dir': str,
+            'prebuilt_virtualenv': bool,
             'deps': list,
             'files': list,
         }
@@ -113,6 +156,8 @@ class InvirtualenvRPM(InvirtualenvPlugin):
     default_config_filename = 'invirtualenv.spec'
 
     def add_plugin_configuration(self):
+        import distro
+
         # Make sure the configuration is sane
         # self.config['rpm_package']['deps'].append('invirtualenv')
         self.config['rpm_package']['cwd'] = os.getcwd()
@@ -192,8 +237,69 @@ class InvirtualenvRPM(InvirtualenvPlugin):
             except IsADirectoryError:
                 os.makedirs(full_dest, exist_ok=True)
 
-    def system_requirements_ok(self):
-        if find_executable('rpmbuild'):
+    def package_cache_files(self):
+        # The spec copies the [rpm_package] files from the source directory
+        files = []
+        for source, _ in self.config['rpm_package'].get('file_tuples', []):
+            files.append(source if source.startswith('/') else os.path.join(self.source_dir, source))
+        return files
+
+    def build_prebuilt_virtualenv(self, wheel_dir='wheels'):
+        """
+        Build the application virtualenv from the package wheels and relocate
+        it to the directory it is deployed to, so the package can install it
+        without running pip on every host
+
+        Parameters
+        ----------
+        wheel_dir : str, optional
+            The directory containing the package wheels
+
+        Returns
+        -------
+        str
+            The directory the virtualenv is deployed to
+
+        Raises
+        ------
+        BuildException
+            The basepython setting is not an absolute path, the virtualenv
+            links to the interpreter so it must be at the same path on the
+            hosts the package is installed on
+        """
+        basepython = self.config['rpm_package'].get('basepython', '')
+        if not basepython or not os.path.isabs(basepython):
+            raise BuildException(
+                'The prebuilt_virtualenv setting requires basepython to be the absolute path of the interpreter on the target hosts'
+            )
+        name = self.config['global']['name']
+        if self.config['global'].get('version', ''):
+            name += '_' + self.config['global']['version']
+        deploy_dir = os.path.join(self.config['global'].get('virtualenv_dir', '') or default_virtualenv_directory(), name)
+
+        build_dir = os.path.join(os.getcwd(), PREBUILT_VIRTUALENV_DIRECTORY)
+        if os.path.exists(build_dir):
+            shutil.rmtree(build_dir)
+        logger.debug('Building the prebuilt virtualenv %r for %r', build_dir, deploy_dir)
+        build_virtualenv(
+            PREBUILT_VIRTUALENV_DIRECTORY, os.getcwd(), python_interpreter=basepython
+        )
+        install_python_dependencies(
+            build_dir, deps=self.config['pip']['deps'], use_index=False, no_deps=self._locked, wheel_dirs=[os.path.abspath(wheel_dir)]
+        )
+        relocate_virtualenv(build_dir, deploy_dir, move=False)
+
+        link_bin_files = self.config['global'].get('link_bin_files', 'false').lower() in ['1', 'true', 'yes', 'on']
+        self.config['rpm_package']['virtualenv_bin_files'] = sorted(deployed_bin_files(build_dir)) if link_bin_files else []
+        if not self.config['rpm_package']['bin_dir']:
+            self.config['rpm_package']['bin_dir'] = self.config['global'].get('bin_dir', '') or '/usr/bin'
+        self.config['rpm_package']['virtualenv_build_dir'] = PREBUILT_VIRTUALENV_DIRECTORY
+        self.config['rpm_package']['virtualenv_deploy_dir'] = deploy_dir
+        return deploy_dir
+
+    @classmethod
+    def system_requirements_ok(cls):
+        if toolchain_inventory().executable('rpmbuild'):
             return True
         logger.debug('The rpmbuild command is not present, disabling the rpm plugin')
         return False
@@ -206,6 +312,29 @@ class InvirtualenvRPM(InvirtualenvPlugin):
             with open(os.path.basename(script), 'wb') as script_handle:
                 script_handle.write(pkgutil.get_data('invirtualenv_plugins', script))
 
+        if self.config['rpm_package']['prebuilt_virtualenv']:
+            self.build_prebuilt_virtualenv(wheel_dir)
+
+        command = [toolchain_inventory().executable('rpmbuild'), '-ba', 'package.spec']
+        env = {'LANG': 'C'}
+        timestamp = self.build_timestamp()
+        if timestamp is not None:
+            # Pass the build paths to rpmbuild as macros so the spec doesn't contain them, and have rpm use the
+            # timestamp for the build time and the file modification times
+            defines = {'invirtualenv_build_dir': self.config['rpm_package']['cwd']}
+            self.config['rpm_package']['cwd'] = '%{invirtualenv_build_dir}'
+            if self.source_dir:
+                defines['invirtualenv_source_dir'] = self.source_dir
+                self.config['rpm_package']['source_dir'] = '%{invirtualenv_source_dir}'
+            defines.update({
+                '_buildhost': 'reproducible',
+                'use_source_date_epoch_as_buildtime': '1',
+                'clamp_mtime_to_source_date_epoch': '1',
+            })
+            for name, value in sorted(defines.items()):
+                command += ['--define', '%s %s' % (name, value)]
+            env['SOURCE_DATE_EPOCH'] = str(timestamp)
+
         logger.debug('Config')
         logger.debug(json.dumps(self.config, indent=4, sort_keys=True))
         logger.debug('Spec')
@@ -216,9 +345,8 @@ class InvirtualenvRPM(InvirtualenvPlugin):
         logger.debug('source_dir: %s', self.source_dir)
         with open('package.spec', 'w') as spec_handle:
             spec_handle.write(self.render_template_with_config())
-        command = [find_executable('rpmbuild'), '-ba', 'package.spec']
         logger.debug('Running command %r', ' '.join(command))
-        output = subprocess.check_output(command, env={'LANG': 'C'})
+        output = subprocess.check_output(command, env=env)
         output = output.decode(errors='ignore')
         packages = []
         for line in output.split('\n'):
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# Copyright (c) 2016, Yahoo Inc.
+# Copyrights licensed under the BSD License
+# See the accompanying LICENSE.txt file for terms.
+import os
+import unittest
+from invirtualenv.buildcache import BuildCache, content_digest
+from invirtualenv.contextmanager import InTemporaryDirectory
+
+
+class TestBuildCache(unittest.TestCase):
+    def test__content_digest__relative_to_root(self):
+        with InTemporaryDirectory() as tempdir:
+            for directory in ['one', 'two']:
+                os.makedirs(os.path.join(directory, 'wheels'))
+                with open(os.path.join(directory, 'wheels', 'a.whl'), 'w') as handle:
+                    handle.write('a')
+            first = content_digest([os.path.join(tempdir, 'one', 'wheels')], root=os.path.join(tempdir, 'one'))
+            second = content_digest([os.path.join(tempdir, 'two', 'wheels')], root=os.path.join(tempdir, 'two'))
+            self.assertEqual(first, second)
+            with open(os.path.join('two', 'wheels', 'a.whl'), 'w') as handle:
+                handle.write('b')
+            self.assertNotEqual(first, content_digest([os.path.join(tempdir, 'two', 'wheels')], root=os.path.join(tempdir, 'two')))
+
+    def test__content_digest__missing(self):
+        with InTemporaryDirectory():
+            self.assertNotEqual(content_digest(['missing']), content_digest(['other']))
+
+    def test__key(self):
+        self.assertEqual(BuildCache.key('stage', {'a': 1, 'b': 2}), BuildCache.key('stage', {'b': 2, 'a': 1}))
+        self.assertNotEqual(BuildCache.key('stage', [1]), BuildCache.key('other', [1]))
+
+    def test__restore__miss(self):
+        with InTemporaryDirectory() as tempdir:
+            cache = BuildCache(os.path.join(tempdir, 'cache'))
+            self.assertIsNone(cache.restore(cache.key('stage', []), tempdir))
+
+    def test__save_restore(self):
+        with InTemporaryDirectory() as tempdir:
+            os.makedirs('build/wheels')
+            with open('build/wheels/a.whl', 'w') as handle:
+                handle.write('wheel')
+            with open('build/wheels.tar.gz', 'w') as handle:
+                handle.write('archive')
+            cache = BuildCache(os.path.join(tempdir, 'cache'))
+            key = cache.key('stage', ['inputs'])
+            cache.save(
+                key, {'wheel_dir': 'wheels'},
+                files={'wheels': os.path.join(tempdir, 'build/wheels'), 'wheels.tar.gz': os.path.join(tempdir, 'build/wheels.tar.gz')}
+            )
+            os.makedirs('restored')
+            self.assertEqual(cache.restore(key, os.path.join(tempdir, 'restored')), {'wheel_dir': 'wheels'})
+            with open('restored/wheels/a.whl') as handle:
+                self.assertEqual(handle.read(), 'wheel')
+            with open('restored/wheels.tar.gz') as handle:
+                self.assertEqual(handle.read(), 'archive')
+
+    def test__save__existing_entry(self):
+        with InTemporaryDirectory() as tempdir:
+            cache = BuildCache(os.path.join(tempdir, 'cache'))
+            key = cache.key('stage', [])
+            cache.save(key, {'value': 1})
+            cache.save(key, {'value': 2})
+            self.assertEqual(cache.restore(key, tempdir), {'value': 1})
+            self.assertEqual(os.listdir(os.path.join(tempdir, 'cache', key[:2])), [key])
@@ -6,6 +6,7 @@
 import os
 import sys
 import unittest
+from unittest import mock
 from invirtualenv.cli import parse_cli_arguments, main
 from invirtualenv.contextmanager import InTemporaryDirectory
 from invirtualenv.plugin import package_formats
@@ -43,6 +44,18 @@ class TestCli(unittest.TestCase):
             for plugin in package_formats():
                 self.assertIn(plugin, output)
 
+    def test__lock_command(self):
+        with InTemporaryDirectory():
+            with open('deploy.conf', 'w') as write_handle:
+                write_handle.write('[global]\nname=foo\n[pip]\ndeps:\n    six\n')
+            sys.argv = ['invirtualenv', 'lock']
+            with mock.patch('invirtualenv.lock.generate_lock', return_value=['six==1.16.0 --hash=sha256:abc']):
+                rc, output = main(test=True)
+            self.assertEqual(rc, 0)
+            self.assertTrue(output.endswith('deploy.lock'))
+            with open('deploy.lock') as lock_handle:
+                self.assertIn('six==1.16.0 --hash=sha256:abc', lock_handle.read())
+
     def test__get_setting_command(self):
         with InTemporaryDirectory():
             with open('deploy.conf', 'w') as write_handle:
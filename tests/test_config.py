@@ -19,6 +19,7 @@ import shutil
 import sys
 import tempfile
 import unittest
+from unittest import mock
 from invirtualenv import config, plugin
 from invirtualenv.contextmanager import InTemporaryDirectory
 
@@ -32,6 +33,8 @@ class TestConfig(unittest.TestCase):
             'description': 'No description is available',
             'name': '',
             'install_os_packages': False,
+            'reproducible': False,
+            'base_virtualenv': False,
             'install_manifest': [],
             'version': '',
             'virtualenv_deploy_dir': '',
@@ -41,8 +44,14 @@ class TestConfig(unittest.TestCase):
             'virtualenv_version_package': ''
         },
         'pip': {
+            'build_jobs': 0,
+            'compiler_cache': '',
+            'compiler_cache_size': 5120,
             'deps': [],
+            'locked': False,
             'pip_version': '',
+            'wheel_cache': True,
+            'wheel_cache_size': 2048,
         },
         'rpm': {
             'deps': [],
@@ -185,6 +194,69 @@ class TestConfig(unittest.TestCase):
             os.remove(outfile)
             del os.environ['TEST_GEN_CONF']
 
+    def test_configuration__parsed_once(self):
+        config_file = os.path.join(self.venv_dir, 'parsed_once.conf')
+        with open(config_file, 'w') as config_handle:
+            config_handle.write("[global]\nname=foo\n[pip]\ndeps:\n    bar\n")
+        configuration = config.Configuration([config_file])
+        with mock.patch.object(config, 'str_format_env', wraps=config.str_format_env) as str_format_env:
+            first = configuration.as_dict()
+            second = configuration.as_dict()
+            rendered = str_format_env.call_count
+        self.assertGreater(rendered, 0)
+        self.assertEqual(first, second)
+        self.assertEqual(first['pip']['deps'], ['bar'])
+        self.assertEqual(configuration.parser.get('global', 'name'), 'foo')
+
+        # The views handed out can be modified without changing the configuration
+        first['global']['name'] = 'changed'
+        parser = configuration.config_parser()
+        parser.set('global', 'name', 'changed')
+        self.assertEqual(configuration.values['global']['name'], 'foo')
+        self.assertEqual(configuration.parser.get('global', 'name'), 'foo')
+
+    def test_load_configuration__passthrough(self):
+        config_file = os.path.join(self.venv_dir, 'passthrough.conf')
+        with open(config_file, 'w') as config_handle:
+            config_handle.write("[global]\nname=foo\n")
+        configuration = config.Configuration([config_file])
+        self.assertIs(config.load_configuration(configuration), configuration)
+        self.assertEqual(config.get_configuration_dict(configuration)['global']['name'], 'foo')
+
+    def test_configuration__cache(self):
+        config_file = os.path.join(self.venv_dir, 'cached.conf')
+        with open(config_file, 'w') as config_handle:
+            config_handle.write("[global]\nname=foo\nversion=0.0.1\n")
+        cache_dir = os.path.join(self.tempdir, 'cache')
+        with mock.patch.dict(os.environ, {'INVIRTUALENV_CACHE_DIR': cache_dir}):
+            self.assertEqual(config.Configuration([config_file]).values['global']['version'], '0.0.1')
+            cache_files = os.listdir(os.path.join(cache_dir, 'config'))
+            self.assertEqual(len(cache_files), 1)
+            self.assertEqual(os.stat(os.path.join(cache_dir, 'config', cache_files[0])).st_mode & 0o777, 0o600)
+
+            # A hit does not parse or render the configuration
+            with mock.patch.object(config.Configuration, '_render', side_effect=AssertionError('rendered')):
+                configuration = config.Configuration([config_file])
+                self.assertEqual(configuration.values['global']['version'], '0.0.1')
+                self.assertEqual(configuration.values['pip']['deps'], [])
+
+            # So does the configuration content
+            with open(config_file, 'a') as config_handle:
+                config_handle.write("description=changed\n")
+            self.assertEqual(config.Configuration([config_file]).values['global']['description'], 'changed')
+
+    def test_configuration__cache__environment(self):
+        config_file = os.path.join(self.venv_dir, 'secret.conf')
+        with open(config_file, 'w') as config_handle:
+            config_handle.write("[global]\nname=foo\nversion=0.0.{{CACHE_BUILD_NUMBER|default('0')}}\n")
+        cache_dir = os.path.join(self.tempdir, 'cache')
+        with mock.patch.dict(os.environ, {'INVIRTUALENV_CACHE_DIR': cache_dir, 'CACHE_BUILD_NUMBER': '1'}):
+            self.assertEqual(config.Configuration([config_file]).values['global']['version'], '0.0.1')
+            # Values rendered from the environment are never written to the cache
+            self.assertFalse(os.listdir(os.path.join(cache_dir, 'config')))
+            os.environ['CACHE_BUILD_NUMBER'] = '2'
+            self.assertEqual(config.Configuration([config_file]).values['global']['version'], '0.0.2')
+
     def test_plugin_package_formats(self):
         result = plugin.package_formats()
         self.assertIsInstance(result, list)
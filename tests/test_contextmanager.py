@@ -19,3 +19,10 @@ class TestContextmanager(unittest.TestCase):
         with invirtualenv.contextmanager.InTemporaryDirectory() as tempdir:
             self.assertIsInstance(tempdir, str)
             self.assertTrue(os.path.exists(tempdir))
+
+    def test__InTemporaryDir__dir(self):
+        with invirtualenv.contextmanager.InTemporaryDirectory() as parent:
+            with invirtualenv.contextmanager.InTemporaryDirectory(dir=parent) as tempdir:
+                self.assertEqual(os.path.dirname(tempdir), parent)
+                self.assertEqual(os.getcwd(), tempdir)
+            self.assertFalse(os.path.exists(tempdir))
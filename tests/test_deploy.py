@@ -17,8 +17,11 @@ import shutil
 import subprocess
 import sys
 import tempfile
+import threading
 import unittest
+from unittest import mock
 from invirtualenv import deploy
+from invirtualenv.lock import write_lock
 from invirtualenv.contextmanager import TemporaryDirectory
 
 
@@ -65,6 +68,11 @@ class TestDeploy(unittest.TestCase):
         self.assertEqual(os.stat(venv).st_uid, nobody.pw_uid)
         self.assertEqual(os.stat(venv).st_gid, nobody.pw_gid)
 
+    def test__interpreter_from_os_packages(self):
+        self.assertFalse(deploy.interpreter_from_os_packages(sys.executable, ['libffi-devel']))
+        self.assertTrue(deploy.interpreter_from_os_packages(sys.executable, ['python3-devel']))
+        self.assertTrue(deploy.interpreter_from_os_packages('/opt/missing/bin/python3.99', []))
+
     def test__build_deploy_virtualenv(self):
         sys.argv = ['foo']
         venv_name = 'deploy_default'
@@ -165,6 +173,55 @@ class TestDeploy(unittest.TestCase):
             deploy.unlink_deployed_bin_files(venv_path)
             self.assertEqual([], os.listdir(bindir))
 
+    def test__build_deploy_virtualenv__lock(self):
+        sys.argv = ['foo']
+        config_file = os.path.join(self.venv_dir, 'deploy_default.conf')
+        with open(config_file, 'w') as config_handle:
+            config_handle.write(
+                "[global]\nname=deploy_default\nvirtualenv_dir=%s\n"
+                "[pip]\ndeps=serviceping<18.0.0\n" % self.venv_dir
+            )
+        write_lock(
+            os.path.join(self.venv_dir, 'deploy_default.lock'), ['serviceping<18.0.0'],
+            ['serviceping==17.6.0 --hash=sha256:abc']
+        )
+        with mock.patch.object(deploy, 'build_virtualenv', return_value=self.venv_dir):
+            with mock.patch.object(deploy, 'install_python_dependencies') as install_python_dependencies:
+                deploy.build_deploy_virtualenv(configuration=[config_file], verbose=False)
+        kwargs = install_python_dependencies.call_args[1]
+        self.assertEqual(kwargs['deps'], ['serviceping==17.6.0 --hash=sha256:abc'])
+        self.assertTrue(kwargs['no_deps'])
+
+    @unittest.skipUnless(os.getuid() == 0, "This test requires root")
+    def test__build_deploy_virtualenv__os_phase_failure(self):
+        sys.argv = ['foo']
+        venv_path = os.path.join(self.venv_dir, 'deploy_default')
+        config_file = os.path.join(self.venv_dir, 'deploy_default.conf')
+        with open(config_file, 'w') as config_handle:
+            config_handle.write(
+                "[global]\nname=deploy_default\nvirtualenv_dir=%s\n"
+                "[pip]\ndeps=serviceping\n[rpm]\ndeps=missing-package\n" % self.venv_dir
+            )
+        created = threading.Event()
+
+        def fake_build_virtualenv(name, directory, **kwargs):
+            os.makedirs(os.path.join(directory, name))
+            created.set()
+            return os.path.join(directory, name)
+
+        def fake_install_rpm_dependencies(**kwargs):
+            # Fail after the virtualenv was created at the same time
+            created.wait(10)
+            raise deploy.BuildException('yum failed')
+
+        with mock.patch.object(deploy, 'build_virtualenv', side_effect=fake_build_virtualenv):
+            with mock.patch.object(deploy, 'install_rpm_dependencies', side_effect=fake_install_rpm_dependencies):
+                with mock.patch.object(deploy, 'install_python_dependencies') as install_python_dependencies:
+                    with self.assertRaises(deploy.BuildException):
+                        deploy.build_deploy_virtualenv(configuration=[config_file], verbose=False)
+        install_python_dependencies.assert_not_called()
+        self.assertFalse(os.path.exists(venv_path))
+
     def test__build_deploy_virtualenv__package_tools__up_to_date(self):
         sys.argv = ['foo']
         venv_name = 'deploy_default'
@@ -9,9 +9,26 @@ test_invirtualenv
 
 Tests for `invirtualenv` module.
 """
+import json
+import subprocess
+import sys
 import unittest
 
 
+# Modules the cli should only import when a command needs them
+CLI_LAZY_MODULES = ['defusedxml', 'distro', 'jinja2', 'pkg_resources', 'requests', 'invirtualenv_plugins']
+
+
+def imported_modules(code):
+    """
+    Run python code in a new interpreter and return the names of the modules
+    it imported.
+    """
+    code = 'import atexit, json, sys\natexit.register(lambda: sys.stderr.write(json.dumps(sorted(sys.modules))))\n' + code
+    process = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return json.loads(process.stderr.decode().splitlines()[-1])
+
+
 class TestImport(unittest.TestCase):
 
     def test_import_invirtualenv(self):
@@ -38,6 +55,25 @@ class TestImport(unittest.TestCase):
     def test_import_invirtualenv_plugin(self):
         import invirtualenv.plugin
 
+    def assertNotImported(self, modules):
+        for module in modules:
+            for lazy_module in CLI_LAZY_MODULES:
+                self.assertFalse(
+                    module == lazy_module or module.startswith(lazy_module + '.'), '%r was imported' % module
+                )
+
+    def test_import_invirtualenv_cli__startup(self):
+        modules = imported_modules('import invirtualenv.cli')
+        self.assertIn('invirtualenv.cli', modules)
+        self.assertNotImported(modules)
+
+    def test_import_invirtualenv_cli__help(self):
+        modules = imported_modules(
+            "import sys; sys.argv = ['invirtualenv', '--help']; from invirtualenv.cli import main; main()"
+        )
+        self.assertIn('invirtualenv.cli', modules)
+        self.assertNotImported(modules)
+
 
 if __name__ == '__main__':
     test_suite = unittest.TestLoader().loadTestsFromTestCase(TestImport)
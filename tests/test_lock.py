@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# Copyright (c) 2016, Yahoo Inc.
+# Copyrights licensed under the BSD License
+# See the accompanying LICENSE.txt file for terms.
+import hashlib
+import os
+import shutil
+import subprocess  # nosec
+import sys
+import unittest
+from unittest import mock
+import zipfile
+from invirtualenv import lock, wheelhouse
+from invirtualenv.config import Configuration
+from invirtualenv.contextmanager import InTemporaryDirectory
+
+
+def fake_pip_download(cmd, **kwargs):
+    directory = cmd[cmd.index('-d') + 1]
+    for filename in ['six-1.16.0-py2.py3-none-any.whl', 'compiled-2.0.tar.gz']:
+        with open(os.path.join(directory, filename), 'w') as file_handle:
+            file_handle.write(filename)
+    return b''
+
+
+def fake_pip_download_wheels(cmd, **kwargs):
+    directory = cmd[cmd.index('-d') + 1]
+    with open(os.path.join(directory, 'six-1.16.0-py2.py3-none-any.whl'), 'w') as file_handle:
+        file_handle.write('six-1.16.0-py2.py3-none-any.whl')
+    return b''
+
+
+def create_wheel(directory, name, version, tags):
+    dist_info = '{name}-{version}.dist-info'.format(name=name, version=version)
+    files = {
+        dist_info + '/METADATA': 'Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n'.format(name=name, version=version),
+        dist_info + '/WHEEL': 'Wheel-Version: 1.0\nRoot-Is-Purelib: false\nTag: {tags}\n'.format(tags=tags),
+    }
+    files[dist_info + '/RECORD'] = ''.join('%s,,\n' % filename for filename in list(files) + [dist_info + '/RECORD'])
+    with zipfile.ZipFile(os.path.join(directory, '{name}-{version}-{tags}.whl'.format(name=name, version=version, tags=tags)), 'w') as wheel:
+        for filename, contents in files.items():
+            wheel.writestr(filename, contents)
+
+
+class TestLock(unittest.TestCase):
+    def test__lock_filename(self):
+        self.assertEqual(lock.lock_filename('/tmp/app/deploy.conf'), '/tmp/app/deploy.lock')
+
+    def test__generate_lock(self):
+        with mock.patch('invirtualenv.wheelhouse.subprocess.check_output', side_effect=fake_pip_download_wheels) as check_output:
+            with mock.patch('invirtualenv.lock.package_file_hashes', return_value=['sha256:other']) as index_hashes:
+                requirements = lock.generate_lock(['pip'], ['six'])
+        self.assertEqual(requirements, [
+            'six==1.16.0 --hash=sha256:' + hashlib.sha256(b'six-1.16.0-py2.py3-none-any.whl').hexdigest() + ' --hash=sha256:other',
+        ])
+        index_hashes.assert_called_once_with('six', '1.16.0', index_url=None)
+        self.assertEqual(check_output.call_count, 1)
+
+    def test__generate_lock__source_package(self):
+        # Source packages are built into wheels when they are installed, which don't match any hash
+        with mock.patch('invirtualenv.wheelhouse.subprocess.check_output', side_effect=fake_pip_download):
+            with mock.patch('invirtualenv.lock.package_file_hashes', return_value=['sha256:other']):
+                requirements = lock.generate_lock(['pip'], ['six', 'compiled'])
+        self.assertEqual(requirements, ['compiled==2.0', 'six==1.16.0'])
+
+    def test__generate_lock__index_unavailable(self):
+        with mock.patch('invirtualenv.wheelhouse.subprocess.check_output', side_effect=fake_pip_download_wheels):
+            with mock.patch('invirtualenv.lock.package_file_hashes', side_effect=OSError('offline')):
+                requirements = lock.generate_lock(['pip'], ['six'])
+        self.assertEqual(requirements, ['six==1.16.0 --hash=sha256:' + hashlib.sha256(b'six-1.16.0-py2.py3-none-any.whl').hexdigest()])
+
+    def test__generate_lock__other_platform(self):
+        with InTemporaryDirectory() as tempdir:
+            index = os.path.join(tempdir, 'index')
+            os.makedirs(index)
+            for platform_tag in ['manylinux2014_x86_64', 'manylinux2014_aarch64']:
+                create_wheel(index, 'compiled', '2.0', 'cp311-cp311-' + platform_tag)
+
+            def fake_pip_download_x86_64(cmd, **kwargs):
+                # The lock is generated on an x86_64 host
+                shutil.copy(os.path.join(index, 'compiled-2.0-cp311-cp311-manylinux2014_x86_64.whl'), cmd[cmd.index('-d') + 1])
+                return b''
+
+            index_hashes = ['sha256:' + wheelhouse.hash_file(os.path.join(index, filename)).split(':')[1] for filename in os.listdir(index)]
+            with mock.patch('invirtualenv.wheelhouse.subprocess.check_output', side_effect=fake_pip_download_x86_64):
+                with mock.patch('invirtualenv.lock.package_file_hashes', return_value=index_hashes):
+                    requirements = lock.generate_lock(['pip'], ['compiled'])
+            lock.write_lock('deploy.lock', ['compiled'], requirements)
+
+            # Install the lock on an aarch64 host, pip checks the hashes of the downloaded files
+            subprocess.check_output([  # nosec
+                sys.executable, '-m', 'pip', 'download', '-q', '--no-index', '--find-links', index, '--no-deps',
+                '--only-binary', ':all:', '--platform', 'manylinux2014_aarch64', '--python-version', '3.11',
+                '--implementation', 'cp', '--abi', 'cp311', '-d', 'downloads', '-r', 'deploy.lock'
+            ], stderr=subprocess.STDOUT)
+            self.assertEqual(os.listdir('downloads'), ['compiled-2.0-cp311-cp311-manylinux2014_aarch64.whl'])
+
+    def test__read_lock(self):
+        with InTemporaryDirectory():
+            lock.write_lock('deploy.lock', ['six'], ['six==1.16.0 --hash=sha256:abc'])
+            self.assertEqual(lock.read_lock('deploy.lock', ['six']), ['six==1.16.0 --hash=sha256:abc'])
+            self.assertEqual(lock.read_lock('deploy.lock'), ['six==1.16.0 --hash=sha256:abc'])
+
+    def test__read_lock__out_of_date(self):
+        with InTemporaryDirectory():
+            lock.write_lock('deploy.lock', ['six'], ['six==1.16.0 --hash=sha256:abc'])
+            self.assertIsNone(lock.read_lock('deploy.lock', ['six', 'requests']))
+
+    def test__read_lock__missing(self):
+        with InTemporaryDirectory():
+            self.assertIsNone(lock.read_lock('deploy.lock', ['six']))
+            self.assertIsNone(lock.read_lock(None))
+
+    def test__find_lock_file(self):
+        with InTemporaryDirectory() as tempdir:
+            with open('deploy.conf', 'w') as deploy_conf_handle:
+                deploy_conf_handle.write('[global]\nname=foo\n')
+            configuration = Configuration(['deploy.conf'])
+            self.assertIsNone(lock.find_lock_file(configuration))
+            lock.write_lock('deploy.lock', [], [])
+            os.chdir('/')
+            self.assertEqual(lock.find_lock_file(configuration), os.path.join(tempdir, 'deploy.lock'))
+
+
+if __name__ == '__main__':
+    unittest.main()
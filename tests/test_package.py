@@ -12,6 +12,7 @@ Tests for `invirtualenv` module.
 import os
 import sys
 import unittest
+from unittest import mock
 from invirtualenv import package
 
 
@@ -32,6 +33,19 @@ class TestPackage(unittest.TestCase):
         result = package.package_versions('invirtualenv')
         self.assertIsInstance(result, list)
 
+    def test_package_file_hashes(self):
+        index_page = (
+            '<a href="../../packages/compiled-2.0-cp311-cp311-manylinux2014_x86_64.whl#sha256=aaa">x</a>'
+            '<a href="../../packages/compiled-2.0-cp311-cp311-manylinux2014_aarch64.whl#sha256=bbb">x</a>'
+            '<a href="../../packages/compiled-2.0.tar.gz#sha256=ccc">x</a>'
+            '<a href="../../packages/compiled-1.0.tar.gz#sha256=ddd">x</a>'
+        )
+        with mock.patch('requests.get') as get:
+            get.return_value.text = index_page
+            hashes = package.package_file_hashes('Compiled', '2.0', index_url='https://index/simple')
+        get.assert_called_once_with('https://index/simple/compiled/', timeout=mock.ANY)
+        self.assertEqual(hashes, ['sha256:aaa', 'sha256:bbb', 'sha256:ccc'])
+
     def test_strip_from_end(self):
         result = package.strip_from_end("hello.conf", '.conf')
         self.assertEqual(result, 'hello')
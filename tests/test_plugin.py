@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# Copyright (c) 2016, Yahoo Inc.
+# Copyrights licensed under the BSD License
+# See the accompanying LICENSE.txt file for terms.
+import os
+import sys
+import unittest
+from unittest import mock
+from invirtualenv import plugin
+from invirtualenv.contextmanager import InTemporaryDirectory
+from invirtualenv.exceptions import PackageGenerationFailure
+from invirtualenv.plugin_base import InvirtualenvPlugin
+from invirtualenv_plugins.parsedconfig import InvirtualenvParsedConfig
+
+
+class TestPluginRegistry(unittest.TestCase):
+    def test__registry__finds_builtin_plugins(self):
+        with InTemporaryDirectory() as tempdir:
+            registry = plugin.PluginRegistry(index_filename=os.path.join(tempdir, 'index.json'))
+            names = [entry_point.name for entry_point in registry.iter_entry_points('invirtualenv.plugin')]
+            self.assertIn('parsedconfig', names)
+            self.assertIn('InvirtualenvParsedConfig', [cls.__name__ for cls in registry.load('invirtualenv.plugin')])
+
+    def test__registry__warm_start_does_not_scan(self):
+        with InTemporaryDirectory() as tempdir:
+            index_filename = os.path.join(tempdir, 'index.json')
+            plugin.PluginRegistry(index_filename=index_filename).entry_points
+            self.assertTrue(os.path.exists(index_filename))
+
+            registry = plugin.PluginRegistry(index_filename=index_filename)
+            with mock.patch.object(plugin.PluginRegistry, 'scan', side_effect=AssertionError('scanned')):
+                self.assertTrue(registry.iter_entry_points('invirtualenv.plugin'))
+
+    def test__registry__path_change_rescans(self):
+        with InTemporaryDirectory() as tempdir:
+            index_filename = os.path.join(tempdir, 'index.json')
+            plugin.PluginRegistry(index_filename=index_filename).entry_points
+
+            registry = plugin.PluginRegistry(path=sys.path + [tempdir], index_filename=index_filename)
+            with mock.patch.object(plugin.PluginRegistry, 'scan', return_value={}) as scan:
+                self.assertEqual(registry.iter_entry_points('invirtualenv.plugin'), [])
+                scan.assert_called_once_with()
+
+    def test__registry__stale_index_rescans(self):
+        with InTemporaryDirectory() as tempdir:
+            index_filename = os.path.join(tempdir, 'index.json')
+            registry = plugin.PluginRegistry(index_filename=index_filename)
+            registry._entry_points = {
+                'invirtualenv.plugin': [plugin.PluginEntryPoint('missing', 'invirtualenv_missing_plugin_module', 'Plugin')]
+            }
+            registry._from_index = True
+            self.assertIn('InvirtualenvParsedConfig', [cls.__name__ for cls in registry.load('invirtualenv.plugin')])
+
+
+class TestPluginFormatIndex(unittest.TestCase):
+    def test__format_index__does_not_construct_plugins(self):
+        with InTemporaryDirectory() as tempdir:
+            registry = plugin.PluginRegistry(index_filename=os.path.join(tempdir, 'index.json'))
+            with mock.patch.object(InvirtualenvPlugin, '__init__', side_effect=AssertionError('constructed')):
+                index = registry.format_index()
+            self.assertEqual(index['parsed_deploy_conf'], InvirtualenvParsedConfig)
+
+    def test__format_index__instance_method_probe(self):
+        class LegacyPlugin(InvirtualenvPlugin):
+            package_formats = ['legacy']
+
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def system_requirements_ok(self):
+                return True
+
+        self.assertEqual(plugin.plugin_available_formats(LegacyPlugin), ['legacy'])
+
+    def test__get_package_plugin(self):
+        self.assertEqual(plugin.get_package_plugin('parsed_deploy_conf'), InvirtualenvParsedConfig)
+
+
+class FakePackagePlugin(InvirtualenvPlugin):
+    package_formats = ['fake1', 'fake2']
+
+    def run_package_command(self, package_hashes, wheel_dir='wheels'):
+        package = '{0}-{1}.pkg'.format(self.package_type, os.getpid())
+        with open(package, 'w') as package_handle:
+            package_handle.write(' '.join(sorted(os.listdir(wheel_dir))))
+        return package
+
+
+class FakePackagePlugin2(FakePackagePlugin):
+    package_type = 'fake2'
+
+
+class FakePackagePlugin1(FakePackagePlugin):
+    package_type = 'fake1'
+
+
+class FailingPackagePlugin(FakePackagePlugin):
+    package_formats = ['failing']
+    package_type = 'failing'
+
+    def run_package_command(self, package_hashes, wheel_dir='wheels'):
+        raise ValueError('build failed')
+
+
+def fake_generate_wheel_packages(self, wheeldir):
+    with open(os.path.join(wheeldir, 'six-1.16.0-py2.py3-none-any.whl'), 'w') as wheel_handle:
+        wheel_handle.write('six')
+    return {'six==1.16.0': 'sha256:abc'}
+
+
+class TestCreatePackages(unittest.TestCase):
+    def create_packages(self, index, package_types):
+        with open('deploy.conf', 'w') as deploy_conf_handle:
+            deploy_conf_handle.write('[global]\nname=foo\n[pip]\ndeps:\n    six\n')
+        with mock.patch.object(plugin.PluginRegistry, 'format_index', return_value=index):
+            with mock.patch.object(
+                InvirtualenvPlugin, 'generate_wheel_packages', autospec=True, side_effect=fake_generate_wheel_packages
+            ) as generate_wheel_packages:
+                results = plugin.create_packages(package_types, configuration=['deploy.conf'])
+        return results, generate_wheel_packages
+
+    def test__create_packages__shares_wheels(self):
+        with InTemporaryDirectory() as tempdir:
+            results, generate_wheel_packages = self.create_packages(
+                {'fake1': FakePackagePlugin1, 'fake2': FakePackagePlugin2}, ['fake1', 'fake2']
+            )
+            self.assertEqual(generate_wheel_packages.call_count, 1)
+            self.assertEqual(sorted(results.keys()), ['fake1', 'fake2'])
+            pids = set()
+            for package_type, package in results.items():
+                self.assertEqual(os.path.dirname(package), tempdir)
+                self.assertTrue(os.path.basename(package).startswith(package_type + '-'))
+                pids.add(int(os.path.basename(package).split('-')[1].split('.')[0]))
+                with open(package) as package_handle:
+                    self.assertEqual(package_handle.read(), 'six-1.16.0-py2.py3-none-any.whl')
+            self.assertEqual(len(pids), 2)
+            self.assertNotIn(os.getpid(), pids)
+
+    def test__create_packages__spawns(self):
+        import multiprocessing
+        with InTemporaryDirectory():
+            with mock.patch('multiprocessing.get_context', wraps=multiprocessing.get_context) as get_context:
+                self.create_packages({'fake1': FakePackagePlugin1}, ['fake1'])
+            get_context.assert_called_once_with('spawn')
+
+    def test__create_packages__failure(self):
+        with InTemporaryDirectory():
+            with self.assertRaises(PackageGenerationFailure):
+                self.create_packages({'fake1': FakePackagePlugin1, 'failing': FailingPackagePlugin}, ['fake1', 'failing'])
+
+
+if __name__ == '__main__':
+    unittest.main()
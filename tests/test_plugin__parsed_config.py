@@ -4,7 +4,9 @@
 # See the accompanying LICENSE.txt file for terms.
 import os
 import unittest
+from unittest import mock
 from invirtualenv.contextmanager import InTemporaryDirectory
+from invirtualenv.plugin_base import InvirtualenvPlugin
 from invirtualenv_plugins.parsedconfig import InvirtualenvParsedConfig
 
 
@@ -33,3 +35,15 @@ class TestPluginBase(unittest.TestCase):
                 config_handle.write(deploy_conf)
             plugin = InvirtualenvParsedConfig(config_file='deploy.conf')
             plugin.create_package('parsed_deploy_conf')
+
+    def test__create_package__skips_wheels(self):
+        with InTemporaryDirectory():
+            with open('deploy.conf', 'w') as config_handle:
+                config_handle.write(deploy_conf)
+            plugin = InvirtualenvParsedConfig(config_file='deploy.conf')
+            with mock.patch.object(InvirtualenvPlugin, 'generate_wheel_packages', side_effect=AssertionError('wheels generated')):
+                with mock.patch('invirtualenv.plugin_base.toolchain_inventory', side_effect=AssertionError('toolchain probed')):
+                    package = plugin.create_package('parsed_deploy_conf')
+            with open(package) as package_handle:
+                self.assertIn('confset', package_handle.read())
+
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Copyright (c) 2016, Yahoo Inc.
+# Copyrights licensed under the BSD License
+# See the accompanying LICENSE.txt file for terms.
+import json
+import os
+import unittest
+from unittest import mock
+from invirtualenv.contextmanager import InTemporaryDirectory
+from invirtualenv.exceptions import BuildException
+from invirtualenv.utility import compile_template
+from invirtualenv_plugins.rpm import InvirtualenvRPM, PREBUILT_VIRTUALENV_DIRECTORY, SPEC_TEMPLATE
+
+
+deploy_conf = """[global]
+name = test
+version = 1.0
+basepython = /usr/bin/python3
+virtualenv_dir = /opt/venvs
+link_bin_files = True
+
+[pip]
+deps:
+    confset
+
+[rpm_package]
+prebuilt_virtualenv = True
+"""
+
+
+def fake_build_virtualenv(name, directory, **kwargs):
+    os.makedirs(os.path.join(directory, name, 'conf'))
+    with open(os.path.join(directory, name, 'conf', 'binfiles_predeploy.json'), 'w') as handle:
+        json.dump({'python': 'hash'}, handle)
+
+
+def fake_install_python_dependencies(virtualenv, **kwargs):
+    with open(os.path.join(virtualenv, 'conf', 'binfiles_postdeploy.json'), 'w') as handle:
+        json.dump({'python': 'hash', 'confset': 'hash'}, handle)
+
+
+class TestPluginRPM(unittest.TestCase):
+    def plugin(self):
+        with mock.patch('distro.name', return_value='Red Hat Enterprise Linux'):
+            with mock.patch('distro.major_version', return_value='8'), mock.patch('distro.minor_version', return_value='4'):
+                return InvirtualenvRPM(config_file='deploy.conf')
+
+    def test__build_prebuilt_virtualenv(self):
+        with InTemporaryDirectory() as tempdir:
+            with open('deploy.conf', 'w') as config_handle:
+                config_handle.write(deploy_conf)
+            plugin = self.plugin()
+            with mock.patch('invirtualenv_plugins.rpm.build_virtualenv', side_effect=fake_build_virtualenv):
+                with mock.patch('invirtualenv_plugins.rpm.install_python_dependencies', side_effect=fake_install_python_dependencies) as install:
+                    with mock.patch('invirtualenv_plugins.rpm.relocate_virtualenv') as relocate:
+                        self.assertEqual(plugin.build_prebuilt_virtualenv('wheels'), '/opt/venvs/test_1.0')
+            build_dir = os.path.join(tempdir, PREBUILT_VIRTUALENV_DIRECTORY)
+            relocate.assert_called_once_with(build_dir, '/opt/venvs/test_1.0', move=False)
+            self.assertEqual(install.call_args[1]['wheel_dirs'], [os.path.join(tempdir, 'wheels')])
+            self.assertFalse(install.call_args[1]['use_index'])
+            self.assertEqual(plugin.config['rpm_package']['virtualenv_bin_files'], ['confset'])
+
+            spec = compile_template(SPEC_TEMPLATE).render(plugin.config)
+        self.assertIn('Requires: /usr/bin/python3', spec)
+        self.assertNotIn('BuildArch', spec)
+        self.assertIn('ln -sfn "/opt/venvs/test_1.0/bin/confset" "/usr/bin/confset"', spec)
+        self.assertIn('%{buildroot}/opt/venvs/test_1.0', spec)
+        self.assertNotIn('invirtualenv_deployer', spec)
+        self.assertNotIn('post_install.py', spec)
+
+    def test__build_prebuilt_virtualenv__relative_basepython(self):
+        with InTemporaryDirectory():
+            with open('deploy.conf', 'w') as config_handle:
+                config_handle.write(deploy_conf.replace('basepython = /usr/bin/python3', 'basepython = python3'))
+            plugin = self.plugin()
+            with mock.patch('invirtualenv_plugins.rpm.build_virtualenv') as build:
+                with self.assertRaises(BuildException):
+                    plugin.build_prebuilt_virtualenv('wheels')
+            build.assert_not_called()
+
+    def test__spec__bootstrap(self):
+        with InTemporaryDirectory():
+            with open('deploy.conf', 'w') as config_handle:
+                config_handle.write(deploy_conf.replace('prebuilt_virtualenv = True', 'prebuilt_virtualenv = False'))
+            plugin = self.plugin()
+            spec = compile_template(SPEC_TEMPLATE).render(plugin.config)
+        self.assertIn('post_install.py', spec)
+        self.assertIn('invirtualenv_deployer', spec)
+        self.assertNotIn('__os_install_post', spec)
@@ -4,8 +4,11 @@
 # See the accompanying LICENSE.txt file for terms.
 import os
 import unittest
-from invirtualenv.contextmanager import InTemporaryDirectory
-from invirtualenv.plugin_base import InvirtualenvPlugin
+from unittest import mock
+from invirtualenv import __version__
+from invirtualenv.contextmanager import InTemporaryDirectory, working_dir
+from invirtualenv.exceptions import PackageGenerationFailure
+from invirtualenv.plugin_base import InvirtualenvPlugin, PackageStage
 
 
 deploy_conf = """[global]
@@ -30,3 +33,165 @@ class TestPluginBase(unittest.TestCase):
             self.assertGreater(len(hashes), 0)
             self.assertIn('invirtualenv', packages)
             self.assertIn('sha512:', list(hashes.values())[0])
+
+
+class StagePlugin(InvirtualenvPlugin):
+    package_stages = ['deploy_conf', PackageStage('marker', 'stage_marker', inputs=['deploy_conf'], outputs=['marker'])]
+
+    def stage_marker(self, state):
+        with open('marker', 'w') as marker_handle:
+            marker_handle.write(state['deploy_conf'])
+        return {'marker': 'marker'}
+
+
+class TestPluginPipeline(unittest.TestCase):
+    def test__prepare_package__custom_stage(self):
+        with InTemporaryDirectory() as tempdir:
+            with open('deploy.conf', 'w') as config_handle:
+                config_handle.write(deploy_conf)
+            plugin = StagePlugin()
+            self.assertEqual([stage.name for stage in plugin.pipeline()], ['deploy_conf', 'marker'])
+            self.assertEqual(plugin.prepare_package(tempdir), {})
+            with open('marker') as marker_handle:
+                self.assertEqual(marker_handle.read(), 'deploy.conf')
+
+    def test__pipeline__missing_input(self):
+        with InTemporaryDirectory():
+            with open('deploy.conf', 'w') as config_handle:
+                config_handle.write(deploy_conf)
+            plugin = InvirtualenvPlugin()
+            plugin.package_stages = ['wheel_archive']
+            with self.assertRaises(PackageGenerationFailure):
+                plugin.pipeline()
+
+    def test__pipeline__unknown_stage(self):
+        with InTemporaryDirectory():
+            with open('deploy.conf', 'w') as config_handle:
+                config_handle.write(deploy_conf)
+            plugin = InvirtualenvPlugin()
+            plugin.package_stages = ['missing']
+            with self.assertRaises(PackageGenerationFailure):
+                plugin.pipeline()
+
+
+class TestPluginReproducible(unittest.TestCase):
+    def test__build_timestamp(self):
+        with InTemporaryDirectory():
+            with open('deploy.conf', 'w') as config_handle:
+                config_handle.write(deploy_conf)
+            with mock.patch.dict(os.environ, clear=False):
+                os.environ.pop('SOURCE_DATE_EPOCH', None)
+                self.assertIsNone(InvirtualenvPlugin().build_timestamp())
+                os.environ['SOURCE_DATE_EPOCH'] = '1500000000'
+                self.assertEqual(InvirtualenvPlugin().build_timestamp(), 1500000000)
+
+    def test__build_timestamp__setting(self):
+        with InTemporaryDirectory():
+            with open('deploy.conf', 'w') as config_handle:
+                config_handle.write(deploy_conf.replace('[global]', '[global]\nreproducible = True'))
+            with mock.patch.dict(os.environ, clear=False):
+                os.environ.pop('SOURCE_DATE_EPOCH', None)
+                self.assertEqual(InvirtualenvPlugin().build_timestamp(), 0)
+
+    def test__wheel_archive_compression__warns_once(self):
+        with InTemporaryDirectory() as tempdir:
+            with open('deploy.conf', 'w') as config_handle:
+                config_handle.write(deploy_conf.replace('[global]', '[global]\nwheel_archive_compression = zstd'))
+            os.makedirs('wheels')
+            plugin = InvirtualenvPlugin()
+            with mock.patch('invirtualenv.wheelhouse.zstd_available', return_value=False):
+                with self.assertLogs('invirtualenv.wheelhouse', level='WARNING') as logs:
+                    plugin.wheel_archive_cache_inputs({'wheel_dir': 'wheels', 'tempdir': tempdir})
+                    self.assertEqual(plugin.generate_wheel_archive(), 'wheels.tar.gz')
+            self.assertEqual(len(logs.output), 1)
+
+    def test__wheel_cache_key__build_tool_versions(self):
+        with InTemporaryDirectory():
+            with open('deploy.conf', 'w') as config_handle:
+                config_handle.write(deploy_conf)
+            plugin = InvirtualenvPlugin()
+            inventory = mock.Mock()
+            inventory.interpreter.side_effect = [
+                {'pip': '23.0', 'setuptools': '67.0', 'wheel': '0.40.0'},
+                {'pip': '24.0', 'setuptools': '67.0', 'wheel': '0.40.0'},
+            ]
+            with mock.patch('invirtualenv.plugin_base.toolchain_inventory', return_value=inventory):
+                with mock.patch('invirtualenv.plugin_base.installed_version', return_value='5.3.0'):
+                    key = plugin.wheel_cache_key()
+                    self.assertIn('5.3.0', key)
+                    self.assertIn(__version__, key)
+                    self.assertNotEqual(plugin.wheel_cache_key(), key)
+            inventory.invalidate.assert_called_with(plugin.basepython)
+
+    def test__stage_deploy_conf__sorted_deps(self):
+        with InTemporaryDirectory() as tempdir:
+            with open('deploy.conf', 'w') as config_handle:
+                config_handle.write(deploy_conf)
+            plugin = InvirtualenvPlugin()
+            plugin.stage_deploy_conf({'tempdir': tempdir, 'hashes': {'b==1.0': 'sha256:b', 'a==1.0': 'sha256:a'}})
+            self.assertEqual(plugin.config['pip']['deps'], ['a==1.0', 'b==1.0'])
+
+
+class CachedStagePlugin(InvirtualenvPlugin):
+    package_formats = ['cached']
+    package_stages = [
+        PackageStage('marker', 'stage_marker', outputs=['marker'], cache_inputs='marker_cache_inputs', files=['marker']),
+    ]
+    runs = 0
+
+    def marker_cache_inputs(self, state):
+        return ['marker']
+
+    def stage_marker(self, state):
+        CachedStagePlugin.runs += 1
+        with open('marker', 'w') as marker_handle:
+            marker_handle.write('marker')
+        return {'marker': 'marker'}
+
+    def run_package_command(self, package_hashes, wheel_dir='wheels'):
+        CachedStagePlugin.runs += 1
+        with open('package.cached', 'w') as package_handle:
+            package_handle.write('package')
+        return 'package.cached'
+
+
+class TestPluginBuildCache(unittest.TestCase):
+    def test__build_cache__disabled(self):
+        with InTemporaryDirectory():
+            with open('deploy.conf', 'w') as config_handle:
+                config_handle.write(deploy_conf)
+            self.assertIsNone(InvirtualenvPlugin().build_cache())
+
+    def test__wheel_packages_cache_inputs__unlocked(self):
+        with InTemporaryDirectory() as tempdir:
+            with open('deploy.conf', 'w') as config_handle:
+                config_handle.write(deploy_conf)
+            self.assertIsNone(InvirtualenvPlugin().wheel_packages_cache_inputs({'tempdir': tempdir}))
+
+    def test__create_package__cached(self):
+        with InTemporaryDirectory() as tempdir:
+            with open('deploy.conf', 'w') as config_handle:
+                config_handle.write(deploy_conf.replace('[global]', '[global]\nbuild_cache_dir = %s' % os.path.join(tempdir, 'cache')))
+            CachedStagePlugin.runs = 0
+            self.assertEqual(os.path.basename(CachedStagePlugin().create_package('cached')), 'package.cached')
+            self.assertEqual(CachedStagePlugin.runs, 2)
+            os.remove('package.cached')
+
+            self.assertEqual(os.path.basename(CachedStagePlugin().create_package('cached')), 'package.cached')
+            self.assertEqual(CachedStagePlugin.runs, 2)
+            with open('package.cached') as package_handle:
+                self.assertEqual(package_handle.read(), 'package')
+
+    def test__prepare_package__restores_stage_files(self):
+        with InTemporaryDirectory() as tempdir:
+            with open('deploy.conf', 'w') as config_handle:
+                config_handle.write(deploy_conf.replace('[global]', '[global]\nbuild_cache_dir = %s' % os.path.join(tempdir, 'cache')))
+            CachedStagePlugin.runs = 0
+            for build_dir in ['first', 'second']:
+                os.makedirs(build_dir)
+                plugin = CachedStagePlugin()
+                with working_dir(build_dir):
+                    plugin.prepare_package(os.path.join(tempdir, build_dir))
+                with open(os.path.join(build_dir, 'marker')) as marker_handle:
+                    self.assertEqual(marker_handle.read(), 'marker')
+            self.assertEqual(CachedStagePlugin.runs, 1)
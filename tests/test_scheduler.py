@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# Copyright (c) 2016, Yahoo Inc.
+# Copyrights licensed under the BSD License
+# See the accompanying LICENSE.txt file for terms.
+import threading
+import unittest
+from invirtualenv.scheduler import Phase, run_phases
+
+
+class TestScheduler(unittest.TestCase):
+    def test__run_phases__concurrent(self):
+        barrier = threading.Barrier(2, timeout=10)
+        order = []
+
+        def independent(name):
+            def run():
+                barrier.wait()
+                order.append(name)
+                return name
+            return run
+
+        results = run_phases([
+            Phase('rpm', independent('rpm')),
+            Phase('virtualenv', independent('virtualenv')),
+            Phase('pip', lambda: order.append('pip'), requires=['rpm', 'virtualenv']),
+        ])
+        self.assertEqual(results['rpm'], 'rpm')
+        self.assertEqual(results['virtualenv'], 'virtualenv')
+        self.assertEqual(order[-1], 'pip')
+
+    def test__run_phases__missing_requirement_ignored(self):
+        self.assertEqual(run_phases([Phase('pip', lambda: 1, requires=['rpm'])]), {'pip': 1})
+
+    def test__run_phases__failure(self):
+        ran = []
+
+        def fail():
+            raise RuntimeError('yum failed')
+
+        with self.assertRaises(RuntimeError):
+            run_phases([Phase('rpm', fail), Phase('pip', lambda: ran.append('pip'), requires=['rpm'])])
+        self.assertEqual(ran, [])
+
+    def test__run_phases__cycle(self):
+        with self.assertRaises(ValueError):
+            run_phases([Phase('a', lambda: None, requires=['b']), Phase('b', lambda: None, requires=['a'])])
+
+    def test__run_phases__on_start(self):
+        started = []
+        run_phases(
+            [Phase('virtualenv', lambda: None), Phase('pip', lambda: None, requires=['virtualenv'])],
+            on_start=lambda phase: started.append((phase.name, threading.current_thread() is threading.main_thread()))
+        )
+        self.assertEqual(started, [('virtualenv', True), ('pip', True)])
+
+    def test__run_phases__empty(self):
+        self.assertEqual(run_phases([]), {})
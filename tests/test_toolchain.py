@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# Copyright (c) 2016, Yahoo Inc.
+# Copyrights licensed under the BSD License
+# See the accompanying LICENSE.txt file for terms.
+import json
+import os
+import platform
+import sys
+import unittest
+from unittest import mock
+from invirtualenv import toolchain
+from invirtualenv.contextmanager import InTemporaryDirectory
+
+
+class TestToolchainInventory(unittest.TestCase):
+    def test__interpreter__probe(self):
+        with InTemporaryDirectory() as tempdir:
+            inventory = toolchain.ToolchainInventory(index_filename=os.path.join(tempdir, 'index.json'))
+            info = inventory.interpreter(sys.executable)
+            self.assertEqual(info['version'], platform.python_version())
+            self.assertTrue(info['python_tag'])
+            self.assertTrue(info['platform_tag'])
+            self.assertTrue(info['pip'])
+
+    def test__interpreter__persisted(self):
+        with InTemporaryDirectory() as tempdir:
+            index_filename = os.path.join(tempdir, 'index.json')
+            info = toolchain.ToolchainInventory(index_filename=index_filename).interpreter(sys.executable)
+
+            inventory = toolchain.ToolchainInventory(index_filename=index_filename)
+            with mock.patch.object(toolchain.subprocess, 'check_output', side_effect=AssertionError('probed')):
+                self.assertEqual(inventory.interpreter(sys.executable), info)
+                # Memoized results are returned without reading the index again
+                with mock.patch.object(toolchain, 'read_json_file', side_effect=AssertionError('read')):
+                    self.assertEqual(inventory.interpreter(sys.executable), info)
+
+    def test__interpreter__binary_modified(self):
+        with InTemporaryDirectory() as tempdir:
+            index_filename = os.path.join(tempdir, 'index.json')
+            toolchain.ToolchainInventory(index_filename=index_filename).interpreter(sys.executable)
+            with open(index_filename) as handle:
+                index = json.load(handle)
+            for entry in index.values():
+                entry['state'][0] -= 1
+            with open(index_filename, 'w') as handle:
+                json.dump(index, handle)
+
+            inventory = toolchain.ToolchainInventory(index_filename=index_filename)
+            with mock.patch.object(inventory, '_probe_interpreter', return_value=None) as probe:
+                self.assertIsNone(inventory.interpreter(sys.executable))
+                probe.assert_called_once_with(os.path.abspath(sys.executable))
+
+    def test__interpreter__missing(self):
+        inventory = toolchain.ToolchainInventory(index_filename='')
+        self.assertIsNone(inventory.interpreter('invirtualenv-missing-python'))
+
+    def test__executable__memoized(self):
+        inventory = toolchain.ToolchainInventory(index_filename='')
+        with mock.patch.object(toolchain, 'find_executable', return_value='/bin/true') as find_executable:
+            self.assertEqual(inventory.executable('true'), '/bin/true')
+            self.assertEqual(inventory.executable('true'), '/bin/true')
+            find_executable.assert_called_once_with('true')
+
+    def test__pip_command(self):
+        with InTemporaryDirectory() as tempdir:
+            inventory = toolchain.ToolchainInventory(index_filename=os.path.join(tempdir, 'index.json'))
+            self.assertEqual(inventory.pip_command(sys.executable), [sys.executable, '-m', 'pip'])
+
+    def test__probe(self):
+        with InTemporaryDirectory() as tempdir:
+            inventory = toolchain.ToolchainInventory(index_filename=os.path.join(tempdir, 'index.json'))
+            result = inventory.probe(interpreters=[sys.executable], commands=['invirtualenv-missing-command'])
+            self.assertEqual(result['interpreters'][sys.executable]['version'], platform.python_version())
+            self.assertEqual(result['executables'], {'invirtualenv-missing-command': None})
+
+
+if __name__ == '__main__':
+    unittest.main()
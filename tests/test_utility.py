@@ -13,10 +13,16 @@ try:
     from StringIO import StringIO
 except ImportError:
     from io import StringIO
+import errno
 import os
+import socket
 import sys
+import tempfile
 import unittest
+from unittest import mock
+import jinja2
 from invirtualenv import utility
+from invirtualenv.contextmanager import InTemporaryDirectory, SCRATCH_PREFIX, TemporaryDirectory
 
 
 class TestUtility(unittest.TestCase):
@@ -94,10 +100,127 @@ class TestUtility(unittest.TestCase):
         self.assertEqual(result, 'bar')
         del os.environ['str_format_env']
 
+    def test__str_format_env__no_template_fast_path(self):
+        with mock.patch.object(utility, 'compile_template') as compile_template:
+            self.assertEqual(utility.str_format_env('plain value'), 'plain value')
+            compile_template.assert_not_called()
+
+    def test__str_format_env__compiled_once(self):
+        utility.compile_template.cache_clear()
+        environment = {'str_format_env': 'foo'}
+        for _ in range(3):
+            self.assertEqual(utility.str_format_env('x{{str_format_env}}', environment), 'xfoo')
+        self.assertEqual(utility.compile_template.cache_info().misses, 1)
+
+    def test__render_template__matches_jinja(self):
+        for value in ['plain\n', 'plain\n\n', 'windows\r\n', '{{ 1 }}\n', '']:
+            self.assertEqual(utility.render_template(value, {}), jinja2.Template(value).render())
+
+    def test__template_variables(self):
+        self.assertEqual(utility.template_variables("{{FOO}}-{{BAR|default('x')}}"), {'FOO', 'BAR'})
+        self.assertEqual(utility.template_variables('plain'), set())
+
     def test__csv_list(self):
         result = utility.csv_list('1,2')
         self.assertEqual(result, ['1', '2'])
 
+    def test__move_file(self):
+        with InTemporaryDirectory():
+            os.makedirs('dest')
+            with open('package.rpm', 'w') as package_handle:
+                package_handle.write('package')
+            self.assertEqual(utility.move_file('package.rpm', 'dest/package.rpm'), 'dest/package.rpm')
+            self.assertFalse(os.path.exists('package.rpm'))
+            with open('dest/package.rpm') as package_handle:
+                self.assertEqual(package_handle.read(), 'package')
+
+    def test__move_file__other_file_system(self):
+        with InTemporaryDirectory():
+            os.makedirs('dest')
+            with open('package.rpm', 'w') as package_handle:
+                package_handle.write('package')
+            os.chmod('package.rpm', 0o640)
+            real_replace = os.replace
+            calls = []
+
+            def replace(source, dest):
+                calls.append([source, dest])
+                if len(calls) == 1:
+                    raise OSError(errno.EXDEV, 'Invalid cross-device link')
+                return real_replace(source, dest)
+
+            with mock.patch('os.replace', side_effect=replace):
+                utility.move_file('package.rpm', 'dest/package.rpm')
+            self.assertEqual(os.path.dirname(calls[1][0]), os.path.abspath('dest'))
+            self.assertFalse(os.path.exists('package.rpm'))
+            self.assertEqual(os.listdir('dest'), ['package.rpm'])
+            with open('dest/package.rpm') as package_handle:
+                self.assertEqual(package_handle.read(), 'package')
+            self.assertEqual(os.stat('dest/package.rpm').st_mode & 0o777, 0o640)
+
+    def test__clone_file(self):
+        with InTemporaryDirectory():
+            with open('source', 'wb') as source_handle:
+                source_handle.write(os.urandom(100000))
+            utility.clone_file('source', 'dest')
+            with open('source', 'rb') as source_handle, open('dest', 'rb') as dest_handle:
+                self.assertEqual(source_handle.read(), dest_handle.read())
+
+    def test__clone_tree(self):
+        with InTemporaryDirectory():
+            os.makedirs('source/bin')
+            with open('source/bin/tool', 'w') as tool_handle:
+                tool_handle.write('tool')
+            os.chmod('source/bin/tool', 0o755)
+            os.symlink('tool', 'source/bin/link')
+            with mock.patch('invirtualenv.utility.reflink_file', return_value=False):
+                self.assertEqual(utility.clone_tree('source', 'linked'), 'hardlink')
+                self.assertEqual(utility.clone_tree('source', 'copied', hardlinks=False), 'copy')
+            self.assertTrue(os.path.samefile('source/bin/tool', 'linked/bin/tool'))
+            self.assertFalse(os.path.samefile('source/bin/tool', 'copied/bin/tool'))
+            self.assertEqual(os.stat('copied/bin/tool').st_mode & 0o777, 0o755)
+            self.assertEqual(os.readlink('copied/bin/link'), 'tool')
+
+    def test__scratch_directory(self):
+        with InTemporaryDirectory() as tempdir:
+            self.assertEqual(utility.scratch_directory(tempdir, os.path.join(tempdir, 'scratch')), os.path.join(tempdir, 'scratch'))
+            self.assertTrue(os.path.isdir('scratch'))
+            with mock.patch.dict(os.environ, {'TMPDIR': tempdir}):
+                self.assertIsNone(utility.scratch_directory('/'))
+            with mock.patch.dict(os.environ, clear=False):
+                os.environ.pop('TMPDIR', None)
+                self.assertIsNone(utility.scratch_directory(tempdir))
+
+    def test__scratch_directory__other_file_system(self):
+        with InTemporaryDirectory() as tempdir:
+            os.makedirs('output')
+            real_stat = os.stat
+
+            def fake_stat(path, *args, **kwargs):
+                result = real_stat(path, *args, **kwargs)
+                if path == tempfile.gettempdir():
+                    return mock.Mock(st_dev=result.st_dev + 1)
+                return result
+
+            with mock.patch.dict(os.environ, clear=False):
+                os.environ.pop('TMPDIR', None)
+                with mock.patch('invirtualenv.utility.os.stat', side_effect=fake_stat):
+                    # The build directories are not created in the output directory
+                    self.assertEqual(utility.scratch_directory(os.path.join(tempdir, 'output')), tempdir)
+
+    def test__remove_stale_scratch_directories(self):
+        with InTemporaryDirectory() as tempdir:
+            with TemporaryDirectory(dir=tempdir) as active:
+                stale = os.path.join(tempdir, '%s%s-%d-abc' % (SCRATCH_PREFIX, socket.gethostname(), 2 ** 22 + 1))
+                other_host = os.path.join(tempdir, '%sother-host-%d-abc' % (SCRATCH_PREFIX, 2 ** 22 + 1))
+                os.makedirs(stale)
+                os.makedirs(other_host)
+                with mock.patch('invirtualenv.utility._process_running', side_effect=lambda pid: pid == os.getpid()):
+                    utility.remove_stale_scratch_directories(tempdir)
+                self.assertTrue(os.path.exists(active))
+                self.assertFalse(os.path.exists(stale))
+                self.assertTrue(os.path.exists(other_host))
+
 
 if __name__ == '__main__':
     test_suite = unittest.TestLoader().loadTestsFromTestCase(TestUtility)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# Copyright (c) 2016, Yahoo Inc.
+# Copyrights licensed under the BSD License
+# See the accompanying LICENSE.txt file for terms.
+import os
+import subprocess
+import unittest
+from unittest import mock
+from invirtualenv import virtualenv
+from invirtualenv.contextmanager import InTemporaryDirectory
+from invirtualenv.exceptions import BuildException
+from invirtualenv.utility import write_json_file
+
+
+def create_wheels(directory, filenames):
+    os.makedirs(directory, exist_ok=True)
+    for filename in filenames:
+        open(os.path.join(directory, filename), 'w').close()
+
+
+class TestSeedWheels(unittest.TestCase):
+    def test__seed_wheels__newest(self):
+        with InTemporaryDirectory():
+            create_wheels('one', ['pip-23.0-py3-none-any.whl', 'six-1.16.0-py2.py3-none-any.whl'])
+            create_wheels('two', ['pip-24.0-py3-none-any.whl', 'setuptools-69.0.0-py3-none-any.whl'])
+            seeds = virtualenv.seed_wheels(['one', 'two', 'missing'])
+        self.assertEqual(seeds, {
+            'pip': (os.path.join('two', 'pip-24.0-py3-none-any.whl'), '24.0'),
+            'setuptools': (os.path.join('two', 'setuptools-69.0.0-py3-none-any.whl'), '69.0.0'),
+        })
+
+    def test__upgrade_package_tools__offline(self):
+        with InTemporaryDirectory():
+            create_wheels('wheels', [
+                'pip-24.0-py3-none-any.whl', 'setuptools-69.0.0-py3-none-any.whl', 'wheel-0.42.0-py3-none-any.whl'
+            ])
+            with mock.patch('invirtualenv.virtualenv.toolchain_inventory') as inventory:
+                inventory.return_value.interpreter.return_value = {'pip': '24.0', 'setuptools': '65.5.0', 'wheel': None}
+                with mock.patch('invirtualenv.virtualenv.cache_directory', return_value=None):
+                    with mock.patch('invirtualenv.virtualenv.subprocess.check_output', return_value=b'') as check_output:
+                        virtualenv.upgrade_package_tools('venv', wheel_dirs=['wheels'])
+        check_output.assert_called_once_with([
+            'venv/bin/python', 'venv/bin/pip', 'install', '--upgrade', '--no-index', '--find-links', 'wheels', 'setuptools', 'wheel'
+        ], stderr=mock.ANY)
+
+    def test__upgrade_package_tools__incompatible_seed(self):
+        def fake_pip(command, **kwargs):
+            if '--no-index' in command:
+                raise subprocess.CalledProcessError(1, command, output=b'requires a different Python')
+            return b''
+
+        with InTemporaryDirectory():
+            create_wheels('wheels', [
+                'pip-99.0-py3-none-any.whl', 'setuptools-69.0.0-py3-none-any.whl', 'wheel-0.42.0-py3-none-any.whl'
+            ])
+            with mock.patch('invirtualenv.virtualenv.toolchain_inventory') as inventory:
+                inventory.return_value.interpreter.return_value = {'pip': '24.0', 'setuptools': '69.0.0', 'wheel': '0.42.0'}
+                with mock.patch('invirtualenv.virtualenv.subprocess.check_output', side_effect=fake_pip) as check_output:
+                    virtualenv.upgrade_package_tools('venv', wheel_dirs=['wheels'])
+        # The index is used when pip can't install the seed wheels
+        self.assertEqual(check_output.call_args[0][0], ['venv/bin/python', 'venv/bin/pip', 'install', '--upgrade', 'pip'])
+
+    def test__upgrade_package_tools__up_to_date(self):
+        with InTemporaryDirectory():
+            create_wheels('wheels', [
+                'pip-24.0-py3-none-any.whl', 'setuptools-69.0.0-py3-none-any.whl', 'wheel-0.42.0-py3-none-any.whl'
+            ])
+            with mock.patch('invirtualenv.virtualenv.toolchain_inventory') as inventory:
+                inventory.return_value.interpreter.return_value = {'pip': '24.0', 'setuptools': '69.0.0', 'wheel': '0.42.0'}
+                with mock.patch('invirtualenv.virtualenv.subprocess.check_output') as check_output:
+                    virtualenv.upgrade_package_tools('venv', wheel_dirs=['wheels'])
+        check_output.assert_not_called()
+
+    def test__upgrade_package_tools__seed_cache(self):
+        with InTemporaryDirectory() as tempdir:
+            seed_cache = os.path.join(tempdir, 'seed')
+
+            def fake_pip(command, **kwargs):
+                create_wheels(command[command.index('-d') + 1], ['setuptools-69.0.0-py3-none-any.whl', 'wheel-0.42.0-py3-none-any.whl'])
+                return b''
+
+            create_wheels('wheels', ['pip-24.0-py3-none-any.whl'])
+            with mock.patch('invirtualenv.virtualenv.toolchain_inventory') as inventory:
+                inventory.return_value.interpreter.return_value = {
+                    'pip': '24.0', 'setuptools': '69.0.0', 'wheel': '0.42.0', 'python_tag': 'cp38'
+                }
+                with mock.patch('invirtualenv.virtualenv.cache_directory', return_value=seed_cache):
+                    with mock.patch('invirtualenv.virtualenv.subprocess.check_output', side_effect=fake_pip) as check_output:
+                        virtualenv.upgrade_package_tools('venv', wheel_dirs=['wheels'])
+                        virtualenv.upgrade_package_tools('venv', wheel_dirs=['wheels'])
+            # The seed cache is only downloaded once and everything is up to date
+            self.assertEqual(check_output.call_count, 1)
+            self.assertIn('download', check_output.call_args[0][0])
+            # Each interpreter has its own seed cache
+            self.assertIn(os.path.join(seed_cache, 'cp38'), check_output.call_args[0][0])
+
+    def test__upgrade_package_tools__no_wheels(self):
+        with mock.patch('invirtualenv.virtualenv.toolchain_inventory') as inventory:
+            inventory.return_value.interpreter.return_value = {}
+            with mock.patch('invirtualenv.virtualenv.cache_directory', return_value=None):
+                with mock.patch('invirtualenv.virtualenv.subprocess.check_output', return_value=b'') as check_output:
+                    virtualenv.upgrade_package_tools('venv')
+        check_output.assert_called_once_with(
+            ['venv/bin/python', 'venv/bin/pip', 'install', '--upgrade', 'pip', 'setuptools', 'wheel'], stderr=mock.ANY
+        )
+
+
+class TestBaseVirtualenv(unittest.TestCase):
+    def create_base(self, directory):
+        os.makedirs(os.path.join(directory, 'bin'))
+        with open(os.path.join(directory, 'bin', 'pip'), 'w') as pip_handle:
+            pip_handle.write('#!%s/bin/python\n' % directory)
+        with open(os.path.join(directory, 'pyvenv.cfg'), 'w') as cfg_handle:
+            cfg_handle.write('home = /usr/bin\n')
+        os.makedirs(os.path.join(directory, 'lib', 'python3.11', 'site-packages', 'pip-23.0.dist-info'))
+        with open(os.path.join(directory, 'lib', 'python3.11', 'site-packages', 'pip-23.0.dist-info', 'RECORD'), 'w') as record_handle:
+            record_handle.write('../../../bin/pip,sha256=old,10\npip-23.0.dist-info/RECORD,,\n')
+        write_json_file(os.path.join(directory, virtualenv.BASE_VIRTUALENV_INFO_FILENAME), {'path': directory, 'created': 0})
+
+    def test__clone_virtualenv__fixes_paths(self):
+        with InTemporaryDirectory() as tempdir:
+            base = os.path.join(tempdir, 'base')
+            self.create_base(base)
+            venv = os.path.join(tempdir, 'venv')
+            record = os.path.join('lib', 'python3.11', 'site-packages', 'pip-23.0.dist-info', 'RECORD')
+            with open(os.path.join(base, record), 'rb') as record_handle:
+                base_record = record_handle.read()
+            virtualenv.clone_virtualenv(base, venv)
+            with open(os.path.join(venv, 'bin', 'pip')) as pip_handle:
+                self.assertEqual(pip_handle.read(), '#!%s/bin/python\n' % venv)
+            with open(os.path.join(venv, record), 'rb') as record_handle:
+                self.assertNotEqual(record_handle.read(), base_record)
+            # The base virtualenv is not changed through hard links
+            with open(os.path.join(base, 'bin', 'pip')) as pip_handle:
+                self.assertEqual(pip_handle.read(), '#!%s/bin/python\n' % base)
+            with open(os.path.join(base, record), 'rb') as record_handle:
+                self.assertEqual(record_handle.read(), base_record)
+            self.assertFalse(os.path.exists(os.path.join(venv, virtualenv.BASE_VIRTUALENV_INFO_FILENAME)))
+
+    def test__base_virtualenv__reused(self):
+        def fake_create(name, directory, **kwargs):
+            self.create_base(os.path.join(directory, name))
+
+        with InTemporaryDirectory() as tempdir:
+            with mock.patch('invirtualenv.virtualenv._create_virtualenv', side_effect=fake_create) as create:
+                with mock.patch('invirtualenv.virtualenv.upgrade_package_tools'):
+                    base = virtualenv.base_virtualenv(tempdir)
+                    self.assertEqual(virtualenv.base_virtualenv(tempdir), base)
+            self.assertEqual(create.call_count, 1)
+            self.assertEqual(os.path.dirname(base), os.path.join(tempdir, virtualenv.BASE_VIRTUALENV_DIRECTORY))
+            self.assertEqual(os.listdir(os.path.dirname(base)), [os.path.basename(base)])
+
+    def test__build_virtualenv__clone_failure(self):
+        with InTemporaryDirectory() as tempdir:
+            with mock.patch('invirtualenv.virtualenv.base_virtualenv', side_effect=OSError):
+                with mock.patch('invirtualenv.virtualenv._create_virtualenv', side_effect=lambda name, directory, **kwargs: os.makedirs(os.path.join(directory, name))) as create:
+                    with mock.patch('invirtualenv.virtualenv.upgrade_package_tools'):
+                        virtualenv.build_virtualenv('venv', tempdir, use_base_virtualenv=True)
+            create.assert_called_once()
+
+
+class TestRelocateVirtualenv(unittest.TestCase):
+    def create_virtualenv(self, directory):
+        site_packages = os.path.join(directory, 'lib', 'python3.11', 'site-packages')
+        os.makedirs(os.path.join(site_packages, 'tool-1.0.dist-info'))
+        os.makedirs(os.path.join(directory, 'bin'))
+        with open(os.path.join(directory, 'bin', 'tool'), 'w') as tool_handle:
+            tool_handle.write('#!%s/bin/python\nimport tool\n' % directory)
+        with open(os.path.join(directory, 'bin', 'activate'), 'w') as activate_handle:
+            activate_handle.write('VIRTUAL_ENV="%s"\n' % directory)
+        with open(os.path.join(directory, 'pyvenv.cfg'), 'w') as cfg_handle:
+            cfg_handle.write('home = /usr/bin\ncommand = /usr/bin/python3 -m venv %s\n' % directory)
+        with open(os.path.join(site_packages, 'tool-1.0.dist-info', 'RECORD'), 'w') as record_handle:
+            record_handle.write('../../../bin/tool,sha256=old,10\ntool-1.0.dist-info/RECORD,,\n')
+
+    def test__relocate_virtualenv(self):
+        with InTemporaryDirectory() as tempdir:
+            source = os.path.join(tempdir, 'build')
+            dest = os.path.join(tempdir, 'deploy', 'venv')
+            self.create_virtualenv(source)
+            self.assertEqual(virtualenv.relocate_virtualenv(source, dest), dest)
+            self.assertFalse(os.path.exists(source))
+            with open(os.path.join(dest, 'bin', 'tool')) as tool_handle:
+                self.assertEqual(tool_handle.read(), '#!%s/bin/python\nimport tool\n' % dest)
+            with open(os.path.join(dest, 'bin', 'activate')) as activate_handle:
+                self.assertEqual(activate_handle.read(), 'VIRTUAL_ENV="%s"\n' % dest)
+            with open(os.path.join(dest, 'pyvenv.cfg')) as cfg_handle:
+                self.assertIn('-m venv %s\n' % dest, cfg_handle.read())
+            with open(os.path.join(dest, 'lib', 'python3.11', 'site-packages', 'tool-1.0.dist-info', 'RECORD')) as record_handle:
+                record = record_handle.read().splitlines()
+            self.assertNotIn('sha256=old', record[0])
+            self.assertTrue(record[0].endswith(',%d' % os.path.getsize(os.path.join(dest, 'bin', 'tool'))))
+            self.assertEqual(record[1], 'tool-1.0.dist-info/RECORD,,')
+
+    def test__relocate_virtualenv__long_shebang(self):
+        with InTemporaryDirectory() as tempdir:
+            self.create_virtualenv(os.path.join(tempdir, 'build'))
+            dest = os.path.join(tempdir, 'd' * virtualenv.MAX_SHEBANG_LENGTH, 'venv')
+            virtualenv.relocate_virtualenv('build', dest, move=False)
+            with open(os.path.join('build', 'bin', 'tool')) as tool_handle:
+                self.assertEqual(
+                    tool_handle.read(),
+                    "#!/bin/sh\n'''exec' \"%s/bin/python\" \"$0\" \"$@\"\n' '''\nimport tool\n" % dest
+                )
+            self.assertFalse(os.path.exists(dest))
+
+    def test__relocate_virtualenv__dest_exists(self):
+        with InTemporaryDirectory() as tempdir:
+            self.create_virtualenv(os.path.join(tempdir, 'build'))
+            os.makedirs('venv')
+            with self.assertRaises(BuildException):
+                virtualenv.relocate_virtualenv('build', 'venv')
+            with self.assertRaises(BuildException):
+                virtualenv.relocate_virtualenv('missing', 'other')
+
+
+class TestPackageToolsOutdated(unittest.TestCase):
+    def test__package_tools_outdated(self):
+        with InTemporaryDirectory():
+            for dist_info in ['pip-24.0.dist-info', 'setuptools-69.0.0.dist-info', 'wheel-0.42.0.dist-info']:
+                os.makedirs(os.path.join('venv', 'lib', 'python3.11', 'site-packages', dist_info))
+            self.assertEqual(virtualenv.installed_package_tools('venv'), {'pip': '24.0', 'setuptools': '69.0.0', 'wheel': '0.42.0'})
+            create_wheels('wheels', ['pip-23.0-py3-none-any.whl', 'setuptools-69.0.0-py3-none-any.whl'])
+            self.assertFalse(virtualenv.package_tools_outdated('venv', ['wheels', 'missing']))
+            create_wheels('wheels', ['wheel-0.43.0-py3-none-any.whl'])
+            self.assertTrue(virtualenv.package_tools_outdated('venv', ['wheels']))
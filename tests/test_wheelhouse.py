@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+# Copyright (c) 2016, Yahoo Inc.
+# Copyrights licensed under the BSD License
+# See the accompanying LICENSE.txt file for terms.
+import hashlib
+import os
+import subprocess  # nosec
+import sys
+import tarfile
+import unittest
+from unittest import mock
+from invirtualenv import wheelhouse
+from invirtualenv.contextmanager import InTemporaryDirectory
+
+
+class TestWheelhouseHashing(unittest.TestCase):
+    def test__hash_file__default_algorithm(self):
+        with InTemporaryDirectory():
+            data = os.urandom(wheelhouse.HASH_CHUNK_SIZE * 2 + 7)
+            with open('test.whl', 'wb') as file_handle:
+                file_handle.write(data)
+            self.assertEqual(wheelhouse.hash_file('test.whl'), 'sha256:' + hashlib.sha256(data).hexdigest())
+
+    def test__hash_file__algorithm(self):
+        with InTemporaryDirectory():
+            with open('test.whl', 'wb') as file_handle:
+                file_handle.write(b'wheel')
+            self.assertEqual(wheelhouse.hash_file('test.whl', 'sha512'), 'sha512:' + hashlib.sha512(b'wheel').hexdigest())
+
+    def test__hash_file__matches_pip_hash(self):
+        with InTemporaryDirectory():
+            with open('test.whl', 'wb') as file_handle:
+                file_handle.write(os.urandom(4096))
+            output = subprocess.check_output([sys.executable, '-m', 'pip', 'hash', '-a', 'sha384', 'test.whl']).decode()  # nosec
+            pip_hash = output.split('--hash=')[1].strip()
+            self.assertEqual(wheelhouse.hash_file('test.whl', 'sha384'), pip_hash)
+
+    def test__hash_files(self):
+        with InTemporaryDirectory():
+            filenames = []
+            for number in range(10):
+                filename = 'package{number}-1.0-py3-none-any.whl'.format(number=number)
+                with open(filename, 'wb') as file_handle:
+                    file_handle.write(str(number).encode())
+                filenames.append(filename)
+            hashes = wheelhouse.hash_files(filenames, max_workers=4)
+            self.assertEqual(sorted(hashes.keys()), sorted(filenames))
+            for filename in filenames:
+                self.assertEqual(hashes[filename], wheelhouse.hash_file(filename))
+
+    def test__hash_files__empty(self):
+        self.assertEqual(wheelhouse.hash_files([]), {})
+
+
+def pip_requirements(cmd):
+    """
+    Read the requirements file passed to a pip command
+    """
+    with open(cmd[cmd.index('-r') + 1]) as requirements_handle:
+        return requirements_handle.read().split()
+
+
+def fake_pip(cmd, **kwargs):
+    """
+    Stand in for pip that downloads a wheel and two source packages and
+    fails to build the source package named broken
+    """
+    if 'download' in cmd:
+        fake_pip.requirements.append(pip_requirements(cmd))
+        directory = cmd[cmd.index('-d') + 1]
+        for filename in ['ready-1.0-py3-none-any.whl', 'compiled-2.0.tar.gz', 'broken-3.0.zip']:
+            with open(os.path.join(directory, filename), 'w') as file_handle:
+                file_handle.write(filename)
+        return b''
+    if 'wheel' in cmd:
+        source_package = cmd[-1]
+        if 'broken' in source_package:
+            raise subprocess.CalledProcessError(1, cmd, output=b'build failed')
+        name, version = os.path.basename(source_package).split('.tar')[0].split('-')
+        wheel_dir = cmd[cmd.index('-w') + 1]
+        with open(os.path.join(wheel_dir, '{0}-{1}-cp3-cp3-linux_x86_64.whl'.format(name, version)), 'w') as file_handle:
+            file_handle.write(source_package)
+        return b''
+    raise AssertionError('Unexpected command %r' % cmd)  # pragma: no cover
+
+
+fake_pip.requirements = []
+
+
+class TestWheelhouseBuild(unittest.TestCase):
+    def setUp(self):
+        fake_pip.requirements = []
+
+    def test__build_wheelhouse__per_package_fallback(self):
+        with InTemporaryDirectory():
+            with mock.patch('invirtualenv.wheelhouse.subprocess.check_output', side_effect=fake_pip) as check_output:
+                unbuilt = wheelhouse.build_wheelhouse(['pip'], ['ready', 'compiled', 'broken'], '.')
+            self.assertEqual(unbuilt, ['./broken-3.0.zip'])
+            self.assertEqual(
+                sorted(os.listdir('.')),
+                ['broken-3.0.zip', 'compiled-2.0-cp3-cp3-linux_x86_64.whl', 'ready-1.0-py3-none-any.whl']
+            )
+            commands = [call[0][0] for call in check_output.call_args_list]
+            self.assertEqual(commands[0][:5], ['pip', 'download', '-d', '.', '-r'])
+            self.assertEqual(fake_pip.requirements, [['ready', 'compiled', 'broken']])
+            self.assertEqual(len([command for command in commands if 'download' in command]), 1)
+            self.assertTrue(all('--no-deps' in command for command in commands[1:]))
+
+    def test__build_wheelhouse__download_failure_raises(self):
+        with InTemporaryDirectory():
+            error = subprocess.CalledProcessError(1, ['pip'], output=b'no such package')
+            with mock.patch('invirtualenv.wheelhouse.subprocess.check_output', side_effect=error):
+                with self.assertRaises(subprocess.CalledProcessError):
+                    wheelhouse.build_wheelhouse(['pip'], ['missing'], '.')
+
+    def test__build_wheels__bounded_workers(self):
+        with mock.patch('invirtualenv.wheelhouse.ThreadPoolExecutor', wraps=wheelhouse.ThreadPoolExecutor) as executor:
+            with mock.patch('invirtualenv.wheelhouse.build_wheel', return_value=True):
+                results = wheelhouse.build_wheels(['pip'], ['a.tar.gz', 'b.tar.gz', 'c.tar.gz'], max_workers=2)
+        self.assertEqual(results, {'a.tar.gz': True, 'b.tar.gz': True, 'c.tar.gz': True})
+        executor.assert_called_once_with(max_workers=2)
+
+    def test__build_wheelhouse__pinned(self):
+        with InTemporaryDirectory():
+            with mock.patch('invirtualenv.wheelhouse.subprocess.check_output', side_effect=fake_pip) as check_output:
+                wheelhouse.build_wheelhouse(['pip'], [], '.', pinned=['ready==1.0', 'compiled==2.0'])
+            self.assertEqual(check_output.call_args_list[0][0][0][:6], ['pip', 'download', '-d', '.', '--no-deps', '-r'])
+            self.assertEqual(fake_pip.requirements, [['ready==1.0', 'compiled==2.0']])
+            self.assertEqual(len([call for call in check_output.call_args_list if 'download' in call[0][0]]), 1)
+
+    def test__build_jobs(self):
+        self.assertEqual(wheelhouse.build_jobs(6), 6)
+        with mock.patch('os.cpu_count', return_value=16):
+            with mock.patch('invirtualenv.wheelhouse.available_memory', return_value=4 * wheelhouse.BUILD_JOB_MEMORY):
+                self.assertEqual(wheelhouse.build_jobs(), 4)
+            with mock.patch('invirtualenv.wheelhouse.available_memory', return_value=None):
+                self.assertEqual(wheelhouse.build_jobs(0), 16)
+
+    def test__build_environment(self):
+        with InTemporaryDirectory() as tempdir:
+            env = wheelhouse.build_environment(4, tempdir, env={'MAKEFLAGS': '-j2'})
+            self.assertEqual(env['MAKEFLAGS'], '-j2')
+            self.assertEqual(env['MAX_JOBS'], '4')
+            self.assertEqual(env['NPY_NUM_BUILD_JOBS'], '4')
+            with open(env['DIST_EXTRA_CONFIG']) as config_handle:
+                self.assertEqual(config_handle.read(), '[build_ext]\nparallel = 4\n')
+
+    def test__compiler_cache_environment(self):
+        with InTemporaryDirectory() as tempdir:
+            with mock.patch('invirtualenv.wheelhouse.toolchain_inventory') as inventory:
+                inventory.return_value.executable.return_value = '/usr/bin/ccache'
+                env = wheelhouse.compiler_cache_environment('ccache', max_size=100, env={'CC': 'gcc -pthread', 'CXX': 'ccache g++'})
+            self.assertEqual(env['CCACHE_DIR'], os.path.join(tempdir, 'ccache'))
+            self.assertTrue(os.path.isdir(env['CCACHE_DIR']))
+            self.assertEqual(env['CCACHE_MAXSIZE'], '100M')
+            self.assertEqual(env['CC'], '/usr/bin/ccache gcc -pthread')
+            self.assertEqual(env['CXX'], 'ccache g++')
+            # cmake uses the wrapped CC and CXX, so the launchers would run ccache twice
+            self.assertNotIn('CMAKE_C_COMPILER_LAUNCHER', env)
+            self.assertNotIn('CMAKE_CXX_COMPILER_LAUNCHER', env)
+
+    def test__compiler_cache_environment__launcher_set(self):
+        with InTemporaryDirectory():
+            with mock.patch('invirtualenv.wheelhouse.toolchain_inventory') as inventory:
+                inventory.return_value.executable.return_value = '/usr/bin/ccache'
+                env = wheelhouse.compiler_cache_environment('ccache', env={'CC': 'gcc', 'CXX': 'g++', 'CMAKE_C_COMPILER_LAUNCHER': 'ccache'})
+            self.assertEqual(env['CC'], 'gcc')
+            self.assertEqual(env['CXX'], '/usr/bin/ccache g++')
+
+    def test__compiler_cache_environment__disabled(self):
+        self.assertEqual(wheelhouse.compiler_cache_environment('', env={'A': 'b'}), {'A': 'b'})
+        with mock.patch('invirtualenv.wheelhouse.toolchain_inventory') as inventory:
+            inventory.return_value.executable.return_value = None
+            self.assertEqual(wheelhouse.compiler_cache_environment('/tmp/ccache', env={'A': 'b'}), {'A': 'b'})
+
+    def test__build_wheels__divides_jobs(self):
+        with mock.patch.dict(os.environ, {}, clear=True):
+            with mock.patch('invirtualenv.wheelhouse.build_wheel', return_value=True) as mock_build_wheel:
+                wheelhouse.build_wheels(['pip'], ['a.tar.gz', 'b.tar.gz'], max_workers=4, jobs=8)
+        self.assertEqual({call[1]['env']['MAX_JOBS'] for call in mock_build_wheel.call_args_list}, {'4'})
+
+    def test__requirement_chunks(self):
+        self.assertEqual(wheelhouse.requirement_chunks(['a', 'b', 'a', 'c'], chunk_size=2), [['a', 'b'], ['c']])
+        self.assertEqual(wheelhouse.requirement_chunks([]), [])
+
+    def test__package_requirement(self):
+        self.assertEqual(wheelhouse.package_requirement('wheels/six-1.16.0-py2.py3-none-any.whl'), ('six', '1.16.0'))
+        self.assertEqual(wheelhouse.package_requirement('my-package-1.0.tar.gz'), ('my-package', '1.0'))
+        self.assertEqual(wheelhouse.package_requirement('package.zip'), ('package', None))
+
+    def test__source_packages(self):
+        with InTemporaryDirectory():
+            for filename in ['a-1.0.tar.gz', 'b-1.0.zip', 'c-1.0-py3-none-any.whl']:
+                open(filename, 'w').close()
+            self.assertEqual(wheelhouse.source_packages('.'), ['./a-1.0.tar.gz', './b-1.0.zip'])
+
+
+def fake_pip_bulk(cmd, **kwargs):
+    """
+    Stand in for pip download that downloads a wheel for every requirement
+    """
+    fake_pip_bulk.argv_lengths.append(len(' '.join(cmd)))
+    directory = cmd[cmd.index('-d') + 1]
+    for requirement in pip_requirements(cmd):
+        name, version = requirement.split('==')
+        open(os.path.join(directory, '{0}-{1}-py3-none-any.whl'.format(name, version)), 'w').close()
+    return b''
+
+
+class TestWheelhouseScale(unittest.TestCase):
+    requirements = ['package{0}==1.0'.format(number) for number in range(5000)]
+
+    def setUp(self):
+        fake_pip_bulk.argv_lengths = []
+
+    def test__build_wheelhouse__5k_pinned(self):
+        with InTemporaryDirectory():
+            with mock.patch('invirtualenv.wheelhouse.subprocess.check_output', side_effect=fake_pip_bulk) as check_output:
+                self.assertEqual(wheelhouse.build_wheelhouse(['pip'], [], '.', pinned=self.requirements, max_workers=4), [])
+            self.assertEqual(check_output.call_count, 5000 // wheelhouse.REQUIREMENTS_CHUNK_SIZE)
+            self.assertLess(max(fake_pip_bulk.argv_lengths), 200)
+            self.assertEqual(len(wheelhouse.wheel_files('.')), 5000)
+
+    def test__build_wheelhouse__5k_resolved(self):
+        with InTemporaryDirectory():
+            with mock.patch('invirtualenv.wheelhouse.subprocess.check_output', side_effect=fake_pip_bulk) as check_output:
+                wheelhouse.build_wheelhouse(['pip'], self.requirements, '.')
+            self.assertEqual(check_output.call_count, 1)
+            self.assertLess(max(fake_pip_bulk.argv_lengths), 200)
+            self.assertEqual(len(wheelhouse.wheel_files('.')), 5000)
+
+
+class TestWheelCache(unittest.TestCase):
+    def test__build_wheelhouse__uses_cache(self):
+        with InTemporaryDirectory() as tempdir:
+            cache = wheelhouse.WheelCache(directory=os.path.join(tempdir, 'cache'))
+            os.makedirs(cache.directory)
+            os.makedirs('first')
+            with mock.patch('invirtualenv.wheelhouse.subprocess.check_output', side_effect=fake_pip) as check_output:
+                wheelhouse.build_wheelhouse(['pip'], ['compiled'], 'first', wheel_cache=cache)
+            self.assertIn(['--find-links', cache.directory], [
+                call[0][0][4:6] for call in check_output.call_args_list
+            ])
+            self.assertEqual(cache.wheels(), ['compiled-2.0-cp3-cp3-linux_x86_64.whl', 'ready-1.0-py3-none-any.whl'])
+
+    def test__add__touches_cached_wheel(self):
+        with InTemporaryDirectory() as tempdir:
+            cache = wheelhouse.WheelCache(directory=os.path.join(tempdir, 'cache'))
+            os.makedirs(cache.directory)
+            with open('a-1.0-py3-none-any.whl', 'w') as file_handle:
+                file_handle.write('a')
+            cache.add('a-1.0-py3-none-any.whl')
+            cached_filename = os.path.join(cache.directory, 'a-1.0-py3-none-any.whl')
+            os.utime(cached_filename, (1, 1))
+            cache.add('a-1.0-py3-none-any.whl')
+            self.assertGreater(os.stat(cached_filename).st_mtime, 1)
+
+    def test__prune__least_recently_used(self):
+        with InTemporaryDirectory() as tempdir:
+            cache = wheelhouse.WheelCache(directory=tempdir, max_size=1)
+            for age, filename in enumerate(['old-1.0-py3-none-any.whl', 'new-1.0-py3-none-any.whl', 'newest-1.0-py3-none-any.whl']):
+                with open(filename, 'wb') as file_handle:
+                    file_handle.write(b'0' * 400 * 1024)
+                os.utime(filename, (age + 1, age + 1))
+            cache.prune()
+            self.assertEqual(cache.wheels(), ['new-1.0-py3-none-any.whl', 'newest-1.0-py3-none-any.whl'])
+
+    def test__key__separates_wheels(self):
+        with InTemporaryDirectory() as tempdir:
+            with open('a-1.0-py3-none-any.whl', 'w') as file_handle:
+                file_handle.write('a')
+            cache = wheelhouse.WheelCache(directory=tempdir, key=['1.0', ['23.0', '67.0', '0.40.0']])
+            self.assertEqual(cache.pip_args(), [])
+            cache.add('a-1.0-py3-none-any.whl')
+            self.assertEqual(cache.wheels(), ['a-1.0-py3-none-any.whl'])
+            self.assertEqual(wheelhouse.WheelCache(directory=tempdir, key=['1.0', ['23.0', '67.0', '0.40.0']]).directory, cache.directory)
+            other = wheelhouse.WheelCache(directory=tempdir, key=['1.1', ['23.0', '67.0', '0.40.0']])
+            self.assertNotEqual(other.directory, cache.directory)
+            self.assertEqual(other.wheels(), [])
+
+    def test__prune__all_keys(self):
+        with InTemporaryDirectory() as tempdir:
+            old = wheelhouse.WheelCache(directory=os.path.join(tempdir, 'cache'), key=['1.0'])
+            new = wheelhouse.WheelCache(directory=os.path.join(tempdir, 'cache'), key=['1.1'], max_size=1)
+            for age, (cache, filename) in enumerate([(old, 'old-1.0-py3-none-any.whl'), (new, 'new-1.0-py3-none-any.whl'), (new, 'newest-1.0-py3-none-any.whl')]):
+                with open(filename, 'wb') as file_handle:
+                    file_handle.write(b'0' * 400 * 1024)
+                cache.add(filename)
+                os.utime(os.path.join(cache.directory, filename), (age + 1, age + 1))
+            new.prune()
+            self.assertEqual(old.wheels(), [])
+            self.assertEqual(new.wheels(), ['new-1.0-py3-none-any.whl', 'newest-1.0-py3-none-any.whl'])
+
+    def test__disabled(self):
+        with mock.patch.dict(os.environ, {'INVIRTUALENV_NO_CACHE': 'true'}):
+            cache = wheelhouse.WheelCache()
+        self.assertEqual(cache.pip_args(), [])
+        self.assertEqual(cache.wheels(), [])
+
+
+class TestWheelArchive(unittest.TestCase):
+    def create_wheels(self):
+        os.makedirs(os.path.join('wheels', 'sub'))
+        for filename in ['b-1.0-py3-none-any.whl', 'a-1.0-py3-none-any.whl', os.path.join('sub', 'c.txt')]:
+            with open(os.path.join('wheels', filename), 'w') as file_handle:
+                file_handle.write(filename)
+
+    def test__write_archive(self):
+        for compression in ['store', 'gz', 'xz']:
+            with InTemporaryDirectory():
+                self.create_wheels()
+                filename = wheelhouse.archive_filename('wheels', compression)
+                self.assertEqual(wheelhouse.write_archive(filename, 'wheels', compression=compression), compression)
+                with tarfile.open(filename) as archive:
+                    self.assertEqual(archive.getnames(), [
+                        'wheels', 'wheels/a-1.0-py3-none-any.whl', 'wheels/b-1.0-py3-none-any.whl', 'wheels/sub', 'wheels/sub/c.txt'
+                    ])
+                    self.assertEqual(archive.extractfile('wheels/sub/c.txt').read(), os.path.join('sub', 'c.txt').encode())
+
+    def test__write_archive__compression(self):
+        with InTemporaryDirectory():
+            self.create_wheels()
+            wheelhouse.write_archive('wheels.tar.gz', 'wheels', compression='gz')
+            with open('wheels.tar.gz', 'rb') as archive_handle:
+                self.assertEqual(archive_handle.read(2), b'\x1f\x8b')
+            wheelhouse.write_archive('wheels.tar.xz', 'wheels', compression='xz')
+            with open('wheels.tar.xz', 'rb') as archive_handle:
+                self.assertEqual(archive_handle.read(6), b'\xfd7zXZ\x00')
+
+    def test__write_archive__reproducible(self):
+        for compression in ['store', 'gz', 'xz']:
+            with InTemporaryDirectory():
+                self.create_wheels()
+                filename = wheelhouse.archive_filename('wheels', compression)
+                wheelhouse.write_archive(filename, 'wheels', compression=compression, mtime=1000)
+                with open(filename, 'rb') as archive_handle:
+                    first = archive_handle.read()
+                os.utime(os.path.join('wheels', 'sub', 'c.txt'), (5000, 5000))
+                wheelhouse.write_archive(filename, 'wheels', compression=compression, mtime=1000)
+                with open(filename, 'rb') as archive_handle:
+                    self.assertEqual(archive_handle.read(), first)
+                with tarfile.open(filename) as archive:
+                    self.assertEqual({member.mtime for member in archive.getmembers()}, {1000})
+
+    def test__archive_compression__zstd_fallback(self):
+        with mock.patch('invirtualenv.wheelhouse.zstd_available', return_value=False):
+            self.assertEqual(wheelhouse.archive_compression('zstd'), 'gz')
+
+    def test__archive_compression__invalid(self):
+        with self.assertRaises(ValueError):
+            wheelhouse.archive_compression('bzip3')
+
+
+if __name__ == '__main__':
+    unittest.main()